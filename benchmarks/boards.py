@@ -0,0 +1,81 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+#
+# Timing of `AtmelavrPlatform.get_boards()`:
+#   cold - no board index, every manifest is parsed and enriched
+#   warm - new platform instance restored from the board index
+#   hot  - repeated call on the same platform instance
+#
+# Usage: python benchmarks/boards.py [--rounds N]
+#
+
+import argparse
+import os
+import time
+
+from platformio.platform.factory import PlatformFactory
+
+PLATFORM_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(func, rounds):
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return min(timings) * 1000, sum(timings) / len(timings) * 1000
+
+
+def remove_index():
+    platform = PlatformFactory.new(PLATFORM_DIR)
+    path = platform._get_board_index_path()  # pylint: disable=protected-access
+    if os.path.isfile(path):
+        os.remove(path)
+
+
+def cold():
+    remove_index()
+    started = time.perf_counter()
+    PlatformFactory.new(PLATFORM_DIR).get_boards()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rounds", type=int, default=10)
+    args = parser.parse_args()
+
+    results = {}
+    timings = [cold() for _ in range(args.rounds)]
+    results["cold"] = (min(timings) * 1000, sum(timings) / len(timings) * 1000)
+    results["warm"] = measure(
+        lambda: PlatformFactory.new(PLATFORM_DIR).get_boards(), args.rounds
+    )
+    platform = PlatformFactory.new(PLATFORM_DIR)
+    platform.get_boards()
+    results["hot"] = measure(platform.get_boards, args.rounds)
+    results["find_boards"] = measure(
+        lambda: platform.find_boards(mcu="atmega328p", f_cpu="16000000L"),
+        args.rounds,
+    )
+
+    print("Boards: %d" % len(platform.get_boards()))
+    for name, (best, mean) in results.items():
+        print("%-12s best %8.2f ms  mean %8.2f ms" % (name, best, mean))
+
+
+if __name__ == "__main__":
+    main()
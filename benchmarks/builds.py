@@ -0,0 +1,323 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+#
+# Build times of the projects in examples/ over a board matrix:
+#   cold    - wall time of a build from an empty build directory
+#   warm    - wall time of the next, up-to-date, build
+#   startup - SConscript execution time (SCons startup) of the cold build
+#   steps   - per-target command time and spawned processes (`-j 1` build)
+#
+# Each project is copied to a work directory and gets a `bench_<board>`
+# environment extending its first one, built with this platform checkout.
+# Results are compared with a stored baseline, regressions over the
+# threshold make the script exit with 1.
+#
+# Usage: python benchmarks/builds.py [--boards uno,...] [--examples name,...]
+#                                    [--rounds N] [--offline] [--save]
+#
+
+import argparse
+import configparser
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from platformio.platform.factory import PlatformFactory
+
+PLATFORM_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXAMPLES_DIR = os.path.join(PLATFORM_DIR, "examples")
+BASELINE_PATH = os.path.join(PLATFORM_DIR, "benchmarks", "builds.baseline.json")
+
+# One board per core
+DEFAULT_BOARDS = (
+    "uno",  # arduino
+    "ATmega328P",  # MiniCore
+    "ATmega2560",  # MegaCore
+    "ATmega1284P",  # MightyCore
+    "ATmega8515",  # MajorCore
+    "attiny13",  # MicroCore
+    "attiny85",  # tiny
+    "digispark-tiny",  # digistump
+)
+
+# Options of the example environment which are replaced by the board
+BOARD_OPTIONS_RE = re.compile(r"^(platform|board|upload_)")
+
+STEP_RE = re.compile(r"^Command execution time: (.+): ([\d.]+) seconds$")
+STARTUP_RE = re.compile(r"^Total SConscript file execution time: ([\d.]+) seconds$")
+SPAWN_RE = re.compile(
+    r"^\"?(?:\S*[/\\])?(avr-[\w+-]+|avrdude|micronucleus|ccache|sccache|"
+    r"python[\d.]*)(?:\.exe)?\"?\s"
+)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--boards", default=",".join(DEFAULT_BOARDS))
+    parser.add_argument("--examples", help="comma separated names, all by default")
+    parser.add_argument("--examples-dir", default=EXAMPLES_DIR)
+    parser.add_argument("--work-dir", help="kept between runs when given")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="skip builds which need packages that are not installed",
+    )
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save", action="store_true", help="store as the baseline")
+    parser.add_argument(
+        "--threshold", type=float, default=10.0, help="regression limit, percent"
+    )
+    return parser.parse_args()
+
+
+def list_examples(examples_dir, names=None):
+    result = []
+    for name in sorted(os.listdir(examples_dir)):
+        if names and name not in names:
+            continue
+        if os.path.isfile(os.path.join(examples_dir, name, "platformio.ini")):
+            result.append(name)
+    return result
+
+
+def read_base_environment(project_dir):
+    config = configparser.ConfigParser(interpolation=None)
+    config.read(os.path.join(project_dir, "platformio.ini"))
+    for section in config.sections():
+        if section.startswith("env:"):
+            return {
+                key: value
+                for key, value in config.items(section)
+                if not BOARD_OPTIONS_RE.match(key)
+            }
+    return {}
+
+
+def prepare_project(example_dir, project_dir, boards, extra_options=None):
+    """Copies the example and appends one `bench_<board>` environment per
+    board. Returns the environment names by board."""
+    if os.path.isdir(project_dir):
+        shutil.rmtree(os.path.join(project_dir, "src"), ignore_errors=True)
+    shutil.copytree(
+        example_dir,
+        project_dir,
+        ignore=shutil.ignore_patterns(".pio"),
+        dirs_exist_ok=True,
+    )
+    options = read_base_environment(example_dir)
+    options.update(extra_options or {})
+    environments = {}
+    with open(os.path.join(project_dir, "platformio.ini"), "a", encoding="utf8") as fp:
+        for board in boards:
+            name = "bench_%s" % re.sub(r"\W", "_", board)
+            fp.write(
+                "\n[env:%s]\nplatform = %s\nboard = %s\n" % (name, PLATFORM_DIR, board)
+            )
+            for key, value in options.items():
+                fp.write("%s = %s\n" % (key, value.replace("\n", "\n  ")))
+            environments[board] = name
+    return environments
+
+
+def get_missing_packages(board, frameworks):
+    platform = PlatformFactory.new(PLATFORM_DIR)
+    platform.configure_default_packages(
+        dict(pioenv="bench", board=board, framework=frameworks), ["buildprog"]
+    )
+    return [
+        name
+        for name, options in platform.packages.items()
+        if not options.get("optional") and not platform.get_package_dir(name)
+    ]
+
+
+def run_build(project_dir, environment, extra_args=None, env=None):
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-m", "platformio", "run", "-d", project_dir]
+        + ["-e", environment]
+        + (extra_args or []),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        env=env,
+        check=False,
+        universal_newlines=True,
+        errors="replace",
+    )
+    return result.returncode, time.perf_counter() - started, result.stdout
+
+
+def parse_steps(output):
+    """Splits the output of a verbose `-j 1` build with SCons `--debug=time`
+    into per-target command times and spawned processes"""
+    steps = {}
+    startup = None
+    processes = 0
+    pending = 0
+    for line in output.splitlines():
+        if SPAWN_RE.match(line):
+            pending += 1
+            continue
+        match = STEP_RE.match(line)
+        if match:
+            steps[match.group(1)] = dict(
+                seconds=float(match.group(2)), processes=pending
+            )
+            processes += pending
+            pending = 0
+            continue
+        match = STARTUP_RE.match(line)
+        if match:
+            startup = float(match.group(1))
+    return dict(startup=startup, processes=processes, steps=steps)
+
+
+def benchmark(project_dir, environment, rounds, env):
+    build_dir = os.path.join(project_dir, ".pio", "build", environment)
+    cold = []
+    warm = []
+    for _ in range(rounds):
+        shutil.rmtree(build_dir, ignore_errors=True)
+        returncode, elapsed, output = run_build(project_dir, environment, env=env)
+        if returncode != 0:
+            return dict(status="failed", output=output.splitlines()[-20:])
+        cold.append(elapsed)
+        warm.append(run_build(project_dir, environment, env=env)[1])
+
+    shutil.rmtree(build_dir, ignore_errors=True)
+    returncode, _, output = run_build(
+        project_dir,
+        environment,
+        ["-v", "-j", "1"],
+        env=dict(env, SCONSFLAGS="--debug=time"),
+    )
+    result = dict(status="ok", cold=min(cold), warm=min(warm))
+    if returncode == 0:
+        result.update(parse_steps(output))
+    return result
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for key, result in sorted(results.items()):
+        previous = baseline.get(key)
+        if result["status"] != "ok" or not previous or previous["status"] != "ok":
+            continue
+        for metric in ("cold", "warm", "startup", "processes"):
+            if not result.get(metric) or not previous.get(metric):
+                continue
+            change = (result[metric] - previous[metric]) / previous[metric] * 100
+            if change > threshold:
+                regressions.append((key, metric, previous[metric], result[metric]))
+            result.setdefault("change", {})[metric] = round(change, 1)
+    return regressions
+
+
+def print_results(results):
+    print(
+        "%-40s %8s %8s %8s %6s  %s"
+        % ("project/board", "cold s", "warm s", "start s", "procs", "change %")
+    )
+    for key, result in sorted(results.items()):
+        if result["status"] != "ok":
+            print("%-40s %s" % (key, result["status"]))
+            continue
+        print(
+            "%-40s %8.2f %8.2f %8s %6s  %s"
+            % (
+                key,
+                result["cold"],
+                result["warm"],
+                "%.2f" % result["startup"] if result.get("startup") else "-",
+                result.get("processes", "-"),
+                " ".join(
+                    "%s %+.1f" % item
+                    for item in sorted(result.get("change", {}).items())
+                ),
+            )
+        )
+
+
+def main():
+    args = parse_args()
+    boards = [board.strip() for board in args.boards.split(",") if board.strip()]
+    examples = list_examples(
+        args.examples_dir, args.examples.split(",") if args.examples else None
+    )
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="atmelavr-bench-")
+    env = dict(os.environ, PLATFORMIO_SETTING_ENABLE_TELEMETRY="No")
+    if args.offline:
+        env["PLATFORMIO_SETTING_CHECK_PLATFORMIO_INTERVAL"] = "9999"
+
+    results = {}
+    try:
+        for example in examples:
+            example_dir = os.path.join(args.examples_dir, example)
+            project_dir = os.path.join(work_dir, example)
+            environments = prepare_project(example_dir, project_dir, boards)
+            frameworks = [
+                item.strip()
+                for item in read_base_environment(example_dir)
+                .get("framework", "")
+                .split(",")
+                if item.strip()
+            ]
+            for board, environment in environments.items():
+                key = "%s/%s" % (example, board)
+                missing = get_missing_packages(board, frameworks)
+                if args.offline and missing:
+                    results[key] = dict(
+                        status="skipped, missing %s" % ", ".join(missing)
+                    )
+                else:
+                    results[key] = benchmark(
+                        project_dir, environment, args.rounds, env
+                    )
+                print("%s: %s" % (key, results[key]["status"]), file=sys.stderr)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    baseline = {}
+    if os.path.isfile(args.baseline):
+        with open(args.baseline, encoding="utf8") as fp:
+            baseline = json.load(fp)
+    regressions = compare(results, baseline, args.threshold)
+    print_results(results)
+
+    if args.save:
+        for key, result in results.items():
+            if result["status"] == "ok":
+                result.pop("change", None)
+                baseline[key] = result
+        with open(args.baseline, "w", encoding="utf8") as fp:
+            json.dump(baseline, fp, indent=2, sort_keys=True)
+        print("Baseline saved to %s" % args.baseline)
+
+    if regressions:
+        print("\nRegressions over %.0f%%:" % args.threshold)
+        for key, metric, previous, current in regressions:
+            print("  %s %s: %.2f -> %.2f" % (key, metric, previous, current))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
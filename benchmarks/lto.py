@@ -0,0 +1,140 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+#
+# Link time and program size of serial and parallel LTO
+# (`board_build.lto_jobs`) for the examples on ATmega2560 boards. Only the
+# link is repeated, the objects of each mode are compiled once.
+#
+# Usage: python benchmarks/lto.py [--boards megaatmega2560,...] [--jobs N]
+#                                 [--examples name,...] [--rounds N]
+#
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+from builds import (
+    EXAMPLES_DIR,
+    list_examples,
+    parse_steps,
+    prepare_project,
+    run_build,
+)
+
+DEFAULT_BOARDS = ("megaatmega2560", "ATmega2560")
+
+
+def link(project_dir, environment, jobs, env):
+    build_dir = os.path.join(project_dir, ".pio", "build", environment)
+    program_path = os.path.join(build_dir, "firmware.elf")
+    if os.path.isfile(program_path):
+        os.remove(program_path)
+    returncode, _, output = run_build(
+        project_dir,
+        environment,
+        ["-v", "-j", str(jobs)],
+        env=dict(env, SCONSFLAGS="--debug=time"),
+    )
+    if returncode != 0:
+        return None
+    steps = parse_steps(output)["steps"]
+    seconds = [
+        step["seconds"]
+        for target, step in steps.items()
+        if target.endswith("firmware.elf")
+    ]
+    with open(os.path.join(build_dir, "size.json"), encoding="utf8") as fp:
+        size = json.load(fp)["program"]["size"]
+    return dict(seconds=seconds[0] if seconds else None, size=size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--boards", default=",".join(DEFAULT_BOARDS))
+    parser.add_argument("--examples", help="comma separated names, all by default")
+    parser.add_argument("--examples-dir", default=EXAMPLES_DIR)
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    boards = [board.strip() for board in args.boards.split(",") if board.strip()]
+    work_dir = tempfile.mkdtemp(prefix="atmelavr-lto-")
+    env = dict(os.environ, PLATFORMIO_SETTING_ENABLE_TELEMETRY="No")
+    print(
+        "%-40s %9s %9s %8s %8s %8s"
+        % (
+            "project/board",
+            "serial s",
+            "jobs=%d s" % args.jobs,
+            "speedup",
+            "serial B",
+            "delta B",
+        )
+    )
+    try:
+        for example in list_examples(
+            args.examples_dir, args.examples.split(",") if args.examples else None
+        ):
+            projects = {}
+            for mode, lto_jobs in (("serial", "no"), ("parallel", args.jobs)):
+                project_dir = os.path.join(work_dir, example, mode)
+                projects[mode] = (
+                    project_dir,
+                    prepare_project(
+                        os.path.join(args.examples_dir, example),
+                        project_dir,
+                        boards,
+                        {"board_build.lto_jobs": str(lto_jobs)},
+                    ),
+                )
+            for board in boards:
+                key = "%s/%s" % (example, board)
+                results = {}
+                for mode, (project_dir, environments) in projects.items():
+                    timings = []
+                    for _ in range(args.rounds):
+                        result = link(
+                            project_dir, environments[board], args.jobs, env
+                        )
+                        if not result or result["seconds"] is None:
+                            break
+                        timings.append(result["seconds"])
+                    if timings:
+                        results[mode] = dict(result, seconds=min(timings))
+                if len(results) != 2:
+                    print("%-40s failed" % key)
+                    continue
+                serial, parallel = results["serial"], results["parallel"]
+                print(
+                    "%-40s %9.3f %9.3f %7.2fx %8d %+8d"
+                    % (
+                        key,
+                        serial["seconds"],
+                        parallel["seconds"],
+                        serial["seconds"] / max(parallel["seconds"], 1e-6),
+                        serial["size"],
+                        parallel["size"] - serial["size"],
+                    )
+                )
+                sys.stdout.flush()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+#
+# Index of prebuilt Optiboot and Urboot images shipped in the `bootloaders`
+# folder of the MiniCore family of Arduino cores.
+#
+# The tree is scanned once per framework package version, image parameters
+# are parsed from the file layout and the result is kept on disk.
+#
+
+import json
+import os
+import re
+from functools import lru_cache
+
+INDEX_FORMAT = 1
+PARAMETERS = ("mcu", "f_cpu", "speed", "uart", "oscillator", "uart_pins", "led")
+NUMERIC_PARAMETERS = ("f_cpu", "speed")
+
+LAYOUTS = (
+    (
+        "optiboot",
+        re.compile(
+            r"^optiboot_flash/bootloaders/(?P<mcu>[^/]+)/(?P<f_cpu>\d+)L/"
+            r"optiboot_flash_(?P=mcu)_(?P<uart>UART\d)_(?P<speed>\d+)_(?P=f_cpu)L_"
+            r"(?P<led>[^/_]*?)(?P<bigboot>_BIGBOOT)?\.hex$",
+            re.IGNORECASE,
+        ),
+    ),
+    (
+        "urboot",
+        re.compile(
+            r"^urboot/watchdog_1_s/(?P<oscillator>[^/]+)_oscillator/"
+            r"(?P<f_cpu>\d+)_hz/(?P<speed>\d+)_baud/(?P<uart_pins>[^/]+)/"
+            r"(?P<led>[^/]+)/urboot_(?P<mcu>attiny13a)\.hex$"
+        ),
+    ),
+    (
+        "urboot",
+        re.compile(
+            r"^urboot/(?P<mcu>[^/]+)/watchdog_1_s/(?P<oscillator>[^/]+)_oscillator/"
+            r"(?P<f_cpu>\d+)_hz/(?P<speed>\d+)_baud/(?P<uart_pins>[^/]+)/"
+            r"(?P<led>[^/]+)/urboot_(?P=mcu)_pr_ee_ce\.hex$"
+        ),
+    ),
+    (
+        "urboot",
+        re.compile(
+            r"^urboot/(?P<mcu>[^/]+)/watchdog_1_s/(?P<speed>autobaud)/"
+            r"(?P<uart_pins>[^/]+)/(?P<led>[^/]+)/urboot_(?P=mcu)_pr_ee_ce\.hex$"
+        ),
+    ),
+)
+
+
+def normalize(params):
+    result = {}
+    for name in PARAMETERS:
+        value = params.get(name)
+        if value is None:
+            result[name] = None
+        elif name == "f_cpu":
+            result[name] = int(str(value).upper().strip("UL"))
+        else:
+            result[name] = str(value).lower()
+    return result
+
+
+def parse_path(path):
+    """Returns `(family, params, bigboot)` for a path relative to the
+    `bootloaders` folder or None for unknown layouts"""
+    for family, pattern in LAYOUTS:
+        match = pattern.match(path)
+        if match:
+            params = match.groupdict()
+            bigboot = bool(params.pop("bigboot", None))
+            return family, normalize(params), bigboot
+    return None
+
+
+class BootloaderIndex:
+    def __init__(self, root, entries):
+        self.root = root
+        self.entries = entries
+        self._keys = {}
+        for entry in sorted(entries, key=lambda item: item["bigboot"]):
+            self._keys.setdefault(self._make_key(entry["family"], entry), entry)
+
+    @staticmethod
+    def _make_key(family, params):
+        return (family,) + tuple(params.get(name) for name in PARAMETERS)
+
+    @classmethod
+    def scan(cls, root):
+        entries = []
+        for dirpath, _, filenames in os.walk(root):
+            for filename in filenames:
+                if not filename.lower().endswith(".hex"):
+                    continue
+                path = os.path.relpath(os.path.join(dirpath, filename), root)
+                path = path.replace(os.sep, "/")
+                parsed = parse_path(path)
+                if not parsed:
+                    continue
+                family, params, bigboot = parsed
+                entries.append(dict(params, family=family, bigboot=bigboot, path=path))
+        return cls(root, sorted(entries, key=lambda item: item["path"]))
+
+    def get_path(self, entry):
+        return os.path.join(self.root, *entry["path"].split("/"))
+
+    def lookup(self, family, **params):
+        """Returns the image path for exactly these parameters. Optiboot
+        images without the `_BIGBOOT` suffix take precedence."""
+        entry = self._keys.get(self._make_key(family, normalize(params)))
+        return self.get_path(entry) if entry else None
+
+    def nearest(self, family, limit=3, **params):
+        """Returns up to `limit` `(entry, differences)` of the same MCU, where
+        `differences` maps a parameter to its available value. Numeric
+        parameters are ranked by relative distance to the requested value."""
+        params = normalize(params)
+        ranked = []
+        for entry in self.entries:
+            if entry["family"] != family or entry["mcu"] != params["mcu"]:
+                continue
+            score = 0.0
+            differences = {}
+            for name in PARAMETERS:
+                wanted = params[name]
+                if wanted is None or entry[name] == wanted:
+                    continue
+                differences[name] = entry[name]
+                if (
+                    name in NUMERIC_PARAMETERS
+                    and str(wanted).isdigit()
+                    and str(entry[name]).isdigit()
+                ):
+                    wanted, value = int(wanted), int(entry[name])
+                    score += abs(value - wanted) / max(value, wanted, 1)
+                else:
+                    score += 1
+            ranked.append((score, entry["bigboot"], entry["path"], entry, differences))
+        ranked.sort(key=lambda item: item[:3])
+        return [(item[3], item[4]) for item in ranked[:limit]]
+
+
+def get_package_version(framework_dir):
+    try:
+        with open(
+            os.path.join(framework_dir, "package.json"), encoding="utf8"
+        ) as fp:
+            return str(json.load(fp).get("version", ""))
+    except (OSError, ValueError):
+        return ""
+
+
+@lru_cache(maxsize=8)
+def _load_index(root, version, cache_path):
+    if cache_path and os.path.isfile(cache_path):
+        try:
+            with open(cache_path, encoding="utf8") as fp:
+                data = json.load(fp)
+            if (
+                data.get("format") == INDEX_FORMAT
+                and data.get("version") == version
+                and data.get("root") == root
+            ):
+                return BootloaderIndex(root, data["entries"])
+        except (OSError, ValueError, KeyError):
+            pass
+    index = BootloaderIndex.scan(root)
+    if cache_path:
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            with open(cache_path + ".tmp", "w", encoding="utf8") as fp:
+                json.dump(
+                    dict(
+                        format=INDEX_FORMAT,
+                        version=version,
+                        root=root,
+                        entries=index.entries,
+                    ),
+                    fp,
+                )
+            os.replace(cache_path + ".tmp", cache_path)
+        except OSError:
+            pass
+    return index
+
+
+def load_index(framework_dir, cache_dir=None):
+    """Returns the index of `<framework_dir>/bootloaders`. It is rebuilt when
+    the version in the package manifest changes."""
+    root = os.path.join(os.path.abspath(framework_dir), "bootloaders")
+    cache_path = None
+    if cache_dir:
+        cache_path = os.path.join(
+            cache_dir, "%s.json" % os.path.basename(os.path.dirname(root))
+        )
+    return _load_index(root, get_package_version(framework_dir), cache_path)
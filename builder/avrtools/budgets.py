@@ -0,0 +1,199 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+#
+# Size budgets and growth limits checked by `checkprogsize`.
+#
+#   board_build.size_budgets =
+#     .bss: 1200
+#     FrameworkArduino: 4 KB
+#     FrameworkArduino.ram: 200
+#   board_build.size_growth_limit = 256
+#   board_build.size_growth_percent = 2
+#
+# Budgets are set for a section (`.bss`), the program totals (`flash`,
+# `ram`) or the flash (`<library>`) and RAM (`<library>.ram`) of a library
+# as named by the size report. The growth limits in bytes and in percent
+# apply to every size stored in the baseline, which is written with
+# `pio run -t sizebaseline`.
+#
+# Section sizes come from the ELF section headers. Library sizes need the
+# link map and are only calculated when a budget or the baseline names a
+# library, they are cached in the build directory until the program changes.
+#
+
+import json
+import os
+import re
+
+from avrtools import elf, sizereport
+
+BASELINE_FORMAT = 1
+TOTALS = ("flash", "ram")
+RAM_SUFFIX = ".ram"
+
+SIZE_RE = re.compile(r"^(\d+(?:\.\d+)?)\s*(k|kb|kib|b)?$", re.IGNORECASE)
+
+
+def parse_size(value):
+    """Returns the bytes of `1200`, `4K` or `4 KB`"""
+    match = SIZE_RE.match(str(value).strip())
+    if not match:
+        raise ValueError("Invalid size `%s`" % value)
+    size = float(match.group(1))
+    if match.group(2) and match.group(2).lower().startswith("k"):
+        size *= 1024
+    return int(size)
+
+
+def parse_budgets(value):
+    """Returns the budgets of `name: size` items, one per line or comma
+    separated"""
+    if isinstance(value, (list, tuple)):
+        value = "\n".join(value)
+    budgets = {}
+    for item in re.split(r"[,\n]", str(value or "")):
+        item = item.strip()
+        if not item:
+            continue
+        name, separator, size = item.rpartition(":")
+        if not separator or not name.strip():
+            raise ValueError("Invalid size budget `%s`, expected `name: size`" % item)
+        budgets[name.strip()] = parse_size(size)
+    return budgets
+
+
+def parse_growth_limit(absolute, percent):
+    """Returns the `(bytes, percent)` growth limits, None for a missing one"""
+    absolute = parse_size(absolute) if str(absolute or "").strip() else None
+    if str(percent or "").strip():
+        try:
+            percent = float(str(percent).strip().rstrip("%"))
+        except ValueError as exc:
+            raise ValueError("Invalid growth limit `%s`" % percent) from exc
+    else:
+        percent = None
+    return absolute, percent
+
+
+def is_library_metric(name):
+    return not name.startswith(".") and name not in TOTALS
+
+
+def get_metrics(usage, libraries=None):
+    """Returns the sizes of the sections, the totals and the libraries"""
+    metrics = dict(usage["sections"])
+    metrics["flash"] = usage["program"]["size"]
+    metrics["ram"] = usage["data"]["size"]
+    for name, sizes in (libraries or {}).items():
+        flash, ram = sizereport.get_usage(sizes)
+        metrics[name] = flash
+        metrics[name + RAM_SUFFIX] = ram
+    return metrics
+
+
+def get_library_sizes(elf_path, map_path, project_dir, build_dir, cache_path):
+    """Returns the sizes per library, reused while the program is unchanged"""
+    key = [os.path.getmtime(elf_path), os.path.getsize(elf_path)]
+    try:
+        with open(cache_path, encoding="utf8") as fp:
+            cache = json.load(fp)
+        if cache["key"] == key:
+            return cache["libraries"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    report = sizereport.create_report(
+        elf.load_elf(elf_path), map_path, project_dir, build_dir, with_symbols=False
+    )
+    with open(cache_path, "w", encoding="utf8") as fp:
+        json.dump(dict(key=key, libraries=report["libraries"]), fp)
+    return report["libraries"]
+
+
+def load_baseline(path):
+    """Returns the sizes of the baseline or None"""
+    try:
+        with open(path, encoding="utf8") as fp:
+            baseline = json.load(fp)
+    except (OSError, ValueError):
+        return None
+    if baseline.get("format") != BASELINE_FORMAT:
+        return None
+    return baseline["sizes"]
+
+
+def save_baseline(path, metrics):
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf8") as fp:
+        json.dump(
+            dict(format=BASELINE_FORMAT, sizes=metrics), fp, indent=2, sort_keys=True
+        )
+
+
+def check_budgets(metrics, budgets):
+    """Returns `(name, size, budget)` of the exceeded budgets"""
+    return [
+        (name, metrics.get(name, 0), budget)
+        for name, budget in sorted(budgets.items())
+        if metrics.get(name, 0) > budget
+    ]
+
+
+def check_growth(metrics, baseline, absolute=None, percent=None):
+    """Returns `(name, old size, new size)` of the sizes that grew more than
+    `absolute` bytes or `percent` percent since the baseline"""
+    result = []
+    for name, old in sorted(baseline.items()):
+        new = metrics.get(name, 0)
+        delta = new - old
+        if delta <= 0:
+            continue
+        if (absolute is not None and delta > absolute) or (
+            percent is not None and (not old or 100.0 * delta / old > percent)
+        ):
+            result.append((name, old, new))
+    return result
+
+
+def format_growth(old, new):
+    delta = new - old
+    if not old:
+        return "+%d bytes" % delta
+    return "+%d bytes, %+.1f%%" % (delta, 100.0 * delta / old)
+
+
+def format_violations(exceeded, grown, absolute=None, percent=None):
+    lines = []
+    width = max([len(item[0]) for item in exceeded + grown] + [16])
+    for name, size, budget in exceeded:
+        lines.append(
+            "  %-*s %8d bytes, budget %d bytes (%+d bytes)"
+            % (width, name, size, budget, size - budget)
+        )
+    limits = " or ".join(
+        text
+        for text in (
+            "%d bytes" % absolute if absolute is not None else None,
+            "%g%%" % percent if percent is not None else None,
+        )
+        if text
+    )
+    for name, old, new in grown:
+        lines.append(
+            "  %-*s %8d bytes, baseline %d bytes (%s, limit %s)"
+            % (width, name, new, old, format_growth(old, new), limits)
+        )
+    return "\n".join(lines)
@@ -0,0 +1,207 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+#
+# Opt-in cache of compiled objects, enabled by `board_build.compiler_cache =
+# yes` (or a directory) in platformio.ini or by the
+# PLATFORMIO_ATMELAVR_COMPILER_CACHE environment variable.
+#
+# avr-gcc/avr-g++ invocations are intercepted in the SCons SPAWN hook. The
+# source is preprocessed with the same arguments and the object is looked up
+# under the hash of the preprocessed text, the arguments without the output
+# path and the compiler identity (toolchain version, path, size and mtime of
+# the executable). `-flto` objects hold the intermediate code of that very
+# compiler, `-mmcu` and the other flags are a part of the arguments.
+#
+# Objects whose compilation prints diagnostics are not stored, so warnings
+# are shown on every build.
+#
+
+import atexit
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+
+from avrtools import corecache
+
+CACHE_ENV_VAR = "PLATFORMIO_ATMELAVR_COMPILER_CACHE"
+CACHE_SIZE_ENV_VAR = "PLATFORMIO_ATMELAVR_COMPILER_CACHE_SIZE"
+DEFAULT_MAX_SIZE = 512 * 1024 * 1024
+KEY_FORMAT = 1
+
+COMPILER_RE = re.compile(r"(^|[/\\])avr-(gcc|g\+\+|c\+\+)(\.exe)?$")
+
+
+def _unquote(arg):
+    if len(arg) > 1 and arg[0] in "\"'" and arg[-1] == arg[0]:
+        return arg[1:-1]
+    return arg
+
+
+def parse_compile_command(args):
+    """Returns the index of the output path when `args` compiles a single
+    source to an object, otherwise None"""
+    if not args or not COMPILER_RE.search(_unquote(args[0])) or "-c" not in args:
+        return None
+    if any(arg.startswith("@") for arg in args) or "-" in args:
+        return None
+    if args.count("-o") != 1 or args.index("-o") + 1 >= len(args):
+        return None
+    return args.index("-o") + 1
+
+
+class CompilerCache:
+    def __init__(self, cache, toolchain_version):
+        self.cache = cache
+        self.toolchain_version = toolchain_version
+        self.stats = dict(hits=0, misses=0, uncacheable=0)
+        self._lock = threading.Lock()
+        self._compilers = {}
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def get_compiler_id(self, compiler, path):
+        if compiler not in self._compilers:
+            items = [self.toolchain_version, compiler]
+            executable = shutil.which(_unquote(compiler), path=path)
+            if executable:
+                stat = os.stat(executable)
+                items += [os.path.realpath(executable), stat.st_size, stat.st_mtime]
+            self._compilers[compiler] = "\0".join(str(item) for item in items)
+        return self._compilers[compiler]
+
+    def make_key(self, args, output_index, preprocessed_path, path):
+        digest = corecache._Digest()  # pylint: disable=protected-access
+        digest.update("%d\0" % KEY_FORMAT)
+        digest.update(self.get_compiler_id(args[0], path))
+        for index, arg in enumerate(args):
+            if index != output_index:
+                digest.update("\0" + arg)
+        digest.update(b"\0")
+        with open(preprocessed_path, "rb") as fp:
+            for chunk in iter(lambda: fp.read(65536), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def spawn(self, spawn, pspawn, sh, escape, cmd, args, env):
+        output_index = parse_compile_command(args)
+        if output_index is None:
+            return spawn(sh, escape, cmd, args, env)
+        target = _unquote(args[output_index])
+        fd, preprocessed_path = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(target)) or None, suffix=".i"
+        )
+        os.close(fd)
+        try:
+            preprocess_args = ["-E" if arg == "-c" else arg for arg in args]
+            preprocess_args[output_index] = escape(preprocessed_path)
+            with open(os.devnull, "w", encoding="utf8") as devnull:
+                returncode = pspawn(
+                    sh, escape, cmd, preprocess_args, env, devnull, devnull
+                )
+            if returncode != 0:
+                self._count("uncacheable")
+                return spawn(sh, escape, cmd, args, env)
+            key = self.make_key(
+                args, output_index, preprocessed_path, env.get("PATH")
+            )
+        finally:
+            os.remove(preprocessed_path)
+
+        if self.cache.get(key, target):
+            self._count("hits")
+            return 0
+
+        self._count("misses")
+        with tempfile.TemporaryFile("w+", encoding="utf8", errors="replace") as fp:
+            returncode = pspawn(sh, escape, cmd, args, env, fp, fp)
+            fp.seek(0)
+            diagnostics = fp.read()
+        if diagnostics:
+            sys.stderr.write(diagnostics)
+        if returncode == 0 and not diagnostics:
+            try:
+                self.cache.put(key, target, evict=False)
+            except OSError:
+                pass
+        return returncode
+
+    def report(self):
+        hits = self.stats["hits"]
+        total = hits + self.stats["misses"]
+        if not total:
+            return
+        text = "Compiler cache: %d hits, %d misses (%.0f%%)" % (
+            hits,
+            self.stats["misses"],
+            hits * 100.0 / total,
+        )
+        if self.stats["uncacheable"]:
+            text += ", %d uncacheable" % self.stats["uncacheable"]
+        print(text)
+
+
+def get_cache(env):
+    """Returns the cache configured for the environment or None"""
+    board = env.BoardConfig()
+    value = str(board.get("build.compiler_cache", os.getenv(CACHE_ENV_VAR, "")))
+    value = value.strip()
+    if value.lower() in ("", "0", "no", "false"):
+        return None
+    root = env.subst(os.path.join("$PROJECT_CORE_DIR", ".cache", "atmelavr-objects"))
+    if value.lower() not in ("1", "yes", "true"):
+        root = os.path.abspath(env.subst(value))
+    return CompilerCache(
+        corecache.ArchiveCache(
+            root,
+            corecache.parse_size(
+                board.get(
+                    "build.compiler_cache_size",
+                    os.getenv(CACHE_SIZE_ENV_VAR, DEFAULT_MAX_SIZE),
+                )
+            ),
+            suffix=".o",
+        ),
+        env.PioPlatform().get_package_version("toolchain-atmelavr"),
+    )
+
+
+def install(env):
+    """Routes compiler invocations of the environment through the cache,
+    statistics are printed and the cache is trimmed when SCons exits"""
+    compiler_cache = get_cache(env)
+    if not compiler_cache:
+        return None
+    spawn = env["SPAWN"]
+    pspawn = env["PSPAWN"]
+
+    def _spawn(sh, escape, cmd, args, env):  # pylint: disable=W0621
+        return compiler_cache.spawn(spawn, pspawn, sh, escape, cmd, args, env)
+
+    env.Replace(SPAWN=_spawn)
+
+    def _finish():
+        compiler_cache.report()
+        try:
+            compiler_cache.cache.evict()
+        except OSError:
+            pass
+
+    atexit.register(_finish)
+    return compiler_cache
@@ -0,0 +1,272 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+#
+# Content-addressed cache of prebuilt framework archives shared by all
+# projects, enabled by `board_build.core_cache = yes` (or a directory) in
+# platformio.ini or by the PLATFORMIO_ATMELAVR_CORE_CACHE environment
+# variable.
+#
+# An archive is stored under the hash of its sources, the final compiler
+# flags and include paths and the toolchain version. Entries are published by
+# an atomic rename, so readers need no lock; writers and eviction serialize
+# on a lock file. The least recently used entries are removed above the size
+# limit, `build.core_cache_size` or PLATFORMIO_ATMELAVR_CORE_CACHE_SIZE
+# (256MB).
+#
+
+import filecmp
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+CACHE_ENV_VAR = "PLATFORMIO_ATMELAVR_CORE_CACHE"
+CACHE_SIZE_ENV_VAR = "PLATFORMIO_ATMELAVR_CORE_CACHE_SIZE"
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+KEY_FORMAT = 2
+
+# Construction variables the archive objects are compiled with
+FLAG_VARIABLES = (
+    "_CPPDEFFLAGS",
+    "_CPPINCFLAGS",
+    "CCFLAGS",
+    "CFLAGS",
+    "CXXFLAGS",
+    "ASFLAGS",
+)
+
+
+def parse_size(value):
+    match = re.match(r"^\s*(\d+(?:\.\d+)?)\s*([KMG]?)B?\s*$", str(value), re.I)
+    if not match:
+        raise ValueError("Invalid cache size `%s`" % value)
+    factor = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+    return int(float(match.group(1)) * factor[match.group(2).upper()])
+
+
+def hash_tree(path, digest):
+    """Adds the relative path and the content of every file to `digest`"""
+    for root, dirs, files in os.walk(path):
+        dirs[:] = sorted(name for name in dirs if not name.startswith("."))
+        for name in sorted(files):
+            if name.startswith("."):
+                continue
+            file_path = os.path.join(root, name)
+            digest.update(os.path.relpath(file_path, path).replace(os.sep, "/"))
+            digest.update(b"\0")
+            with open(file_path, "rb") as fp:
+                for chunk in iter(lambda: fp.read(65536), b""):
+                    digest.update(chunk)
+            digest.update(b"\0")
+
+
+class _Digest:
+    def __init__(self):
+        self._hash = hashlib.sha256()
+
+    def update(self, data):
+        self._hash.update(data.encode() if isinstance(data, str) else data)
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+
+def make_key(name, source_dirs, flags, toolchain_version):
+    digest = _Digest()
+    digest.update("%d\0%s\0%s\0" % (KEY_FORMAT, name, toolchain_version))
+    for item in flags:
+        digest.update(item)
+        digest.update(b"\0")
+    for path in source_dirs:
+        hash_tree(path, digest)
+    return digest.hexdigest()
+
+
+class ArchiveCache:
+    def __init__(self, root, max_size=DEFAULT_MAX_SIZE, suffix=".a"):
+        self.root = root
+        self.max_size = max_size
+        self.suffix = suffix
+
+    def get_path(self, key):
+        return os.path.join(self.root, key[:2], key + self.suffix)
+
+    @contextmanager
+    def lock(self):
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, ".lock"), "a", encoding="utf8") as fp:
+            if fcntl:
+                fcntl.flock(fp, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(fp, fcntl.LOCK_UN)
+
+    def get(self, key, dest):
+        """Copies the entry to `dest`, returns False when it is not cached"""
+        path = self.get_path(key)
+        try:
+            # Recently used entries survive the eviction
+            os.utime(path)
+            if not os.path.isfile(dest) or not filecmp.cmp(path, dest, shallow=False):
+                _copy_file(path, dest)
+        except OSError:
+            return False
+        return True
+
+    def put(self, key, source, evict=True):
+        path = self.get_path(key)
+        with self.lock():
+            _copy_file(source, path)
+            if evict:
+                self._evict()
+
+    def evict(self):
+        with self.lock():
+            return self._evict()
+
+    def _evict(self):
+        entries = []
+        for root, _, files in os.walk(self.root):
+            for name in files:
+                if not name.endswith(self.suffix):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        removed = []
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed.append(path)
+        return removed
+
+
+def _copy_file(source, dest):
+    """Copies via a temporary file, a reader never sees a partial file"""
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(dest), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as fp, open(source, "rb") as src:
+            shutil.copyfileobj(src, fp)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, dest)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def get_cache(env):
+    """Returns the cache configured for the environment or None"""
+    board = env.BoardConfig()
+    value = str(board.get("build.core_cache", os.getenv(CACHE_ENV_VAR, ""))).strip()
+    if value.lower() in ("", "0", "no", "false"):
+        return None
+    root = env.subst(os.path.join("$PROJECT_CORE_DIR", ".cache", "atmelavr-cores"))
+    if value.lower() not in ("1", "yes", "true"):
+        root = os.path.abspath(env.subst(value))
+    return ArchiveCache(
+        root,
+        parse_size(
+            board.get(
+                "build.core_cache_size", os.getenv(CACHE_SIZE_ENV_VAR, DEFAULT_MAX_SIZE)
+            )
+        ),
+    )
+
+
+def build_library(env, cache, variant_dir, src_dir, toolchain_version, depends=()):
+    """Same as `env.BuildLibrary()`, the archive comes from the cache when
+    it was already built from the same sources and flags. `depends` lists
+    other directories the sources include headers from.
+
+    Only the archive node is returned here, it is fetched or built by
+    `build_libraries()` once the flags of the environment are final."""
+    name = os.path.basename(env.subst(variant_dir))
+    env.Append(
+        CORE_CACHE_LIBRARIES=[
+            (cache, variant_dir, src_dir, toolchain_version, tuple(depends))
+        ]
+    )
+    return env.File(
+        os.path.join(os.path.dirname(variant_dir), "${LIBPREFIX}%s${LIBSUFFIX}" % name)
+    )
+
+
+def build_libraries(env):
+    """Fetches or builds the archives of `build_library()`. Called after the
+    debug configuration and `build_unflags` were applied to `env`."""
+    for cache, variant_dir, src_dir, toolchain_version, depends in env.get(
+        "CORE_CACHE_LIBRARIES", []
+    ):
+        _build_library(
+            env, cache, variant_dir, src_dir, toolchain_version, list(depends)
+        )
+    env.Replace(CORE_CACHE_LIBRARIES=[])
+
+
+def get_flags(env):
+    """Returns the final flags of `env`, the project and build directories
+    are replaced by variables so that projects can share the entries"""
+    paths = [
+        (env.subst(variable), variable)
+        for variable in ("$BUILD_DIR", "$PROJECT_DIR")
+        if env.subst(variable)
+    ]
+    flags = []
+    for variable in FLAG_VARIABLES:
+        value = env.subst("$" + variable)
+        for path, replacement in paths:
+            value = value.replace(path, replacement)
+        flags.append(value)
+    return flags
+
+
+def _build_library(env, cache, variant_dir, src_dir, toolchain_version, depends):
+    name = os.path.basename(env.subst(variant_dir))
+    key = make_key(name, [src_dir] + depends, get_flags(env), toolchain_version)
+    archive = env.subst(
+        os.path.join(os.path.dirname(variant_dir), "${LIBPREFIX}%s${LIBSUFFIX}" % name)
+    )
+    if cache.get(key, archive):
+        return env.File(archive)
+
+    def _store(target, source, env):  # pylint: disable=W0613,W0621
+        try:
+            cache.put(key, target[0].get_abspath())
+        except OSError as exc:
+            print("Warning: Could not store %s in the core cache: %s" % (name, exc))
+
+    library = env.BuildLibrary(variant_dir, src_dir)
+    env.AddPostAction(library, env.VerboseAction(_store, "Caching $TARGET"))
+    return library
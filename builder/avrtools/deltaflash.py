@@ -0,0 +1,157 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+#
+# Page-level delta flashing.
+#
+# The last image written to a device is kept per (port, mcu). A new image is
+# compared with it page by page and only the dirty pages are passed to
+# avrdude, which skips flash pages without data in the input file. The
+# pages kept from the record are verified on the device before, every other
+# flash write drops the records of its port and MCU.
+#
+
+import json
+import os
+import re
+import time
+from os.path import isfile, join
+
+from avrtools import ihex
+
+# Protocols served by a bootloader which erases every page before writing it.
+# ISP programmers can not rewrite a page without a chip erase.
+DELTA_PROTOCOLS = ("arduino", "urclock", "wiring", "avr109", "butterfly")
+
+# Flash page size in bytes. Unknown parts use the largest AVR page, writing
+# bigger aligned blocks than needed is safe, writing smaller ones is not.
+DEFAULT_PAGE_SIZE = 256
+PAGE_SIZES = {
+    32: (
+        "attiny13 attiny13a attiny25 attiny24 attiny261 attiny2313 "
+        "attiny1634"
+    ).split(),
+    64: (
+        "atmega8 atmega8515 atmega8535 atmega48 atmega48p atmega48pb "
+        "atmega88 atmega88p atmega88pb attiny45 attiny85 attiny44 attiny84 "
+        "attiny461 attiny861 attiny48 attiny88 attiny4313 atmega8u2"
+    ).split(),
+    128: (
+        "atmega16 atmega32 atmega164a atmega164p atmega168 atmega168p "
+        "atmega168pb atmega165 atmega165a atmega165p atmega169 atmega169a "
+        "atmega169p atmega162 atmega324a atmega324p atmega324pa atmega324pb "
+        "atmega325 atmega325p atmega3250 atmega3250p atmega328 atmega328p "
+        "atmega328pb atmega329 atmega329p atmega3290 atmega3290p atmega32u4 "
+        "atmega16u2 atmega16u4 attiny87 attiny167"
+    ).split(),
+}
+
+
+def get_page_size(mcu):
+    for size, mcus in PAGE_SIZES.items():
+        if mcu.lower() in mcus:
+            return size
+    return DEFAULT_PAGE_SIZE
+
+
+def diff_pages(old_pages, new_pages, fill=0xFF):
+    """Returns sorted addresses of pages whose content differs. Pages which
+    disappeared from the new image are dirty unless they are already blank.
+    """
+    dirty = []
+    for page in sorted(set(old_pages) | set(new_pages)):
+        old = old_pages.get(page)
+        new = new_pages.get(page)
+        if new is None:
+            new = bytes([fill] * len(old))
+        if old != new:
+            dirty.append(page)
+    return dirty
+
+
+def build_delta(new_pages, dirty, page_size, fill=0xFF):
+    segments = []
+    for page in dirty:
+        data = new_pages.get(page, bytes([fill] * page_size))
+        if segments and segments[-1][0] + len(segments[-1][1]) == page:
+            segments[-1][1].extend(data)
+        else:
+            segments.append((page, bytearray(data)))
+    return segments
+
+
+class FlashRecordStore:
+    def __init__(self, root):
+        self.root = root
+
+    def _get_path(self, port, mcu):
+        name = re.sub(r"[^\w.-]+", "_", "%s_%s" % (port, mcu)).strip("_")
+        return join(self.root, name)
+
+    def load(self, port, mcu, page_size, max_age=None):
+        """Returns the recorded pages or None if the record is missing or stale"""
+        path = self._get_path(port, mcu)
+        if not isfile(path + ".json") or not isfile(path + ".hex"):
+            return None
+        try:
+            with open(path + ".json", encoding="utf8") as fp:
+                meta = json.load(fp)
+            if meta.get("mcu") != mcu or meta.get("page_size") != page_size:
+                return None
+            if max_age and time.time() - meta.get("timestamp", 0) > max_age:
+                return None
+            return ihex.to_pages(ihex.read_ihex(path + ".hex"), page_size)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, port, mcu, page_size, segments):
+        path = self._get_path(port, mcu)
+        os.makedirs(self.root, exist_ok=True)
+        ihex.write_ihex(path + ".hex", segments)
+        with open(path + ".json", "w", encoding="utf8") as fp:
+            json.dump(
+                dict(port=port, mcu=mcu, page_size=page_size, timestamp=time.time()),
+                fp,
+            )
+
+    def invalidate(self, port, mcu):
+        self._remove(self._get_path(port, mcu))
+
+    def invalidate_device(self, port=None, mcu=None):
+        """Removes the records of the device on `port` with `mcu`. Without a
+        port (ISP) all records of `mcu` are removed, without an MCU all
+        records of `port`."""
+        if not os.path.isdir(self.root):
+            return
+        for name in os.listdir(self.root):
+            if not name.endswith(".json"):
+                continue
+            path = join(self.root, name[:-5])
+            try:
+                with open(path + ".json", encoding="utf8") as fp:
+                    meta = json.load(fp)
+            except (OSError, ValueError):
+                meta = {}
+            if (
+                not meta
+                or (port is None or meta.get("port") == port)
+                and (mcu is None or meta.get("mcu") == mcu)
+            ):
+                self._remove(path)
+
+    @staticmethod
+    def _remove(path):
+        for ext in (".json", ".hex"):
+            if isfile(path + ext):
+                os.remove(path + ext)
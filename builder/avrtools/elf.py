@@ -0,0 +1,214 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+#
+# Minimal reader for 32-bit little-endian ELF files produced by avr-gcc
+#
+
+import os
+import struct
+from collections import namedtuple
+from functools import lru_cache
+
+SHT_SYMTAB = 2
+SHT_NOBITS = 8
+SHF_ALLOC = 0x2
+PT_LOAD = 1
+STT_OBJECT = 1
+STT_FUNC = 2
+SHN_LORESERVE = 0xFF00
+
+ElfSymbol = namedtuple("ElfSymbol", "name value size type bind section")
+
+
+class ElfError(ValueError):
+    pass
+
+
+class ElfSection:
+    def __init__(  # pylint: disable=too-many-arguments
+        self, name, sh_type, flags, addr, offset, size, link=0
+    ):
+        self.name = name
+        self.type = sh_type
+        self.flags = flags
+        self.addr = addr
+        self.offset = offset
+        self.size = size
+        self.link = link
+        self.lma = addr
+
+    @property
+    def is_alloc(self):
+        return bool(self.flags & SHF_ALLOC)
+
+    @property
+    def has_contents(self):
+        return self.type != SHT_NOBITS
+
+    @property
+    def is_load(self):
+        return self.is_alloc and self.has_contents
+
+
+class ElfFile:
+    def __init__(self, data):
+        if data[:4] != b"\x7fELF":
+            raise ElfError("Not an ELF file")
+        if data[4] != 1 or data[5] != 1:
+            raise ElfError("Only 32-bit little-endian ELF files are supported")
+        self.data = data
+        (
+            self.type,
+            self.machine,
+            _,
+            self.entry,
+            phoff,
+            shoff,
+            self.flags,
+            _,
+            phentsize,
+            phnum,
+            shentsize,
+            shnum,
+            shstrndx,
+        ) = struct.unpack_from("<HHIIIIIHHHHHH", data, 16)
+        self.segments = [
+            struct.unpack_from("<IIIIIIII", data, phoff + index * phentsize)
+            for index in range(phnum)
+        ]
+        headers = [
+            struct.unpack_from("<IIIIIIIIII", data, shoff + index * shentsize)
+            for index in range(shnum)
+        ]
+        names_offset = headers[shstrndx][4] if shnum else 0
+        self.sections = []
+        for header in headers[1:]:
+            name_end = data.index(b"\0", names_offset + header[0])
+            section = ElfSection(
+                data[names_offset + header[0] : name_end].decode(),
+                header[1],
+                header[2],
+                header[3],
+                header[4],
+                header[5],
+                header[6],
+            )
+            section.lma = self._get_lma(section)
+            self.sections.append(section)
+
+    def _get_lma(self, section):
+        # Same rules as BFD: a section placed in a PT_LOAD segment gets its
+        # load address from the segment physical address
+        if not section.is_alloc:
+            return section.addr
+        lma = section.addr
+        for p_type, p_offset, p_vaddr, p_paddr, p_filesz, p_memsz, _, _ in (
+            self.segments
+        ):
+            if p_type != PT_LOAD:
+                continue
+            in_file = not section.has_contents or (
+                p_offset <= section.offset
+                and section.offset + section.size <= p_offset + p_filesz
+            )
+            in_memory = (
+                p_vaddr <= section.addr
+                and section.addr + section.size <= p_vaddr + p_memsz
+            )
+            if not in_file or not in_memory:
+                continue
+            if section.has_contents:
+                lma = p_paddr + section.offset - p_offset
+            else:
+                lma = p_paddr + section.addr - p_vaddr
+            break
+        return lma
+
+    def get_section(self, name):
+        for section in self.sections:
+            if section.name == name:
+                return section
+        return None
+
+    def get_contents(self, section):
+        if not section.has_contents:
+            return b""
+        return self.data[section.offset : section.offset + section.size]
+
+    def get_symbols(self):
+        """Returns the entries of the symbol table, `section` is the
+        ElfSection the symbol is defined in or None"""
+        symtab = next(
+            (section for section in self.sections if section.type == SHT_SYMTAB),
+            None,
+        )
+        if not symtab or not 0 < symtab.link <= len(self.sections):
+            return []
+        names = self.get_contents(self.sections[symtab.link - 1])
+        entries = self.get_contents(symtab)
+        result = []
+        for name_offset, value, size, info, _, shndx in struct.iter_unpack(
+            "<IIIBBH", entries[: len(entries) - len(entries) % 16]
+        ):
+            section = None
+            if 0 < shndx < min(SHN_LORESERVE, len(self.sections) + 1):
+                section = self.sections[shndx - 1]
+            result.append(
+                ElfSymbol(
+                    names[name_offset : names.index(b"\0", name_offset)].decode(
+                        errors="replace"
+                    ),
+                    value,
+                    size,
+                    info & 0xF,
+                    info >> 4,
+                    section,
+                )
+            )
+        return result
+
+    def get_load_segments(self, include=None, exclude=None, change_lma=None):
+        """Returns `(lma, data)` of loadable sections sorted by load address,
+        which is what `objcopy -O ihex [-j|-R section] [--change-section-lma]`
+        writes.
+        """
+        change_lma = change_lma or {}
+        result = []
+        for section in self.sections:
+            if include is not None and section.name not in include:
+                continue
+            if exclude and section.name in exclude:
+                continue
+            if not section.is_load or not section.size:
+                continue
+            result.append(
+                (
+                    change_lma.get(section.name, section.lma),
+                    self.get_contents(section),
+                )
+            )
+        return sorted(result, key=lambda item: item[0])
+
+
+@lru_cache(maxsize=16)
+def _load_elf(path, mtime, size):  # pylint: disable=unused-argument
+    with open(path, "rb") as fp:
+        return ElfFile(fp.read())
+
+
+def load_elf(path):
+    """Parses an ELF file once per modification, later calls reuse the result"""
+    stat = os.stat(path)
+    return _load_elf(os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
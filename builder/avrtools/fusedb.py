@@ -0,0 +1,268 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+#
+# Data-driven fuse calculator.
+#
+# `fusedb.json` describes every fuse byte as a set of named bit fields
+# (CKSEL, SUT, CKOUT, BODLEVEL, EESAVE, JTAGEN, BOOTRST, CFD, ...). A field
+# value is either a constant or a decision tree over the hardware options of
+# a board (`f_cpu`, `oscillator`, `bod`, ...), where `*` matches any other
+# value. Bits which are not covered by a field are taken from `fixed`.
+#
+# `unused` lists the bits which are not implemented by the parts of a layout.
+# They read back differently depending on the part and the avrdude version
+# and are ignored when the fuses of a chip are compared.
+#
+
+import itertools
+import json
+from functools import lru_cache
+from os.path import dirname, join
+
+FUSES = ("lfuse", "hfuse", "efuse", "lock")
+OPTIONS = (
+    "f_cpu",
+    "oscillator",
+    "bod",
+    "eesave",
+    "jtagen",
+    "ckout",
+    "cfd",
+    "bootloader_type",
+)
+ANY_VALUE = "*"
+DEFAULT_DATABASE = join(dirname(__file__), "fusedb.json")
+
+
+class FuseError(ValueError):
+    pass
+
+
+def _to_int(value):
+    return int(value, 0) if isinstance(value, str) else int(value)
+
+
+class _Node:
+    def __init__(self, spec):
+        self.option = None
+        self.constant = None
+        self.cases = {}
+        if isinstance(spec, dict):
+            self.option = spec["option"]
+            self.cases = {
+                key: _Node(value) for key, value in spec["cases"].items()
+            }
+        else:
+            self.constant = _to_int(spec)
+
+    def get_options(self):
+        if self.option is None:
+            return set()
+        result = {self.option}
+        for node in self.cases.values():
+            result |= node.get_options()
+        return result
+
+    def get_domain(self, domain):
+        if self.option is None:
+            return
+        values = domain.setdefault(self.option, [])
+        for key, node in self.cases.items():
+            if key not in values:
+                values.append(key)
+            node.get_domain(domain)
+
+    def evaluate(self, options):
+        if self.option is None:
+            return self.constant
+        value = options.get(self.option)
+        node = self.cases.get(value, self.cases.get(ANY_VALUE))
+        if node is None:
+            raise FuseError("unknown %s value %s" % (self.option, value))
+        return node.evaluate(options)
+
+
+class FuseLayout:
+    def __init__(self, name, spec):
+        self.name = name
+        self.fixed = _to_int(spec.get("fixed", 0xFF))
+        self.unused = _to_int(spec.get("unused", 0))
+        self.fields = []
+        for field, field_spec in spec.get("fields", {}).items():
+            mask = _to_int(field_spec["mask"])
+            shift = (mask & -mask).bit_length() - 1
+            self.fields.append((field, mask, shift, _Node(field_spec["value"])))
+        self.options = tuple(
+            sorted(set().union(*(node.get_options() for _, _, _, node in self.fields)))
+        )
+        self._cache = {}
+
+    def get_domain(self):
+        domain = {}
+        for _, _, _, node in self.fields:
+            node.get_domain(domain)
+        return domain
+
+    def evaluate(self, options):
+        key = tuple(options.get(name) for name in self.options)
+        if key not in self._cache:
+            value = self.fixed
+            for _, mask, shift, node in self.fields:
+                value = (value & ~mask) | ((node.evaluate(options) << shift) & mask)
+            self._cache[key] = value & 0xFF
+        return self._cache[key]
+
+    def decode(self, value):
+        return {
+            field: (value & mask) >> shift for field, mask, shift, _ in self.fields
+        }
+
+
+class FuseDatabase:
+    def __init__(self, manifest):
+        self.defaults = manifest.get("defaults", {})
+        self.layouts = {
+            fuse: {
+                name: FuseLayout(name, spec)
+                for name, spec in manifest["layouts"].get(fuse, {}).items()
+            }
+            for fuse in FUSES
+        }
+        self.mcus = {}
+        for mcu, config in manifest["mcus"].items():
+            entry = dict(self.defaults)
+            entry.update(config)
+            self.mcus[mcu.lower()] = entry
+
+    def get_entry(self, mcu):
+        return self.mcus.get(mcu.lower(), self.defaults)
+
+    def has_bootloader(self, mcu):
+        return self.get_entry(mcu).get("bootloader", True)
+
+    def get_layout(self, mcu, fuse):
+        entry = self.get_entry(mcu)
+        if fuse not in entry:
+            raise FuseError("Couldn't calculate %s for %s" % (fuse, mcu))
+        if entry[fuse] is None:
+            return None
+        return self.layouts[fuse][entry[fuse]]
+
+    def get_used_mask(self, mcu, fuse):
+        """Returns the implemented bits of a fuse byte, all bits when the
+        layout is not known"""
+        try:
+            layout = self.get_layout(mcu, fuse)
+        except FuseError:
+            layout = None
+        return ~layout.unused & 0xFF if layout else 0xFF
+
+    def get_options(self, mcu):
+        """Hardware options which affect at least one fuse byte of `mcu`"""
+        result = set()
+        for fuse in FUSES:
+            try:
+                layout = self.get_layout(mcu, fuse)
+            except FuseError:
+                continue
+            if layout:
+                result |= set(layout.options)
+        return result
+
+    def calculate(self, mcu, fuse, options):
+        layout = self.get_layout(mcu, fuse)
+        if layout is None:
+            return None
+        try:
+            return layout.evaluate(options)
+        except FuseError as exc:
+            raise FuseError("Couldn't calculate %s for %s: %s" % (fuse, mcu, exc))
+
+    def calculate_all(self, mcu, options):
+        return {fuse: self.calculate(mcu, fuse, options) for fuse in FUSES}
+
+    def evaluate_many(self, mcu, options_list):
+        """Evaluates all fuse bytes for a batch of option sets.
+
+        Layouts cache their result per distinct projection of the options they
+        depend on, so large batches cost one evaluation per unique value.
+        """
+        return [self.calculate_all(mcu, options) for options in options_list]
+
+    def get_domain(self, mcu):
+        domain = {}
+        for fuse in FUSES:
+            try:
+                layout = self.get_layout(mcu, fuse)
+            except FuseError:
+                continue
+            if not layout:
+                continue
+            for option, values in layout.get_domain().items():
+                known = domain.setdefault(option, [])
+                known.extend(value for value in values if value not in known)
+        return domain
+
+    def compute_all(self, mcu):
+        """Returns `(options, fuses)` for every combination of the option values
+        known to the database for `mcu`. `*` stands for any other value.
+        Combinations which can not be calculated are skipped.
+        """
+        domain = self.get_domain(mcu)
+        names = sorted(domain)
+        result = []
+        for values in itertools.product(*(domain[name] for name in names)):
+            options = dict(zip(names, values))
+            try:
+                fuses = self.calculate_all(mcu, options)
+            except FuseError:
+                continue
+            result.append((options, fuses))
+        return result
+
+
+def plan_fuses_update(expected, current, erase_chip, masks=None):
+    """Returns the names of the fuse bytes to write and a report. `expected`
+    is a list of `(name, value)`, `current` maps the names to the values
+    read from the chip (None when unknown) and `masks` to the implemented
+    bits which are compared."""
+    masks = masks or {}
+
+    def _equal(name, value, other):
+        mask = masks.get(name, 0xFF)
+        return other is not None and value & mask == other & mask
+
+    changed = [
+        name for name, value in expected if not _equal(name, value, current.get(name))
+    ]
+    erase = bool(changed) and erase_chip
+    lock = dict(expected).get("lock")
+    if erase and "lock" not in changed and not _equal("lock", 0xFF, lock):
+        # Chip erase also clears lock bits, they have to be programmed again
+        changed.insert(0, "lock")
+    report = dict(erase=erase, fuses={})
+    for name, value in expected:
+        report["fuses"][name] = dict(
+            expected=hex(value),
+            current=hex(current[name]) if current.get(name) is not None else None,
+            written=name in changed,
+        )
+    return changed, report
+
+
+@lru_cache(maxsize=None)
+def load_database(path=None):
+    with open(path or DEFAULT_DATABASE, encoding="utf8") as fp:
+        return FuseDatabase(json.load(fp))
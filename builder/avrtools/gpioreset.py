@@ -0,0 +1,268 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+#
+# Reset of a target wired to a host GPIO line, e.g. a Raspberry Pi HAT.
+#
+# Board manifest (or `board_upload.reset_gpio.*` in platformio.ini):
+#
+#   "upload": {
+#     "reset_gpio": {
+#       "pin": 18,              line offset on the chip / sysfs GPIO number
+#       "polarity": "high",     level which holds the target in reset
+#       "pulse_ms": 100,        how long the reset level is held
+#       "backend": "auto",      auto, chardev, sysfs or fake
+#       "chip": "/dev/gpiochip0"
+#     }
+#   }
+#
+# Lines stay requested after a reset, so the next reset in the same process
+# (or, with sysfs, in the next upload) does not wait for export and udev.
+#
+
+import os
+import struct
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+DEFAULT_PULSE_MS = 100
+DEFAULT_CHIP = "/dev/gpiochip0"
+SYSFS_ROOT = "/sys/class/gpio"
+
+# linux/gpio.h, v1 ABI
+GPIOHANDLES_MAX = 64
+GPIOHANDLE_REQUEST_OUTPUT = 1 << 1
+GPIOHANDLE_REQUEST_FORMAT = "<%dII%dB32sIi" % (GPIOHANDLES_MAX, GPIOHANDLES_MAX)
+GPIOHANDLE_DATA_FORMAT = "<%dB" % GPIOHANDLES_MAX
+
+
+def _iowr(nr, size):
+    return (3 << 30) | (size << 16) | (0xB4 << 8) | nr
+
+
+GPIO_GET_LINEHANDLE_IOCTL = _iowr(0x03, struct.calcsize(GPIOHANDLE_REQUEST_FORMAT))
+GPIOHANDLE_SET_LINE_VALUES_IOCTL = _iowr(
+    0x09, struct.calcsize(GPIOHANDLE_DATA_FORMAT)
+)
+
+
+class GpioError(OSError):
+    pass
+
+
+class SysfsLine:
+    def __init__(self, pin, root=SYSFS_ROOT):
+        self.pin = int(pin)
+        self.root = root
+        self._value_fp = None
+
+    @property
+    def path(self):
+        return os.path.join(self.root, "gpio%d" % self.pin)
+
+    def _write(self, path, value, timeout=0):
+        # Attributes of a just exported line get their permissions from udev
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                with open(path, "w", encoding="ascii") as fp:
+                    fp.write(str(value))
+                return
+            except PermissionError:
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(0.01)
+
+    def request(self, value):
+        if not os.path.isdir(self.path):
+            self._write(os.path.join(self.root, "export"), self.pin)
+        # "high"/"low" configures the output and its level at once
+        self._write(
+            os.path.join(self.path, "direction"), "high" if value else "low", 1.0
+        )
+        self._value_fp = open(  # pylint: disable=consider-using-with
+            os.path.join(self.path, "value"), "w", encoding="ascii"
+        )
+
+    def set(self, value):
+        self._value_fp.seek(0)
+        self._value_fp.write("1" if value else "0")
+        self._value_fp.flush()
+
+    def release(self):
+        if self._value_fp:
+            self._value_fp.close()
+            self._value_fp = None
+        self._write(os.path.join(self.root, "unexport"), self.pin)
+
+
+class ChardevLine:
+    def __init__(self, pin, chip=DEFAULT_CHIP):
+        self.pin = int(pin)
+        self.chip = chip
+        self._fd = None
+
+    def request(self, value):
+        if not fcntl:
+            raise GpioError("GPIO character devices are not supported here")
+        offsets = [self.pin] + [0] * (GPIOHANDLES_MAX - 1)
+        values = [int(bool(value))] + [0] * (GPIOHANDLES_MAX - 1)
+        buf = bytearray(
+            struct.pack(
+                GPIOHANDLE_REQUEST_FORMAT,
+                *offsets,
+                GPIOHANDLE_REQUEST_OUTPUT,
+                *values,
+                b"platformio-reset",
+                1,
+                -1,
+            )
+        )
+        chip_fd = os.open(self.chip, os.O_RDWR | os.O_CLOEXEC)
+        try:
+            fcntl.ioctl(chip_fd, GPIO_GET_LINEHANDLE_IOCTL, buf)
+        finally:
+            os.close(chip_fd)
+        self._fd = struct.unpack(GPIOHANDLE_REQUEST_FORMAT, buf)[-1]
+
+    def set(self, value):
+        data = bytearray(
+            struct.pack(
+                GPIOHANDLE_DATA_FORMAT,
+                int(bool(value)),
+                *([0] * (GPIOHANDLES_MAX - 1)),
+            )
+        )
+        fcntl.ioctl(self._fd, GPIOHANDLE_SET_LINE_VALUES_IOCTL, data)
+
+    def release(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class FakeLine:
+    """Records level changes instead of driving hardware"""
+
+    def __init__(self, pin, chip=None):
+        self.pin = int(pin)
+        self.chip = chip
+        self.requested = False
+        self.events = []
+
+    def _record(self, action, value):
+        self.events.append((time.monotonic(), action, int(bool(value))))
+
+    def request(self, value):
+        self.requested = True
+        self._record("request", value)
+
+    def set(self, value):
+        if not self.requested:
+            raise GpioError("GPIO%d is not requested" % self.pin)
+        self._record("set", value)
+
+    def release(self):
+        self.requested = False
+
+    def get_pulses(self):
+        """Returns `(level, seconds)` of each completed level change"""
+        result = []
+        for (started, _, level), (ended, _, _) in zip(self.events, self.events[1:]):
+            result.append((level, ended - started))
+        return result
+
+
+BACKENDS = ("auto", "chardev", "sysfs", "fake")
+
+# Lines kept requested for the lifetime of the process
+_REQUESTED_LINES = {}
+
+
+def _create_line(backend, pin, chip):
+    if backend == "sysfs":
+        return SysfsLine(pin, SYSFS_ROOT)
+    if backend == "fake":
+        return FakeLine(pin, chip)
+    return ChardevLine(pin, chip)
+
+
+def get_line(backend, pin, chip=DEFAULT_CHIP, inactive_value=0):
+    key = (backend, chip, int(pin))
+    if key in _REQUESTED_LINES:
+        return _REQUESTED_LINES[key]
+    if backend not in BACKENDS:
+        raise GpioError("Unknown GPIO backend `%s`" % backend)
+    candidates = [backend]
+    if backend == "auto":
+        candidates = ["chardev", "sysfs"] if os.path.exists(chip) else ["sysfs"]
+    error = None
+    for name in candidates:
+        line = _create_line(name, pin, chip)
+        try:
+            line.request(inactive_value)
+        except OSError as exc:
+            error = exc
+            continue
+        _REQUESTED_LINES[key] = line
+        return line
+    raise GpioError("Could not request GPIO%s: %s" % (pin, error))
+
+
+def release_all():
+    while _REQUESTED_LINES:
+        _, line = _REQUESTED_LINES.popitem()
+        line.release()
+
+
+class GpioReset:
+    def __init__(
+        self,
+        pin,
+        polarity="high",
+        pulse_ms=DEFAULT_PULSE_MS,
+        backend="auto",
+        chip=DEFAULT_CHIP,
+    ):
+        if str(polarity).lower() not in ("high", "low"):
+            raise GpioError("Reset polarity must be `high` or `low`")
+        self.pin = int(pin)
+        self.active_value = int(str(polarity).lower() == "high")
+        self.pulse = float(pulse_ms) / 1000
+        self.backend = str(backend).lower()
+        self.chip = chip
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            config["pin"],
+            polarity=config.get("polarity", "high"),
+            pulse_ms=config.get("pulse_ms", DEFAULT_PULSE_MS),
+            backend=config.get("backend", "auto"),
+            chip=config.get("chip", DEFAULT_CHIP),
+        )
+
+    def get_line(self):
+        return get_line(self.backend, self.pin, self.chip, 1 - self.active_value)
+
+    def pulse_reset(self):
+        line = self.get_line()
+        line.set(self.active_value)
+        time.sleep(self.pulse)
+        line.set(1 - self.active_value)
+        return line
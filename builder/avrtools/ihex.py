@@ -0,0 +1,156 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+#
+# Intel HEX reader and writer. The writer follows the record layout of the
+# BFD `ihex` backend used by avr-objcopy, so the output is byte-identical.
+#
+
+RECORD_SIZE = 16
+
+
+class IHexError(ValueError):
+    pass
+
+
+def parse_ihex(text):
+    """Returns a sorted list of `(address, bytearray)` contiguous segments"""
+    chunks = []
+    base = 0
+    for lineno, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line:
+            continue
+        if not line.startswith(":"):
+            raise IHexError("Line %d: missing record mark" % lineno)
+        try:
+            record = bytes.fromhex(line[1:])
+        except ValueError as exc:
+            raise IHexError("Line %d: %s" % (lineno, exc)) from exc
+        if len(record) < 5 or len(record) != record[0] + 5:
+            raise IHexError("Line %d: invalid record length" % lineno)
+        if sum(record) & 0xFF:
+            raise IHexError("Line %d: checksum mismatch" % lineno)
+        rec_type = record[3]
+        data = record[4:-1]
+        if rec_type == 0:
+            chunks.append((base + ((record[1] << 8) | record[2]), data))
+        elif rec_type == 1:
+            break
+        elif rec_type == 2:
+            base = ((data[0] << 8) | data[1]) << 4
+        elif rec_type == 4:
+            base = ((data[0] << 8) | data[1]) << 16
+    return merge_segments(chunks)
+
+
+def read_ihex(path):
+    with open(path, encoding="ascii") as fp:
+        return parse_ihex(fp.read())
+
+
+def merge_segments(chunks):
+    result = []
+    for address, data in sorted(chunks, key=lambda item: item[0]):
+        if result and result[-1][0] + len(result[-1][1]) == address:
+            result[-1][1].extend(data)
+        elif result and result[-1][0] + len(result[-1][1]) > address:
+            raise IHexError("Overlapping data at 0x%X" % address)
+        else:
+            result.append((address, bytearray(data)))
+    return result
+
+
+def _format_record(rec_type, address, data):
+    record = bytes([len(data), (address >> 8) & 0xFF, address & 0xFF, rec_type])
+    record += bytes(data)
+    record += bytes([(-sum(record)) & 0xFF])
+    return ":%s\r\n" % record.hex().upper()
+
+
+def format_ihex(segments, start_address=0):
+    """Formats `(address, data)` segments in the given order. Each segment is
+    split into records independently, the same way BFD writes sections.
+    """
+    lines = []
+    segbase = 0
+    extbase = 0
+    for where, data in segments:
+        offset = 0
+        while offset < len(data):
+            now = min(len(data) - offset, RECORD_SIZE)
+            if where > segbase + extbase + 0xFFFF:
+                if extbase == 0 and where <= 0xFFFFF:
+                    segbase = where & 0xF0000
+                    lines.append(
+                        _format_record(
+                            2, 0, [(segbase >> 12) & 0xFF, (segbase >> 4) & 0xFF]
+                        )
+                    )
+                else:
+                    if segbase:
+                        lines.append(_format_record(2, 0, [0, 0]))
+                    segbase = 0
+                    extbase = where & 0xFFFF0000
+                    lines.append(
+                        _format_record(
+                            4, 0, [(extbase >> 24) & 0xFF, (extbase >> 16) & 0xFF]
+                        )
+                    )
+            rec_addr = where - (extbase + segbase)
+            if rec_addr + now > 0xFFFF:
+                now = 0x10000 - rec_addr
+            lines.append(_format_record(0, rec_addr, data[offset : offset + now]))
+            where += now
+            offset += now
+    if start_address:
+        if start_address <= 0xFFFFF:
+            lines.append(
+                _format_record(
+                    3,
+                    0,
+                    [
+                        ((start_address & 0xF0000) >> 12) & 0xFF,
+                        0,
+                        (start_address >> 8) & 0xFF,
+                        start_address & 0xFF,
+                    ],
+                )
+            )
+        else:
+            lines.append(_format_record(5, 0, start_address.to_bytes(4, "big")))
+    lines.append(_format_record(1, 0, b""))
+    return "".join(lines)
+
+
+def write_ihex(path, segments, start_address=0):
+    with open(path, "w", encoding="ascii", newline="") as fp:
+        fp.write(format_ihex(segments, start_address))
+
+
+def to_pages(segments, page_size, fill=0xFF):
+    """Splits segments into `{page_address: bytes}` filled up to page size"""
+    pages = {}
+    for address, data in segments:
+        pos = 0
+        while pos < len(data):
+            offset = address + pos
+            page = offset - offset % page_size
+            start = offset - page
+            size = min(page_size - start, len(data) - pos)
+            if page not in pages:
+                pages[page] = bytearray([fill] * page_size)
+            pages[page][start : start + size] = data[pos : pos + size]
+            pos += size
+    return {page: bytes(data) for page, data in pages.items()}
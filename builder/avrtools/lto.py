@@ -0,0 +1,162 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+#
+# Parallel LTO link.
+#
+#   board_build.lto_jobs = auto           the SCons `-j` value, or a number
+#   board_build.lto_partition = balanced  balanced, 1to1, max or one
+#   board_build.lto_check = yes           relink with serial LTO and compare
+#   board_build.lto_size_tolerance = 1.0  allowed code size growth, percent
+#
+# Every partition boundary turns calls between partitions into ordinary
+# global calls, which costs flash on AVR. The number of partitions is
+# therefore limited to the number of jobs instead of the GCC default of 32.
+#
+# GCC runs the parallel LTRANS jobs through `make` (or $MAKE), which the
+# toolchain does not ship on Windows. Without it the program is linked with
+# the same partitions in one job.
+#
+
+import os
+import shutil
+import sys
+
+from SCons.Action import Action
+
+from avrtools import elf, sizes
+
+PARTITIONS = ("balanced", "1to1", "max", "one")
+DEFAULT_TOLERANCE = 1.0
+
+
+def get_jobs(value, num_jobs):
+    """Returns the number of LTRANS jobs, 0 keeps the serial link"""
+    value = str(value).strip().lower()
+    if value in ("", "0", "no", "false"):
+        return 0
+    if value in ("auto", "yes", "true"):
+        jobs = int(num_jobs or 1)
+    else:
+        jobs = int(value)
+    return jobs if jobs > 1 else 0
+
+
+def is_lto_flag(flag):
+    return flag == "-flto" or str(flag).startswith("-flto=")
+
+
+def get_link_flags(flags, jobs, partition="balanced", parallel=True):
+    """Returns `flags` with -flto linking in `jobs` partitions or None when
+    the program is not linked with LTO. The partitions are linked in
+    parallel jobs unless `parallel` is False."""
+    if not any(is_lto_flag(flag) for flag in flags):
+        return None
+    result = []
+    for flag in flags:
+        if is_lto_flag(flag):
+            result.append("-flto=%d" % jobs if parallel else "-flto")
+        elif not str(flag).startswith(("-flto-partition=", "--param=lto-partitions=")):
+            result.append(flag)
+    result.append("-flto-partition=%s" % partition)
+    if partition == "balanced":
+        result.append("--param=lto-partitions=%d" % jobs)
+    return result
+
+
+def get_serial_flags(flags):
+    # The link map describes the program, not the reference
+    return [
+        "-flto" if is_lto_flag(flag) else flag
+        for flag in flags
+        if not str(flag).startswith(
+            ("-flto-partition=", "--param=lto-partitions=", "-Wl,-Map")
+        )
+    ]
+
+
+def has_make(env):
+    """GCC needs `make` to run the LTRANS jobs in parallel"""
+    return bool(
+        shutil.which(
+            env["ENV"].get("MAKE") or os.getenv("MAKE") or "make",
+            path=env["ENV"].get("PATH"),
+        )
+    )
+
+
+def get_program_size(env, path):
+    return sizes.calculate_usage(
+        elf.load_elf(path),
+        env["SIZEPROGSECTIONS"],
+        env["SIZEDATASECTIONS"],
+        env["SIZEEEPROMSECTIONS"],
+    )["program"]["size"]
+
+
+def CheckLtoSize(target, source, env):  # pylint: disable=W0613
+    program_path = target[0].get_abspath()
+    serial_path = "%s.serial%s" % os.path.splitext(program_path)
+    serial_env = env.Clone(LINKFLAGS=get_serial_flags(env["LINKFLAGS"]))
+    link = Action(
+        serial_env.VerboseAction("$LINKCOM", "Linking $TARGET with serial LTO")
+    )
+    if link([serial_env.File(serial_path)], source, serial_env):
+        sys.stderr.write("Error: Could not link the serial LTO reference\n")
+        env.Exit(1)
+
+    parallel_size = get_program_size(env, program_path)
+    serial_size = get_program_size(env, serial_path)
+    tolerance = float(
+        env.BoardConfig().get("build.lto_size_tolerance", DEFAULT_TOLERANCE)
+    )
+    change = (parallel_size - serial_size) * 100.0 / serial_size if serial_size else 0
+    print(
+        "Parallel LTO: %d bytes, serial LTO: %d bytes (%+.2f%%)"
+        % (parallel_size, serial_size, change)
+    )
+    if change > tolerance:
+        sys.stderr.write(
+            "Error: Parallel LTO grows the program by %.2f%%, more than the "
+            "allowed %.2f%% (board_build.lto_size_tolerance)\n" % (change, tolerance)
+        )
+        env.Exit(1)
+
+
+def configure(env, program):
+    """Switches the link of `program` to parallel LTO when it is enabled"""
+    board = env.BoardConfig()
+    jobs = get_jobs(board.get("build.lto_jobs", "no"), env.GetOption("num_jobs"))
+    if not jobs:
+        return None
+    partition = str(board.get("build.lto_partition", "balanced")).lower()
+    if partition not in PARTITIONS:
+        sys.stderr.write(
+            "Error: Unknown LTO partitioning `%s`, use one of %s\n"
+            % (partition, ", ".join(PARTITIONS))
+        )
+        env.Exit(1)
+    parallel = has_make(env)
+    flags = get_link_flags(env["LINKFLAGS"], jobs, partition, parallel)
+    if flags is None:
+        return None
+    if not parallel:
+        print(
+            "Warning: `make` was not found, the LTO partitions are linked in "
+            "one job (board_build.lto_jobs)"
+        )
+    env.Replace(LINKFLAGS=flags)
+    if str(board.get("build.lto_check", "no")).lower() in ("1", "yes", "true"):
+        env.AddPostAction(program, CheckLtoSize)
+    return jobs
@@ -0,0 +1,135 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+#
+# Concurrent upload of the same firmware to many serial ports
+#
+
+import fnmatch
+import glob
+import re
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+MAX_JOBS = 32
+
+
+def resolve_ports(spec, known_ports=None):
+    """Expands a comma or whitespace separated list of ports and glob patterns.
+
+    Patterns are matched against the filesystem and against `known_ports`
+    (the names reported by the serial port enumeration, e.g. `COM*`).
+    """
+    if isinstance(spec, (list, tuple)):
+        items = [str(item) for item in spec]
+    else:
+        items = re.split(r"[\s,]+", str(spec or ""))
+    result = []
+    for item in items:
+        if not item:
+            continue
+        if glob.has_magic(item):
+            matches = set(glob.glob(item))
+            matches.update(fnmatch.filter(known_ports or [], item))
+            candidates = sorted(matches)
+        else:
+            candidates = [item]
+        result.extend(port for port in candidates if port not in result)
+    return result
+
+
+def parse_timeout(value):
+    """Returns the seconds of `board_upload.timeout`, None without a limit"""
+    if value is None or str(value).strip() == "":
+        return None
+    try:
+        timeout = float(value)
+    except (TypeError, ValueError) as exc:
+        raise ValueError("Invalid upload timeout `%s`" % value) from exc
+    if timeout <= 0:
+        raise ValueError("Invalid upload timeout `%s`, expected seconds" % value)
+    return timeout
+
+
+def parse_jobs(value):
+    """Returns the number of concurrent uploads of `board_upload.jobs`"""
+    if value is None or str(value).strip() == "":
+        return MAX_JOBS
+    try:
+        jobs = int(value)
+    except (TypeError, ValueError) as exc:
+        raise ValueError("Invalid number of upload jobs `%s`" % value) from exc
+    if jobs < 1:
+        raise ValueError("Invalid number of upload jobs `%s`" % value)
+    return min(jobs, MAX_JOBS)
+
+
+def _run_command(port, cmd, timeout):
+    started = time.monotonic()
+    result = dict(port=port, cmd=cmd, returncode=None, success=False, log="")
+    try:
+        proc = subprocess.run(
+            cmd,
+            shell=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            timeout=timeout,
+            check=False,
+        )
+        result["returncode"] = proc.returncode
+        result["success"] = proc.returncode == 0
+        result["log"] = proc.stdout.decode(errors="replace")
+    except subprocess.TimeoutExpired as exc:
+        result["log"] = (exc.stdout or b"").decode(errors="replace")
+        result["log"] += "\nTimed out after %s seconds\n" % timeout
+    except OSError as exc:
+        result["log"] = str(exc)
+    result["elapsed"] = round(time.monotonic() - started, 3)
+    return result
+
+
+def run_parallel(commands, jobs=None, timeout=None, on_result=None):
+    """Runs one uploader process per port, at most `jobs` at a time.
+
+    `commands` maps a port to its shell command. A failure on one port does
+    not stop the others. Results are returned in the order of `commands`,
+    `on_result` is called as soon as each port finishes.
+    """
+    if not commands:
+        return []
+    jobs = max(1, min(int(jobs or MAX_JOBS), len(commands)))
+    results = {}
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {
+            executor.submit(_run_command, port, cmd, timeout): port
+            for port, cmd in commands.items()
+        }
+        for future in as_completed(futures):
+            port = futures[future]
+            try:
+                result = future.result()
+            except Exception as exc:  # pylint: disable=broad-except
+                result = dict(
+                    port=port,
+                    cmd=commands[port],
+                    returncode=None,
+                    success=False,
+                    log="Error: %s" % exc,
+                    elapsed=0,
+                )
+            results[port] = result
+            if on_result:
+                on_result(result)
+    return [results[port] for port in commands]
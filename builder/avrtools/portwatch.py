@@ -0,0 +1,268 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+#
+# Detection of the serial port a bootloader enumerates on after a reset.
+#
+# On Linux the kernel uevent netlink socket reports new TTY devices as soon
+# as they appear. Other systems, and hosts where the socket can not be
+# opened, poll the port list. Sources share a small interface:
+#
+#   start()         begin collecting events
+#   wait(timeout)   list of `{"port", "hwid"}` added ports, or None when
+#                   the port list has to be scanned
+#   close()
+#
+
+import collections
+import os
+import re
+import select
+import socket
+import sys
+import threading
+import time
+
+NETLINK_KOBJECT_UEVENT = 15
+POLL_INTERVAL = 0.25
+RESCAN_INTERVAL = 1.0
+WAIT_TIMEOUT = 5.0
+
+
+def parse_hwid(hwid):
+    """Returns `(vid, pid)` from a pyserial hardware ID such as
+    `USB VID:PID=2341:0036 SER=...` or None"""
+    match = re.search(r"VID:PID=([0-9a-f]{4}):([0-9a-f]{4})", hwid or "", re.I)
+    if not match:
+        return None
+    return int(match.group(1), 16), int(match.group(2), 16)
+
+
+def parse_board_hwids(hwids):
+    """Converts `build.hwids` of a board manifest to a set of `(vid, pid)`"""
+    result = set()
+    for item in hwids or []:
+        try:
+            result.add((int(str(item[0]), 16), int(str(item[1]), 16)))
+        except (IndexError, TypeError, ValueError):
+            continue
+    return result
+
+
+def read_sysfs_usb_ids(name, sysfs_root="/sys"):
+    """Looks up VID/PID of a TTY device in sysfs walking up to its USB device"""
+    path = os.path.join(sysfs_root, "class", "tty", os.path.basename(name), "device")
+    if not os.path.exists(path):
+        return None
+    path = os.path.realpath(path)
+    for _ in range(4):
+        try:
+            with open(os.path.join(path, "idVendor"), encoding="ascii") as fp:
+                vid = int(fp.read().strip(), 16)
+            with open(os.path.join(path, "idProduct"), encoding="ascii") as fp:
+                pid = int(fp.read().strip(), 16)
+            return vid, pid
+        except (OSError, ValueError):
+            path = os.path.dirname(path)
+    return None
+
+
+def parse_uevent(data):
+    fields = data.split(b"\0")
+    result = {}
+    for field in fields[1:]:
+        key, _, value = field.partition(b"=")
+        if key:
+            result[key.decode(errors="replace")] = value.decode(errors="replace")
+    return result
+
+
+class PollingSource:
+    def __init__(self, interval=POLL_INTERVAL):
+        self.interval = interval
+
+    def start(self):
+        pass
+
+    def wait(self, timeout):
+        time.sleep(max(0, min(self.interval, timeout)))
+        return None
+
+    def close(self):
+        pass
+
+
+class NetlinkSource:
+    def __init__(self, rescan_interval=RESCAN_INTERVAL, sysfs_root="/sys"):
+        self.rescan_interval = rescan_interval
+        self.sysfs_root = sysfs_root
+        self._sock = None
+
+    def start(self):
+        if not sys.platform.startswith("linux"):
+            raise OSError("Kernel uevents are available only on Linux")
+        sock = socket.socket(
+            socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT
+        )
+        try:
+            sock.bind((0, 1))
+        except OSError:
+            sock.close()
+            raise
+        self._sock = sock
+
+    def wait(self, timeout):
+        # Containers often do not forward uevents, a quiet socket falls back
+        # to a scan of the port list
+        ready, _, _ = select.select(
+            [self._sock], [], [], max(0, min(self.rescan_interval, timeout))
+        )
+        if not ready:
+            return None
+        events = []
+        while ready:
+            event = parse_uevent(self._sock.recv(65536))
+            if (
+                event.get("ACTION") == "add"
+                and event.get("SUBSYSTEM") == "tty"
+                and event.get("DEVNAME")
+            ):
+                events.append(
+                    dict(
+                        port=os.path.join("/dev", event["DEVNAME"]),
+                        hwid=read_sysfs_usb_ids(event["DEVNAME"], self.sysfs_root),
+                    )
+                )
+            ready, _, _ = select.select([self._sock], [], [], 0)
+        return events
+
+    def close(self):
+        if self._sock:
+            self._sock.close()
+            self._sock = None
+
+
+class SimulatedSource:
+    """Replays added devices, e.g. `add("/dev/ttyACM1", 0x2341, 0x0036)`"""
+
+    def __init__(self):
+        self._events = collections.deque()
+        self._condition = threading.Condition()
+
+    def add(self, port, vid=None, pid=None, delay=0):
+        def _add():
+            if delay:
+                time.sleep(delay)
+            with self._condition:
+                self._events.append(
+                    dict(port=port, hwid=(vid, pid) if vid is not None else None)
+                )
+                self._condition.notify_all()
+
+        if delay:
+            threading.Thread(target=_add, daemon=True).start()
+        else:
+            _add()
+
+    def start(self):
+        pass
+
+    def wait(self, timeout):
+        with self._condition:
+            self._condition.wait_for(lambda: self._events, max(0, timeout))
+            events = list(self._events)
+            self._events.clear()
+        return events
+
+    def close(self):
+        pass
+
+
+class PortWatcher:
+    def __init__(self, hwids=None, list_ports=None, source=None):
+        self.hwids = set(hwids or [])
+        self.list_ports = list_ports
+        self.source = source
+        self._known = set()
+
+    def _scan(self):
+        ports = {
+            item["port"]: parse_hwid(item.get("hwid"))
+            for item in (self.list_ports() if self.list_ports else [])
+        }
+        added = [
+            dict(port=port, hwid=hwid)
+            for port, hwid in ports.items()
+            if port not in self._known
+        ]
+        # Ports which disappeared and came back under the same name are new
+        self._known = set(ports)
+        return added
+
+    def _match(self, events):
+        for event in events:
+            if self.hwids and event["hwid"] and event["hwid"] not in self.hwids:
+                continue
+            return event["port"]
+        return None
+
+    def start(self):
+        """Must be called before the reset, so no enumeration is missed"""
+        if self.source is None:
+            try:
+                self.source = NetlinkSource()
+                self.source.start()
+            except (AttributeError, OSError):
+                self.source = PollingSource()
+        else:
+            self.source.start()
+        self._scan()
+        return self
+
+    def wait(self, timeout=WAIT_TIMEOUT):
+        """Returns the first added port matching the board VID/PID or None"""
+        deadline = time.monotonic() + timeout
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                events = self.source.wait(remaining)
+                if events is None:
+                    events = self._scan()
+                else:
+                    self._known.update(event["port"] for event in events)
+                port = self._match(events)
+                if port:
+                    return port
+        finally:
+            self.close()
+
+    def close(self):
+        if self.source:
+            self.source.close()
+
+
+def wait_until_ready(port, timeout=1.0):
+    """The device node is created and given permissions by udev shortly after
+    the kernel event. Ports which are not device nodes (`COM5` on Windows)
+    are ready when they are listed."""
+    if not port.startswith("/dev/"):
+        return True
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if os.access(port, os.R_OK | os.W_OK):
+            return True
+        time.sleep(0.02)
+    return os.access(port, os.R_OK | os.W_OK)
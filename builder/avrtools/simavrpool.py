@@ -0,0 +1,238 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+#
+# GDB ports and pre-started simavr servers for debug sessions.
+#
+# Every session gets a free port unless `debug_port` is set. With
+# `board_debug.simavr_pool = N` (or PLATFORMIO_ATMELAVR_SIMAVR_POOL) up to N
+# servers per simulated MCU and clock are kept running in the background.
+# A session claims an idle server with a lock held for the lifetime of the
+# debug process; servers that exit at the end of a session are replaced.
+#
+# Stop the servers of a pool directory with
+#
+#   python simavrpool.py stop <core_dir>/.cache/atmelavr-simavr
+#
+
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+POOL_ENV_VAR = "PLATFORMIO_ATMELAVR_SIMAVR_POOL"
+MAX_POOL_SIZE = 64
+START_TIMEOUT = 5
+
+# Locks of the claimed servers, released when the debug process exits
+_claims = []
+
+
+def find_free_port(host="127.0.0.1"):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+def is_listening(port, host="127.0.0.1"):
+    """Checks the port without connecting, simavr serves one connection"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        try:
+            sock.bind((host, port))
+        except OSError:
+            return True
+    return False
+
+
+def parse_port(value):
+    """Returns the TCP port of `:1234`, `localhost:1234` or `1234`"""
+    value = str(value or "").strip()
+    try:
+        return int(value.rsplit(":", 1)[-1])
+    except ValueError:
+        return None
+
+
+def parse_pool_size(value):
+    """Returns the number of servers of `board_debug.simavr_pool`"""
+    if value is None or str(value).strip() == "":
+        return 0
+    try:
+        size = int(str(value).strip())
+    except ValueError as exc:
+        raise ValueError("Invalid simavr pool size `%s`" % value) from exc
+    if size < 0:
+        raise ValueError("Invalid simavr pool size `%s`" % value)
+    return min(size, MAX_POOL_SIZE)
+
+
+def set_gdb_port(arguments, port):
+    """Returns the server arguments with `-g <port>`"""
+    result = list(arguments)
+    if "-g" not in result:
+        return ["-g", str(port)] + result
+    index = result.index("-g") + 1
+    if index < len(result) and result[index].isdigit():
+        result[index] = str(port)
+    else:
+        result.insert(index, str(port))
+    return result
+
+
+def get_option(arguments, name):
+    if name in arguments and arguments.index(name) + 1 < len(arguments):
+        return arguments[arguments.index(name) + 1]
+    return None
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class ServerPool:
+    def __init__(self, root, executable, mcu, f_cpu, size):
+        self.root = os.path.join(root, "%s-%s" % (mcu, f_cpu))
+        self.executable = executable
+        self.mcu = mcu
+        self.f_cpu = f_cpu
+        self.size = parse_pool_size(size)
+
+    @contextmanager
+    def lock(self):
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, ".lock"), "a", encoding="utf8") as fp:
+            fcntl.flock(fp, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fp, fcntl.LOCK_UN)
+
+    def _load_servers(self):
+        servers = []
+        for name in sorted(os.listdir(self.root)):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.root, name)
+            try:
+                with open(path, encoding="utf8") as fp:
+                    server = json.load(fp)
+            except (OSError, ValueError):
+                continue
+            if _is_alive(server["pid"]):
+                servers.append(server)
+                continue
+            for stale_path in (path, path[:-5] + ".claim"):
+                if os.path.exists(stale_path):
+                    os.remove(stale_path)
+        return servers
+
+    def _start_server(self):
+        port = find_free_port()
+        log_path = os.path.join(self.root, "%d.log" % port)
+        with open(log_path, "wb") as log:
+            proc = subprocess.Popen(  # pylint: disable=consider-using-with
+                [self.executable, "-g", str(port), "-m", self.mcu, "-f", self.f_cpu],
+                cwd=os.path.dirname(self.executable) or None,
+                stdin=subprocess.DEVNULL,
+                stdout=log,
+                stderr=subprocess.STDOUT,
+                start_new_session=True,
+            )
+        server = dict(pid=proc.pid, port=port, mcu=self.mcu, f_cpu=self.f_cpu)
+        server_path = os.path.join(self.root, "%d.json" % port)
+        with open(server_path, "w", encoding="utf8") as fp:
+            json.dump(server, fp)
+        return server
+
+    def _claim(self, server):
+        fp = open(  # pylint: disable=consider-using-with
+            os.path.join(self.root, "%d.claim" % server["port"]), "a", encoding="utf8"
+        )
+        try:
+            fcntl.flock(fp, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            fp.close()
+            return False
+        _claims.append(fp)
+        return True
+
+    def acquire(self):
+        """Returns the port of an idle server, starts one when all are busy.
+        None when the pool is disabled or not supported on this system."""
+        if not self.size or not fcntl:
+            return None
+        with self.lock():
+            servers = self._load_servers()
+            claimed = next((server for server in servers if self._claim(server)), None)
+            if not claimed:
+                claimed = self._start_server()
+                servers.append(claimed)
+                self._claim(claimed)
+            # Top up for the next sessions
+            while len(servers) < self.size:
+                servers.append(self._start_server())
+
+        started = time.monotonic()
+        while not is_listening(claimed["port"]):
+            if time.monotonic() - started > START_TIMEOUT or not _is_alive(
+                claimed["pid"]
+            ):
+                return None
+            time.sleep(0.05)
+        return claimed["port"]
+
+
+def stop_servers(root):
+    """Terminates the servers of all pools under `root`"""
+    stopped = 0
+    if not os.path.isdir(root):
+        return stopped
+    for pool_name in os.listdir(root):
+        pool_dir = os.path.join(root, pool_name)
+        if not os.path.isdir(pool_dir):
+            continue
+        for name in os.listdir(pool_dir):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(pool_dir, name), encoding="utf8") as fp:
+                    pid = json.load(fp)["pid"]
+                if _is_alive(pid):
+                    os.kill(pid, signal.SIGTERM)
+                    stopped += 1
+            except (OSError, ValueError, KeyError):
+                pass
+            os.remove(os.path.join(pool_dir, name))
+    return stopped
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] != "stop":
+        sys.exit("Usage: python simavrpool.py stop <pool directory>")
+    print("Stopped %d simavr servers" % stop_servers(sys.argv[2]))
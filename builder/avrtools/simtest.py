@@ -0,0 +1,275 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+#
+# Headless test runs on simavr. simavr prints the output of the first UART
+# line by line on its standard output, which is the result channel: a
+# program passes when it prints a Unity summary without failures, or when
+# it stops by itself (sleep with interrupts disabled) without crashing.
+#
+# The module has no dependencies on the build environment and also runs as
+# a script, e.g. as `test_testing_command` of `pio test`:
+#
+#   python simtest.py --simavr <path> -m atmega328p -f 16000000L program.elf
+#
+
+import argparse
+import glob
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+try:
+    import pty
+except ImportError:  # Windows
+    pty = None
+
+MAX_JOBS = 32
+DEFAULT_TIMEOUT = 30
+
+ANSI_RE = re.compile(r"\x1b\[[0-9;]*[A-Za-z]")
+SUMMARY_RE = re.compile(r"^(\d+) Tests (\d+) Failures (\d+) Ignored")
+FAILURE_RE = re.compile(r"^[^:\s][^:]*:\d+:[^:]+:FAIL\b")
+CRASH_RE = re.compile(r"sadly_crashed|invalid opcode", re.I)
+
+
+def resolve_programs(patterns, base_dir=None):
+    """Expands a comma or whitespace separated list of paths and patterns"""
+    if isinstance(patterns, (list, tuple)):
+        items = [str(item) for item in patterns]
+    else:
+        items = re.split(r"[\s,]+", str(patterns or ""))
+    result = []
+    for item in items:
+        if not item:
+            continue
+        if base_dir and not os.path.isabs(item):
+            item = os.path.join(base_dir, item)
+        candidates = sorted(glob.glob(item)) if glob.has_magic(item) else [item]
+        result.extend(path for path in candidates if path not in result)
+    return result
+
+
+def get_command(simavr, mcu, f_cpu, program):
+    return [simavr, "-m", mcu, "-f", str(f_cpu), program]
+
+
+def parse_output(lines):
+    """Returns the Unity counts and the failed tests found in `lines`"""
+    result = dict(tests=None, failures=None, ignored=None, failed_tests=[])
+    for line in lines:
+        match = SUMMARY_RE.match(line)
+        if match:
+            result["tests"], result["failures"], result["ignored"] = (
+                int(value) for value in match.groups()
+            )
+        elif FAILURE_RE.match(line):
+            result["failed_tests"].append(line)
+    return result
+
+
+def _spawn(cmd):
+    """Returns the process and the descriptor of its output. simavr prints
+    with stdio, which flushes every line only when the output is a terminal."""
+    if not pty:
+        proc = subprocess.Popen(  # pylint: disable=consider-using-with
+            cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+        )
+        return proc, proc.stdout.fileno()
+    master, slave = pty.openpty()
+    try:
+        proc = subprocess.Popen(  # pylint: disable=consider-using-with
+            cmd, stdin=subprocess.DEVNULL, stdout=slave, stderr=slave
+        )
+    except OSError:
+        os.close(master)
+        raise
+    finally:
+        os.close(slave)
+    return proc, master
+
+
+def _read_lines(fd):
+    buffer = b""
+    while True:
+        try:
+            chunk = os.read(fd, 4096)
+        except OSError:  # EIO, the terminal was closed
+            chunk = b""
+        if not chunk:
+            break
+        buffer += chunk
+        while b"\n" in buffer:
+            line, buffer = buffer.split(b"\n", 1)
+            yield line
+    if buffer:
+        yield buffer
+
+
+def run_program(cmd, timeout=None, on_line=None):
+    """Runs one simulator process until the program stops, prints a Unity
+    summary or runs out of `timeout` seconds"""
+    started = time.monotonic()
+    result = dict(program=cmd[-1], cmd=cmd, returncode=None, status="error", log="")
+    result.update(parse_output([]))
+    try:
+        proc, fd = _spawn(cmd)
+    except OSError as exc:
+        result.update(log=str(exc), elapsed=0.0)
+        return result
+
+    timed_out = threading.Event()
+
+    def _on_timeout():
+        timed_out.set()
+        proc.kill()
+
+    timer = threading.Timer(timeout, _on_timeout) if timeout else None
+    if timer:
+        timer.start()
+    lines = []
+    crashed = False
+    try:
+        for raw_line in _read_lines(fd):
+            line = ANSI_RE.sub("", raw_line.decode(errors="replace")).rstrip("\r\n")
+            lines.append(line)
+            if on_line:
+                on_line(line)
+            crashed = crashed or bool(CRASH_RE.search(line))
+            # Test programs usually idle in `loop()` after the summary
+            if SUMMARY_RE.match(line):
+                proc.kill()
+                break
+        result["returncode"] = proc.wait()
+    finally:
+        if timer:
+            timer.cancel()
+        if proc.stdout:
+            proc.stdout.close()
+        else:
+            os.close(fd)
+
+    result.update(parse_output(lines))
+    result["log"] = "\n".join(lines)
+    if result["tests"] is not None:
+        result["status"] = "failed" if result["failures"] else "passed"
+    elif timed_out.is_set():
+        result["status"] = "timeout"
+        result["log"] += "\nTimed out after %s seconds" % timeout
+    elif crashed:
+        result["status"] = "crashed"
+    elif result["returncode"] == 0:
+        result["status"] = "passed"
+    result["elapsed"] = round(time.monotonic() - started, 3)
+    return result
+
+
+def run_parallel(commands, jobs=None, timeout=None, on_result=None):
+    """Runs one simulator process per program, at most `jobs` at a time.
+
+    Results are returned in the order of `commands`, `on_result` is called as
+    soon as each program finishes.
+    """
+    if not commands:
+        return []
+    jobs = max(1, min(int(jobs or os.cpu_count() or 1), MAX_JOBS, len(commands)))
+    results = [None] * len(commands)
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {
+            executor.submit(run_program, cmd, timeout): index
+            for index, cmd in enumerate(commands)
+        }
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+            if on_result:
+                on_result(results[futures[future]])
+    return results
+
+
+def format_result(result):
+    text = "%-8s %7.2fs  %s" % (
+        result["status"].upper(),
+        result["elapsed"],
+        result["program"],
+    )
+    if result["tests"] is not None:
+        text += "  (%d tests, %d failures, %d ignored)" % (
+            result["tests"],
+            result["failures"],
+            result["ignored"],
+        )
+    return text
+
+
+def format_summary(results):
+    counts = {}
+    for result in results:
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+    return "%d programs: %s, %.2f seconds of simulator time" % (
+        len(results),
+        ", ".join(
+            "%d %s" % (counts[status], status)
+            for status in ("passed", "failed", "crashed", "timeout", "error")
+            if counts.get(status)
+        ),
+        sum(result["elapsed"] for result in results),
+    )
+
+
+def print_report(results, failed_tests=True):
+    """Prints the logs of the programs that did not finish, the failed
+    tests and the summary. Returns True when all programs passed."""
+    for result in results:
+        if result["status"] not in ("passed", "failed"):
+            sys.stderr.write("\n%s:\n%s\n" % (result["program"], result["log"]))
+        for line in result["failed_tests"] if failed_tests else []:
+            print(line)
+    print(format_summary(results))
+    return all(result["status"] == "passed" for result in results)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run programs on simavr")
+    parser.add_argument("--simavr", default="simavr")
+    parser.add_argument("-m", "--mcu", required=True)
+    parser.add_argument("-f", "--f-cpu", required=True)
+    parser.add_argument("-j", "--jobs", type=int)
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT)
+    parser.add_argument("programs", nargs="+")
+    args = parser.parse_args(argv)
+
+    commands = [
+        get_command(args.simavr, args.mcu, args.f_cpu, program)
+        for program in resolve_programs(args.programs)
+    ]
+    if len(commands) == 1:
+        # Streams the output, e.g. to the Unity reader of `pio test`
+        results = [run_program(commands[0], args.timeout, print)]
+    else:
+        results = run_parallel(
+            commands,
+            args.jobs,
+            args.timeout,
+            lambda result: print(format_result(result)),
+        )
+    # The streamed output already shows the failed tests of a single program
+    return 0 if print_report(results, failed_tests=len(results) > 1) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,500 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+#
+# Flash and RAM usage per symbol, object file and library.
+#
+# Symbols come from the ELF symbol table. Object files come from the link
+# map, which also covers data without symbols such as string literals. The
+# map of an LTO link names the temporary ltrans objects instead of the
+# inputs; global symbols found there are traced back to the input objects
+# through their LTO symbol tables, the rest is reported as `(lto)`.
+#
+
+import bisect
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import time
+
+from avrtools import elf
+
+CATEGORIES = ("text", "data", "bss")
+SECTION_CATEGORIES = {
+    ".text": "text",
+    ".data": "data",
+    ".bss": "bss",
+    ".noinit": "bss",
+}
+LTO_OBJECT = "(lto)"
+LINKER_OBJECT = "(linker)"
+SNAPSHOT_FORMAT = 1
+MAX_SNAPSHOTS = 20
+
+OUTPUT_SECTION_RE = re.compile(r"^(\.\S+)")
+INPUT_SECTION_RE = re.compile(
+    r"^ (\S+)(?:\s+0x([0-9a-fA-F]+)\s+0x([0-9a-fA-F]+)(?:\s+(\S.*?))?)?\s*$"
+)
+CONTINUATION_RE = re.compile(
+    r"^\s+0x([0-9a-fA-F]+)\s+0x([0-9a-fA-F]+)(?:\s+(\S.*?))?\s*$"
+)
+ARCHIVE_MEMBER_RE = re.compile(r"^(.*)\(([^()]+)\)$")
+LTRANS_RE = re.compile(r"\.ltrans(\d+\.ltrans)?\.o$")
+
+
+def parse_map(lines):
+    """Returns the input sections of the program as `(category, address,
+    size, path)` and the files loaded by the linker"""
+    sections = []
+    loaded = []
+    category = None
+    pending = False
+
+    def _add(address, size, path):
+        if int(size, 16):
+            sections.append((category, int(address, 16), int(size, 16), path))
+
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if line.startswith("LOAD "):
+            loaded.append(line[5:].strip())
+            continue
+        if line and line[0] not in " \t":
+            match = OUTPUT_SECTION_RE.match(line)
+            category = SECTION_CATEGORIES.get(match.group(1)) if match else None
+            pending = False
+            continue
+        if not category:
+            continue
+        if pending:
+            pending = False
+            match = CONTINUATION_RE.match(line)
+            if match:
+                _add(*match.groups())
+                continue
+        match = INPUT_SECTION_RE.match(line)
+        if not match or match.group(1).startswith("*("):
+            continue
+        if match.group(2) is None:
+            # A long section name is followed by its address on the next line
+            pending = True
+            continue
+        _add(*match.groups()[1:])
+    return sections, loaded
+
+
+def read_archive(path):
+    """Returns the members of a GNU or BSD `ar` archive"""
+    with open(path, "rb") as fp:
+        data = fp.read()
+    if not data.startswith(b"!<arch>\n"):
+        return {}
+    members = {}
+    long_names = b""
+    offset = 8
+    while offset + 60 <= len(data):
+        name = data[offset : offset + 16].decode(errors="replace").rstrip()
+        size = int(data[offset + 48 : offset + 58].strip() or 0)
+        body = data[offset + 60 : offset + 60 + size]
+        offset += 60 + size + (size & 1)
+        if name == "//":
+            long_names = body
+            continue
+        if name in ("/", "/SYM64/", "__.SYMDEF", "__.SYMDEF SORTED"):
+            continue
+        if name.startswith("#1/"):
+            name_size = int(name[3:])
+            name = body[:name_size].rstrip(b"\0").decode(errors="replace")
+            body = body[name_size:]
+        elif name.startswith("/") and name[1:].isdigit():
+            start = int(name[1:])
+            end = long_names.find(b"\n", start)
+            name = long_names[start : end if end >= 0 else None].decode(
+                errors="replace"
+            )
+        members[name.rstrip("/")] = body
+    return members
+
+
+def parse_lto_symtab(data):
+    """Returns the symbols defined in a GCC LTO symbol table, its entries are
+    name, comdat group, kind, visibility, 8 bytes size and 4 bytes slot"""
+    names = []
+    offset = 0
+    while offset < len(data):
+        name_end = data.index(b"\0", offset)
+        comdat_end = data.index(b"\0", name_end + 1)
+        # 0: definition, 1: weak definition, 4: common
+        if data[comdat_end + 1] in (0, 1, 4):
+            names.append(data[offset:name_end].decode(errors="replace"))
+        offset = comdat_end + 15
+    return names
+
+
+def get_defined_symbols(data):
+    try:
+        elf_file = elf.ElfFile(data)
+        lto_symtabs = [
+            section
+            for section in elf_file.sections
+            if section.name.startswith(".gnu.lto_.symtab")
+        ]
+        if lto_symtabs:
+            return [
+                name
+                for section in lto_symtabs
+                for name in parse_lto_symtab(elf_file.get_contents(section))
+            ]
+        return [
+            symbol.name
+            for symbol in elf_file.get_symbols()
+            if symbol.section
+            and symbol.bind in (1, 2)  # global, weak
+            and symbol.type in (elf.STT_OBJECT, elf.STT_FUNC)
+        ]
+    except (ValueError, IndexError):
+        return []
+
+
+def build_lto_index(loaded, project_dir, build_dir):
+    """Maps the global symbols of the objects built by the project to the
+    objects, as `path` or `archive(member)` like in the link map"""
+    index = {}
+    for path in loaded:
+        full_path = os.path.join(project_dir, path)
+        if os.path.relpath(full_path, build_dir).startswith(".."):
+            continue
+        try:
+            if path.endswith(".a"):
+                objects = {
+                    "%s(%s)" % (path, name): data
+                    for name, data in read_archive(full_path).items()
+                }
+            else:
+                with open(full_path, "rb") as fp:
+                    objects = {path: fp.read()}
+        except OSError:
+            continue
+        for object_path, data in objects.items():
+            for name in get_defined_symbols(data):
+                index.setdefault(name, object_path)
+    return index
+
+
+def get_object_name(path, project_dir):
+    if path in (LTO_OBJECT, LINKER_OBJECT):
+        return path
+    match = ARCHIVE_MEMBER_RE.match(path)
+    if match:
+        return "%s(%s)" % (os.path.basename(match.group(1)), match.group(2))
+    if os.path.isabs(path):
+        relpath = os.path.relpath(path, project_dir)
+        return os.path.basename(path) if relpath.startswith("..") else relpath
+    return path
+
+
+def get_library(path, project_dir, build_dir):
+    """`src` for the project sources, the archive name for libraries"""
+    if path in (LTO_OBJECT, LINKER_OBJECT):
+        return path
+    match = ARCHIVE_MEMBER_RE.match(path)
+    full_path = os.path.join(project_dir, match.group(1) if match else path)
+    in_build_dir = not os.path.relpath(full_path, build_dir).startswith("..")
+    if match:
+        name = os.path.basename(match.group(1))
+        if name.endswith(".a"):
+            name = name[:-2]
+        return name[3:] if in_build_dir and name.startswith("lib") else name
+    if in_build_dir:
+        return os.path.relpath(full_path, build_dir).split(os.sep)[0]
+    return "toolchain"
+
+
+def demangle(names, path=None):
+    """Returns the readable C++ names, `avr-c++filt` is run once"""
+    executable = shutil.which("avr-c++filt", path=path)
+    names = list(names)
+    if not executable or not names:
+        return {name: name for name in names}
+    try:
+        output = subprocess.run(
+            [executable],
+            input="\n".join(names).encode(),
+            stdout=subprocess.PIPE,
+            check=True,
+        ).stdout.decode(errors="replace")
+    except (OSError, subprocess.CalledProcessError):
+        return {name: name for name in names}
+    demangled = output.splitlines()
+    if len(demangled) != len(names):
+        return {name: name for name in names}
+    return dict(zip(names, demangled))
+
+
+def create_report(  # pylint: disable=too-many-arguments
+    elf_file, map_path, project_dir, build_dir, path=None, with_symbols=True
+):
+    """Returns the usage per library, object and symbol. `path` is searched
+    for `avr-c++filt`, `with_symbols=False` leaves the symbols out."""
+    # pylint: disable=too-many-locals,too-many-branches
+    totals = dict.fromkeys(CATEGORIES, 0)
+    for section in elf_file.sections:
+        if section.is_alloc and section.name in SECTION_CATEGORIES:
+            totals[SECTION_CATEGORIES[section.name]] += section.size
+
+    input_sections, loaded = [], []
+    if map_path and os.path.isfile(map_path):
+        with open(map_path, encoding="utf8", errors="replace") as fp:
+            input_sections, loaded = parse_map(fp)
+    by_category = {category: [] for category in CATEGORIES}
+    for item in sorted(input_sections, key=lambda item: item[1]):
+        by_category[item[0]].append(item)
+    starts = {
+        category: [item[1] for item in items]
+        for category, items in by_category.items()
+    }
+
+    objects = {}
+
+    def _count(object_path, category, size):
+        sizes = objects.setdefault(object_path, dict.fromkeys(CATEGORIES, 0))
+        sizes[category] += size
+
+    lto_index = None
+    lto_remainders = {}
+    symbols = {}
+    seen = set()
+    for symbol in elf_file.get_symbols():
+        if not symbol.size or not symbol.section:
+            continue
+        if symbol.type not in (elf.STT_OBJECT, elf.STT_FUNC):
+            continue
+        category = SECTION_CATEGORIES.get(symbol.section.name)
+        if not category or (symbol.value, symbol.size, category) in seen:
+            continue
+        seen.add((symbol.value, symbol.size, category))
+
+        object_path = LINKER_OBJECT
+        index = bisect.bisect_right(starts[category], symbol.value) - 1
+        if index >= 0:
+            item = by_category[category][index]
+            if symbol.value < item[1] + item[2] and item[3]:
+                object_path = item[3]
+        if LTRANS_RE.search(object_path):
+            if lto_index is None:
+                lto_index = build_lto_index(loaded, project_dir, build_dir)
+            key = (category, index)
+            lto_remainders.setdefault(key, by_category[category][index][2])
+            object_path = lto_index.get(symbol.name) or lto_index.get(
+                symbol.name.split(".")[0], LTO_OBJECT
+            )
+            if object_path != LTO_OBJECT:
+                lto_remainders[key] -= symbol.size
+                _count(object_path, category, symbol.size)
+
+        symbol_key = "%s@%s" % (symbol.name, object_path)
+        if symbol_key in symbols:
+            symbols[symbol_key]["size"] += symbol.size
+        else:
+            symbols[symbol_key] = dict(
+                name=symbol.name, object=object_path, section=category, size=symbol.size
+            )
+
+    for category, items in by_category.items():
+        for index, (_, _, size, object_path) in enumerate(items):
+            if not object_path:
+                _count(LINKER_OBJECT, category, size)
+            elif LTRANS_RE.search(object_path):
+                remainder = lto_remainders.get((category, index), size)
+                _count(LTO_OBJECT, category, remainder)
+            else:
+                _count(object_path, category, size)
+    for category in CATEGORIES:
+        # Alignment, padding and everything not covered by the map
+        counted = sum(sizes[category] for sizes in objects.values())
+        if totals[category] > counted:
+            _count(LINKER_OBJECT, category, totals[category] - counted)
+
+    report = dict(
+        format=SNAPSHOT_FORMAT,
+        id=hashlib.sha1(elf_file.data).hexdigest(),
+        created=int(time.time()),
+        totals=totals,
+        libraries={},
+        objects={},
+        symbols={},
+    )
+    for object_path, sizes in objects.items():
+        if not any(sizes.values()):
+            continue
+        library = get_library(object_path, project_dir, build_dir)
+        report["objects"][get_object_name(object_path, project_dir)] = dict(
+            sizes, library=library
+        )
+        library_sizes = report["libraries"].setdefault(
+            library, dict.fromkeys(CATEGORIES, 0)
+        )
+        for category in CATEGORIES:
+            library_sizes[category] += sizes[category]
+    if not with_symbols:
+        return report
+    names = demangle(sorted(set(item["name"] for item in symbols.values())), path)
+    for item in symbols.values():
+        object_name = get_object_name(item["object"], project_dir)
+        report["symbols"]["%s@%s" % (item["name"], object_name)] = dict(
+            item, name=names[item["name"]], object=object_name
+        )
+    return report
+
+
+def get_usage(item):
+    """Returns flash and RAM bytes of a library, object or symbol"""
+    sizes = item if "section" not in item else {item["section"]: item["size"]}
+    return (
+        sizes.get("text", 0) + sizes.get("data", 0),
+        sizes.get("data", 0) + sizes.get("bss", 0),
+    )
+
+
+def get_growers(previous, current):
+    """Returns `(key, flash delta, RAM delta)` of the grown items"""
+    result = []
+    for key in set(previous) | set(current):
+        old = get_usage(previous.get(key, {}))
+        new = get_usage(current.get(key, {}))
+        delta = (new[0] - old[0], new[1] - old[1])
+        if delta[0] > 0 or delta[1] > 0:
+            result.append((key, delta[0], delta[1]))
+    return sorted(result, key=lambda item: (-(item[1] + item[2]), item[0]))
+
+
+class SnapshotStore:
+    def __init__(self, root, max_snapshots=MAX_SNAPSHOTS):
+        self.root = root
+        self.max_snapshots = max_snapshots
+
+    def _list(self):
+        if not os.path.isdir(self.root):
+            return []
+        paths = [
+            os.path.join(self.root, name)
+            for name in os.listdir(self.root)
+            if name.endswith(".json")
+        ]
+        return sorted(paths, key=os.path.getmtime, reverse=True)
+
+    def load_previous(self, report_id):
+        """Returns the newest snapshot of another build or None"""
+        for path in self._list():
+            if os.path.basename(path) == report_id + ".json":
+                continue
+            try:
+                with open(path, encoding="utf8") as fp:
+                    snapshot = json.load(fp)
+            except (OSError, ValueError):
+                continue
+            if snapshot.get("format") == SNAPSHOT_FORMAT:
+                return snapshot
+        return None
+
+    def save(self, report):
+        os.makedirs(self.root, exist_ok=True)
+        path = os.path.join(self.root, report["id"] + ".json")
+        with open(path + ".tmp", "w", encoding="utf8") as fp:
+            json.dump(report, fp)
+        os.replace(path + ".tmp", path)
+        for stale_path in self._list()[self.max_snapshots :]:
+            os.remove(stale_path)
+        return path
+
+
+def format_report(report, previous=None, top=10):
+    totals = report["totals"]
+    flash, ram = get_usage(totals)
+    lines = [
+        "Flash: %d bytes (text %d, data %d), RAM: %d bytes (data %d, bss %d)"
+        % (flash, totals["text"], totals["data"], ram, totals["data"], totals["bss"])
+    ]
+
+    def _table(title, items, name_width=40):
+        lines.append("")
+        lines.append(
+            "%-*s %8s %8s %8s %8s" % (name_width, title, "text", "data", "bss", "RAM")
+        )
+        for name, sizes in items:
+            lines.append(
+                "%-*s %8d %8d %8d %8d"
+                % (
+                    name_width,
+                    name,
+                    sizes.get("text", 0),
+                    sizes.get("data", 0),
+                    sizes.get("bss", 0),
+                    get_usage(sizes)[1],
+                )
+            )
+
+    def _largest(items, index=None):
+        def _size(item):
+            usage = get_usage(item[1])
+            return usage[index] if index is not None else sum(usage)
+
+        return sorted(
+            (item for item in items.items() if _size(item)),
+            key=lambda item: (-_size(item), item[0]),
+        )[:top]
+
+    _table("Library", _largest(report["libraries"]))
+    _table("Object", _largest(report["objects"]))
+    for title, index in (("flash", 0), ("RAM", 1)):
+        lines.append("")
+        lines.append("Largest symbols in %s:" % title)
+        for _, item in _largest(report["symbols"], index):
+            lines.append(
+                "%8d  %-5s %s (%s)"
+                % (
+                    get_usage(item)[index],
+                    item["section"],
+                    item["name"],
+                    item["object"],
+                )
+            )
+
+    if previous:
+        old_flash, old_ram = get_usage(previous["totals"])
+        lines.append("")
+        lines.append(
+            "Since %s: flash %+d bytes, RAM %+d bytes"
+            % (
+                time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(previous["created"])),
+                flash - old_flash,
+                ram - old_ram,
+            )
+        )
+        for title, key in (("libraries", "libraries"), ("symbols", "symbols")):
+            growers = get_growers(previous[key], report[key])[:top]
+            if not growers:
+                continue
+            lines.append("Top growing %s:" % title)
+            for name, flash_delta, ram_delta in growers:
+                item = report[key].get(name) or previous[key][name]
+                if key == "symbols":
+                    name = "%s (%s)" % (item["name"], item["object"])
+                lines.append(
+                    "  flash %+7d  RAM %+6d  %s" % (flash_delta, ram_delta, name)
+                )
+    return "\n".join(lines)
@@ -0,0 +1,77 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+#
+# Flash, RAM and EEPROM usage computed from ELF section headers
+#
+
+PROGRAM_SECTIONS = (".text", ".data", ".bootloader")
+DATA_SECTIONS = (".data", ".bss", ".noinit")
+EEPROM_SECTIONS = (".eeprom",)
+
+
+def get_section_sizes(elf_file):
+    return {
+        section.name: section.size
+        for section in elf_file.sections
+        if section.is_alloc and section.size
+    }
+
+
+def calculate_usage(
+    elf_file,
+    program_sections=PROGRAM_SECTIONS,
+    data_sections=DATA_SECTIONS,
+    eeprom_sections=EEPROM_SECTIONS,
+    maximum_sizes=None,
+):
+    sections = get_section_sizes(elf_file)
+    maximum_sizes = maximum_sizes or {}
+    result = dict(sections=sections)
+    for group, names in (
+        ("program", program_sections),
+        ("data", data_sections),
+        ("eeprom", eeprom_sections),
+    ):
+        result[group] = dict(
+            size=sum(sections.get(name, 0) for name in names),
+            maximum=maximum_sizes.get(group) or None,
+            sections=list(names),
+        )
+    return result
+
+
+def format_available_bytes(value, total):
+    percent_raw = float(value) / float(total)
+    blocks_per_progress = 10
+    used_blocks = min(
+        int(round(blocks_per_progress * percent_raw)), blocks_per_progress
+    )
+    return "[{:{}}] {: 6.1%} (used {:d} bytes from {:d} bytes)".format(
+        "=" * used_blocks, blocks_per_progress, percent_raw, value, total
+    )
+
+
+def format_memory_usage(usage, mcu):
+    """Human summary in the layout of `avr-size --mcu=... -C`"""
+    lines = ["AVR Memory Usage", "----------------", "Device: %s" % mcu, ""]
+    for title, group in (("Program", "program"), ("Data", "data"), ("EEPROM", "eeprom")):
+        info = usage[group]
+        if group == "eeprom" and not info["size"]:
+            continue
+        line = "%-8s%8d bytes" % (title + ":", info["size"])
+        if info["maximum"]:
+            line += " (%2.1f%% Full)" % (100.0 * info["size"] / info["maximum"])
+        lines.extend([line, "(%s)" % " + ".join(info["sections"]), ""])
+    return "\n".join(lines)
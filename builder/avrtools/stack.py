@@ -0,0 +1,230 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+#
+# Worst-case stack depth of the linked program.
+#
+# The code of every function is decoded to find its frame (pushed registers,
+# `rcall .+0` and the frame allocated through the Y pointer) and its calls.
+# The deepest call chain from `main` plus the deepest interrupt handler
+# (`__vector_N`, not nested) is the worst case. An indirect call is assumed
+# to reach the deepest function that is never called directly, which is
+# where callbacks and virtual methods end up. Recursion can not be bounded,
+# such programs are reported with the depth of one pass.
+#
+
+import bisect
+
+from avrtools import elf
+
+SPL = 0x3D
+
+ENTRY_POINT = "main"
+VECTOR_PREFIX = "__vector_"
+
+
+class Function:
+    def __init__(self, name, address, size):
+        self.name = name
+        self.address = address
+        self.size = size
+        self.frame = 0
+        # (target address, return address pushed)
+        self.calls = []
+        self.indirect_calls = 0
+
+
+def _decode_offset(word, bits):
+    offset = word & ((1 << bits) - 1)
+    return offset - (1 << bits) if offset & (1 << (bits - 1)) else offset
+
+
+def decode_function(function, code, pc_size):
+    """Fills the frame size and the calls of `function` from its code"""
+    frame_allocation = 0
+    index = 0
+    end = function.address + function.size
+    while index + 1 < len(code):
+        word = code[index] | code[index + 1] << 8
+        address = function.address + index
+        index += 2
+        # call, jmp, lds and sts have a second word
+        if (word & 0xFE0C) == 0x940C or (word & 0xFC0F) == 0x9000:
+            if (word & 0xFE0C) == 0x940C and index + 1 < len(code):
+                target = (
+                    (((word >> 3) & 0x3E) | (word & 1)) << 16
+                    | code[index]
+                    | code[index + 1] << 8
+                ) * 2
+                is_call = bool(word & 0x2)
+                if is_call or not function.address <= target < end:
+                    function.calls.append((target, is_call))
+            index += 2
+        elif (word & 0xF000) == 0xD000:  # rcall
+            offset = _decode_offset(word, 12)
+            if offset == 0:
+                # `rcall .+0` reserves stack space for the frame
+                function.frame += pc_size
+            else:
+                function.calls.append((address + 2 + offset * 2, True))
+        elif (word & 0xF000) == 0xC000:  # rjmp
+            target = address + 2 + _decode_offset(word, 12) * 2
+            if not function.address <= target < end:
+                function.calls.append((target, False))
+        elif (word & 0xFE0F) == 0x920F:  # push
+            function.frame += 1
+        elif word in (0x9509, 0x9519):  # icall, eicall
+            function.indirect_calls += 1
+        elif (word & 0xFF30) == 0x9720:  # sbiw r28, K
+            frame_allocation += ((word >> 2) & 0x30) | (word & 0xF)
+        elif (word & 0xF0F0) == 0x50C0:  # subi r28, K
+            frame_allocation += ((word >> 4) & 0xF0) | (word & 0xF)
+        elif (word & 0xF0F0) == 0x40D0:  # sbci r29, K
+            frame_allocation += (((word >> 4) & 0xF0) | (word & 0xF)) << 8
+        elif (word & 0xF800) == 0xB800:  # out A, Rr
+            if (((word >> 5) & 0x30) | (word & 0xF)) == SPL:
+                # The frame is allocated when SP is written. `subi`/`sbci`
+                # subtract a 16-bit constant, a negative one (or an `adiw`)
+                # frees the frame in the epilogue.
+                frame_allocation &= 0xFFFF
+                if frame_allocation < 0x8000:
+                    function.frame += frame_allocation
+                frame_allocation = 0
+    return function
+
+
+def load_functions(elf_file, pc_size):
+    functions = {}
+    for symbol in elf_file.get_symbols():
+        if symbol.type != elf.STT_FUNC or not symbol.size or not symbol.section:
+            continue
+        if symbol.value in functions or symbol.section.name != ".text":
+            continue
+        code = elf_file.get_contents(symbol.section)
+        offset = symbol.value - symbol.section.addr
+        functions[symbol.value] = decode_function(
+            Function(symbol.name, symbol.value, symbol.size),
+            code[offset : offset + symbol.size],
+            pc_size,
+        )
+    return functions
+
+
+class StackAnalysis:
+    def __init__(self, elf_file, pc_size=2):
+        self.pc_size = pc_size
+        self.functions = load_functions(elf_file, pc_size)
+        self._addresses = sorted(self.functions)
+        self._depths = {}
+        self.recursive = set()
+        self._indirect_depth = None
+
+    def find_function(self, address):
+        index = bisect.bisect_right(self._addresses, address) - 1
+        if index < 0:
+            return None
+        function = self.functions[self._addresses[index]]
+        return function if address < function.address + function.size else None
+
+    def get_function(self, name):
+        return next(
+            (item for item in self.functions.values() if item.name == name), None
+        )
+
+    def get_indirect_depth(self):
+        """Depth of the deepest function that is never called directly"""
+        if self._indirect_depth is None:
+            self._indirect_depth = (0, [])
+            called = set()
+            for function in self.functions.values():
+                for target, _ in function.calls:
+                    callee = self.find_function(target)
+                    if callee:
+                        called.add(callee.address)
+            for function in self.functions.values():
+                if function.address in called or function.indirect_calls:
+                    continue
+                if function.name == ENTRY_POINT or function.name.startswith(
+                    VECTOR_PREFIX
+                ):
+                    continue
+                depth = self.get_depth(function)
+                if depth[0] > self._indirect_depth[0]:
+                    self._indirect_depth = depth
+        return self._indirect_depth
+
+    def get_depth(self, function, visiting=None):
+        """Returns the worst stack depth of `function` and its callees and
+        the call chain that reaches it"""
+        if function.address in self._depths:
+            return self._depths[function.address]
+        visiting = visiting or set()
+        if function.address in visiting:
+            self.recursive.add(function.name)
+            return (0, [])
+        visiting.add(function.address)
+        deepest = (0, [])
+        for target, is_call in function.calls:
+            callee = self.find_function(target)
+            if not callee:
+                depth = (self.pc_size if is_call else 0, [])
+            else:
+                callee_depth = self.get_depth(callee, visiting)
+                depth = (
+                    callee_depth[0] + (self.pc_size if is_call else 0),
+                    callee_depth[1],
+                )
+            if depth[0] > deepest[0]:
+                deepest = depth
+        if function.indirect_calls:
+            indirect_depth = self.get_indirect_depth()
+            if indirect_depth[0] + self.pc_size > deepest[0]:
+                deepest = (
+                    indirect_depth[0] + self.pc_size,
+                    ["(indirect)"] + indirect_depth[1],
+                )
+        visiting.discard(function.address)
+        result = (function.frame + deepest[0], [function.name] + deepest[1])
+        self._depths[function.address] = result
+        return result
+
+    def analyze(self):
+        """Returns the worst case of the program: `main` called from the
+        startup code plus the deepest interrupt handler"""
+        main = self.get_function(ENTRY_POINT)
+        main_depth = (0, [])
+        if main:
+            depth = self.get_depth(main)
+            main_depth = (depth[0] + self.pc_size, depth[1])
+        interrupt_depth = (0, [])
+        for function in self.functions.values():
+            if not function.name.startswith(VECTOR_PREFIX):
+                continue
+            depth = self.get_depth(function)
+            if depth[0] + self.pc_size > interrupt_depth[0]:
+                interrupt_depth = (depth[0] + self.pc_size, depth[1])
+        return dict(
+            size=main_depth[0] + interrupt_depth[0],
+            main=dict(size=main_depth[0], chain=main_depth[1]),
+            interrupt=dict(size=interrupt_depth[0], chain=interrupt_depth[1]),
+            indirect_calls=sorted(
+                item.name for item in self.functions.values() if item.indirect_calls
+            ),
+            recursive=sorted(self.recursive),
+        )
+
+
+def get_pc_size(flash_size):
+    """Devices with more than 128 KB of flash push 3 byte return addresses"""
+    return 3 if int(flash_size) > 128 * 1024 else 2
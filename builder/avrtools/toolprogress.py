@@ -0,0 +1,279 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+#
+# Incremental parser of avrdude and micronucleus console output.
+#
+# Text is fed in arbitrary chunks as it arrives and nothing is buffered for
+# display, so the parser adds no latency to the console. It emits events:
+#
+#   session_start   a tool run begins
+#   sync            the tool talks to the target, `elapsed`, `retries`
+#   phase_start     `phase` (read, write, verify, erase) of a `memory`
+#   progress        `percent` of the current phase
+#   phase_end       `bytes`, `elapsed` and `throughput` (bytes/s)
+#   error           a tool error line
+#   session_end     summary of the run
+#
+# This module has no dependencies, platform.py loads it by path.
+#
+
+import re
+import time
+
+MEMORIES = r"flash|eeprom|[hle]?fuse\d*|lock|signature|calibration"
+
+SESSION_START_RE = re.compile(
+    r"^(?:avrdude(?:\.exe)?\s+-|micronucleus(?:\.exe)?\s+-|Uploading |"
+    r"Setting fuses|Reading fuses|Programming )"
+)
+SESSION_END_RE = re.compile(r"avrdude:? done|Micronucleus done", re.I)
+READY_RE = re.compile(
+    r"AVR device initialized|Device signature|> Device is found", re.I
+)
+# avrdude follows every "programmer is not responding" with the numbered
+# sync attempt, one retry is counted per attempt line
+RETRY_RE = re.compile(r"not in sync|attempt \d+ of \d+|Device not found", re.I)
+ERROR_RE = re.compile(
+    r"verification error|content mismatch|error:|can't open device|"
+    r"initialization failed",
+    re.I,
+)
+PHASE_RES = (
+    (
+        "write",
+        re.compile(
+            r"writing\s+(?:(?P<size>\d+)\s+bytes?\s+(?:to\s+)?)?(?P<memory>%s)\b"
+            r"(?:\s+\((?P<size2>\d+)\s+bytes?\))?" % MEMORIES,
+            re.I,
+        ),
+    ),
+    (
+        "verify",
+        re.compile(
+            r"verifying\s+(?:(?P<size>\d+)\s+bytes?\s+of\s+)?(?P<memory>%s)\b"
+            % MEMORIES,
+            re.I,
+        ),
+    ),
+    (
+        "read",
+        re.compile(r"reading\s+(?:on-chip\s+)?(?P<memory>%s)\b" % MEMORIES, re.I),
+    ),
+    ("erase", re.compile(r"> Erasing the memory|erasing chip", re.I)),
+    ("write", re.compile(r"> Starting to upload", re.I)),
+)
+PHASE_DONE_RE = re.compile(
+    r"(?P<size>\d+)\s+bytes?\s+of\s+(?P<memory>\w+)\s+(?P<action>written|verified)",
+    re.I,
+)
+# avrdude bars are 50 `#`, micronucleus prints `writing: 42% complete`
+PERCENT_RE = re.compile(r"(\d{1,3})% complete")
+BAR_PREFIX_RE = re.compile(r"(Reading|Writing|Erasing) \|")
+
+
+class ProgressParser:
+    def __init__(self, on_event=None, expected_bytes=None, clock=time.monotonic):
+        self.on_event = on_event
+        self.expected_bytes = expected_bytes
+        self.clock = clock
+        self.sessions = []
+        self.session = None
+        self.phase = None
+        self._line = ""
+        self._bar = 0
+
+    def _emit(self, event_type, **data):
+        event = dict(type=event_type, time=self.clock(), **data)
+        if self.on_event:
+            self.on_event(event)
+        return event
+
+    def feed(self, text):
+        """Accepts any chunk of output, complete lines are not required"""
+        for char in text:
+            if char in "\r\n":
+                if self._line:
+                    self._process_line(self._line)
+                self._line = ""
+                self._bar = 0
+                continue
+            self._line += char
+            if char == "#" and self.phase and BAR_PREFIX_RE.match(self._line):
+                self._bar += 1
+                if self._bar % 5 == 0:
+                    self._emit(
+                        "progress", phase=self.phase["phase"], percent=self._bar * 2
+                    )
+
+    def close(self):
+        if self._line:
+            self._process_line(self._line)
+            self._line = ""
+        self._end_session()
+        return self.summary()
+
+    def _start_session(self, line):
+        tool = "micronucleus" if "micronucleus" in line.lower() else "avrdude"
+        # The action description and the echoed command start the same run
+        if self.session and not self.phase and not self.session["phases"]:
+            if self.session["sync"] is None:
+                self.session["tool"] = tool
+                return
+        self._end_session()
+        self.session = dict(
+            tool=tool,
+            start=self.clock(),
+            sync=None,
+            retries=0,
+            phases=[],
+            errors=[],
+        )
+        self._emit("session_start", tool=tool, command=line.strip())
+
+    def _end_session(self):
+        if not self.session:
+            return
+        self._end_phase()
+        self.session["elapsed"] = self.clock() - self.session["start"]
+        session = self.session
+        self._emit("session_end", summary=session)
+        self.sessions.append(session)
+        self.session = None
+
+    def _start_phase(self, phase, memory, size):
+        self._end_phase()
+        if self.session["sync"] is None:
+            self._mark_ready()
+        self.phase = dict(phase=phase, memory=memory, bytes=size, start=self.clock())
+        self._emit("phase_start", phase=phase, memory=memory, bytes=size)
+
+    def _end_phase(self, size=None):
+        phase = self.phase
+        if not phase:
+            return
+        self.phase = None
+        if size is not None:
+            phase["bytes"] = size
+        if (
+            phase["bytes"] is None
+            and phase["memory"] == "flash"
+            and phase["phase"] in ("write", "verify")
+        ):
+            phase["bytes"] = self.expected_bytes
+        phase["elapsed"] = self.clock() - phase["start"]
+        phase["throughput"] = (
+            phase["bytes"] / phase["elapsed"]
+            if phase["bytes"] and phase["elapsed"] > 0
+            else None
+        )
+        self.session["phases"].append(phase)
+        self._emit("phase_end", **phase)
+
+    def _mark_ready(self):
+        self.session["sync"] = self.clock() - self.session["start"]
+        self._emit(
+            "sync", elapsed=self.session["sync"], retries=self.session["retries"]
+        )
+
+    def _process_line(self, line):
+        if SESSION_START_RE.match(line):
+            self._start_session(line)
+            return
+        if not self.session:
+            if not re.search(r"avrdude|micronucleus|^> ", line, re.I):
+                return
+            self._start_session(line)
+        session = self.session
+        if line.startswith("> ") or "micronucleus" in line.lower():
+            session["tool"] = "micronucleus"
+
+        if RETRY_RE.search(line):
+            session["retries"] += 1
+        if ERROR_RE.search(line):
+            session["errors"].append(line.strip())
+            self._emit("error", line=line.strip())
+        if session["sync"] is None and READY_RE.search(line):
+            self._mark_ready()
+
+        match = PERCENT_RE.search(line)
+        if match and self.phase:
+            self._emit(
+                "progress", phase=self.phase["phase"], percent=int(match.group(1))
+            )
+            return
+
+        match = PHASE_DONE_RE.search(line)
+        if match and self.phase:
+            self._end_phase(int(match.group("size")))
+        elif re.search(r"writing output file|Starting the user app", line, re.I):
+            self._end_phase()
+        else:
+            for phase, pattern in PHASE_RES:
+                match = pattern.search(line)
+                if not match:
+                    continue
+                # verification reads the chip back as a part of its phase
+                if phase == "read" and self.phase and self.phase["phase"] == "verify":
+                    break
+                groups = match.groupdict()
+                size = groups.get("size") or groups.get("size2")
+                self._start_phase(
+                    phase,
+                    (groups.get("memory") or "flash").lower(),
+                    int(size) if size else None,
+                )
+                break
+
+        if SESSION_END_RE.search(line):
+            self._end_session()
+
+    def summary(self):
+        phases = []
+        for session in self.sessions:
+            for item in session["phases"]:
+                phases.append(dict(item, tool=session["tool"]))
+        return dict(
+            sessions=len(self.sessions),
+            sync=sum(session["sync"] or 0 for session in self.sessions),
+            retries=sum(session["retries"] for session in self.sessions),
+            errors=[line for session in self.sessions for line in session["errors"]],
+            phases=phases,
+        )
+
+
+def format_summary(summary):
+    items = []
+    for phase in summary["phases"]:
+        if phase["phase"] not in ("write", "verify") or not phase["bytes"]:
+            continue
+        if phase["memory"] not in ("flash", "eeprom"):
+            continue
+        text = "%s %s %d bytes in %.2f s" % (
+            phase["phase"],
+            phase["memory"],
+            phase["bytes"],
+            phase["elapsed"],
+        )
+        if phase["throughput"]:
+            text += " (%.0f B/s)" % phase["throughput"]
+        items.append(text)
+    if not items:
+        return None
+    text = ", ".join(items)
+    if summary["sync"]:
+        text += ", sync %.2f s" % summary["sync"]
+    if summary["retries"]:
+        text += ", sync retries: %d" % summary["retries"]
+    return text
@@ -0,0 +1,186 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+#
+# Optional per-run trace of upload phases.
+#
+# Enabled by `board_upload.trace = <path>` in platformio.ini or by the
+# PLATFORMIO_ATMELAVR_UPLOAD_TRACE environment variable. An existing
+# directory (or a path ending with a separator) gets one file per run.
+#
+
+import codecs
+import datetime
+import json
+import os
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+
+from avrtools import toolprogress
+
+TRACE_ENV_VAR = "PLATFORMIO_ATMELAVR_UPLOAD_TRACE"
+
+_TRACE = {}
+
+
+class UploadTrace:
+    def __init__(self, path, info=None):
+        self.path = path
+        self.info = dict(info or {})
+        self.started = time.monotonic()
+        self.started_at = datetime.datetime.now().astimezone().isoformat()
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name, **details):
+        entry = dict(name=name, start=self._offset(), **details)
+        entry["ok"] = True
+        try:
+            yield entry
+        except BaseException:
+            entry["ok"] = False
+            raise
+        finally:
+            entry["duration"] = round(self._offset() - entry["start"], 6)
+            self.phases.append(entry)
+            self.save()
+
+    def _offset(self):
+        return round(time.monotonic() - self.started, 6)
+
+    def run_command(self, name, cmd):
+        """Runs a shell command passing its output through. The output of
+        avrdude and micronucleus splits the phase into sync, write, verify,
+        read and erase sub-phases."""
+        with self.phase(name, command=cmd) as entry:
+            parser = toolprogress.ProgressParser(clock=self._offset)
+            parser.feed(cmd + "\n")
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+            proc = subprocess.Popen(  # pylint: disable=consider-using-with
+                cmd, shell=True, stderr=subprocess.PIPE
+            )
+            while True:
+                chunk = os.read(proc.stderr.fileno(), 4096)
+                if not chunk:
+                    break
+                text = decoder.decode(chunk)
+                sys.stderr.write(text)
+                sys.stderr.flush()
+                parser.feed(text)
+            entry["returncode"] = proc.wait()
+            entry["ok"] = entry["returncode"] == 0
+            summary = parser.close()
+            entry.update(
+                sync=summary["sync"],
+                sync_retries=summary["retries"],
+                errors=summary["errors"],
+                phases=summary["phases"],
+            )
+            return entry["returncode"]
+
+    def save(self):
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "w", encoding="utf8") as fp:
+            json.dump(
+                dict(
+                    self.info,
+                    started_at=self.started_at,
+                    total=self._offset(),
+                    phases=self.phases,
+                ),
+                fp,
+                indent=2,
+            )
+
+
+def get_trace_path(env):
+    path = os.getenv(TRACE_ENV_VAR, "")
+    if "BOARD" in env:
+        path = env.BoardConfig().get("upload.trace", path)
+    if not path:
+        return None
+    path = env.subst(str(path))
+    if os.path.isdir(path) or path.endswith(("/", os.sep)):
+        path = os.path.join(
+            path,
+            "%s-%s-%d.json"
+            % (
+                env.subst("$PIOENV"),
+                time.strftime("%Y%m%d-%H%M%S"),
+                os.getpid(),
+            ),
+        )
+    return os.path.abspath(path)
+
+
+def get_trace(env):
+    """Returns the trace of the current run or None when tracing is off"""
+    if "trace" not in _TRACE:
+        path = get_trace_path(env)
+        _TRACE["trace"] = (
+            UploadTrace(
+                path,
+                dict(
+                    env=env.subst("$PIOENV"),
+                    board=env.subst("$BOARD"),
+                    mcu=env.subst("$BOARD_MCU"),
+                    protocol=env.subst("$UPLOAD_PROTOCOL"),
+                    speed=env.subst("$UPLOAD_SPEED"),
+                ),
+            )
+            if path
+            else None
+        )
+    return _TRACE["trace"]
+
+
+@contextmanager
+def phase(env, name, **details):
+    trace = get_trace(env)
+    if not trace:
+        yield {}
+        return
+    with trace.phase(name, **details) as entry:
+        yield entry
+
+
+def traced_command(env, name, command):
+    """Returns `command` unchanged or, when tracing is on, an action running
+    it as the trace phase `name`"""
+    if not get_trace(env):
+        return command
+
+    def _run(target, source, env):  # pylint: disable=W0621
+        trace = get_trace(env)
+        trace.info["port"] = env.subst("$UPLOAD_PORT")
+        return trace.run_command(
+            name, env.subst(command, target=target, source=source)
+        )
+
+    return _run
+
+
+def traced_function(env, name, func):
+    """Returns `func` unchanged or a wrapper timing it as the phase `name`"""
+    if not get_trace(env):
+        return func
+
+    def _run(target, source, env):  # pylint: disable=W0621
+        with phase(env, name):
+            return func(target, source, env)
+
+    return _run
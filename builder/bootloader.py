@@ -13,16 +13,62 @@
 # limitations under the License.
 
 import sys
-from os.path import isfile, join
+from os.path import isdir, isfile, join
 
 from SCons.Script import Import, Return
 
+from avrtools import bootindex, uploadtrace
+
 Import("env")
 
 board = env.BoardConfig()
 platform = env.PioPlatform()
 core = board.get("build.core", "")
 
+# The last image search, used to suggest available images when it failed
+BOOTLOADER_QUERY = {}
+
+
+def get_bootloader_index(framework_dir):
+    if not framework_dir or not isdir(join(framework_dir, "bootloaders")):
+        return None
+    return bootindex.load_index(
+        framework_dir,
+        env.subst(join("$PROJECT_CORE_DIR", ".cache", "atmelavr-bootloaders")),
+    )
+
+
+def find_bootloader_image(framework_dir, family, **params):
+    BOOTLOADER_QUERY.update(framework_dir=framework_dir, family=family, params=params)
+    index = get_bootloader_index(framework_dir)
+    return index.lookup(family, **params) if index else None
+
+
+def print_bootloader_suggestions():
+    index = get_bootloader_index(BOOTLOADER_QUERY.get("framework_dir"))
+    if not index:
+        return
+    suggestions = index.nearest(
+        BOOTLOADER_QUERY["family"], **BOOTLOADER_QUERY["params"]
+    )
+    if not suggestions:
+        sys.stderr.write(
+            "No %s images are available for %s\n"
+            % (BOOTLOADER_QUERY["family"], BOOTLOADER_QUERY["params"]["mcu"])
+        )
+        return
+    sys.stderr.write("Closest available images:\n")
+    for entry, differences in suggestions:
+        sys.stderr.write(
+            "  %s\n    %s\n"
+            % (
+                ", ".join(
+                    "%s=%s" % (name, value) for name, value in differences.items()
+                ),
+                index.get_path(entry),
+            )
+        )
+
 
 def get_suitable_optiboot_binary(framework_dir, board_config):
     mcu = board_config.get("build.mcu", "").lower()
@@ -48,6 +94,18 @@ def get_suitable_optiboot_binary(framework_dir, board_config):
         bootloader_file,
     )
 
+    indexed_path = find_bootloader_image(
+        framework_dir,
+        "optiboot",
+        mcu=mcu,
+        f_cpu=f_cpu,
+        speed=board_config.get("bootloader.speed", env.subst("$UPLOAD_SPEED")),
+        uart=uart,
+        led=bootloader_led,
+    )
+    if indexed_path:
+        return indexed_path
+
     if isfile(bootloader_path):
         return bootloader_path
 
@@ -59,6 +117,7 @@ def get_suitable_urboot_binary(framework_dir, board_config):
     f_cpu = int(board_config.get("build.f_cpu", "16000000L").strip("UL"))
     oscillator = board_config.get("hardware.oscillator", "external").lower()
     bootloader_speed = board_config.get("bootloader.speed", env.subst("$UPLOAD_SPEED"))
+    indexed_path = None
 
     if core == "MicroCore":
         bootloader_file = "urboot_attiny13a.hex"
@@ -82,6 +141,16 @@ def get_suitable_urboot_binary(framework_dir, board_config):
             bootloader_led,
             bootloader_file,
         )
+        indexed_path = find_bootloader_image(
+            framework_dir,
+            "urboot",
+            mcu="attiny13a",
+            f_cpu=clock_speed,
+            speed=bootloader_speed,
+            oscillator=oscillator,
+            uart_pins=uart_pins,
+            led=bootloader_led,
+        )
 
         if -10.00 > f_cpu_error > 10.00 or f_cpu_error % 1.25 != 0.0:
             sys.stderr.write(
@@ -115,6 +184,16 @@ def get_suitable_urboot_binary(framework_dir, board_config):
                 bootloader_led,
                 bootloader_file,
             )
+            indexed_path = find_bootloader_image(
+                framework_dir,
+                "urboot",
+                mcu=mcu,
+                f_cpu=f_cpu,
+                speed=bootloader_speed,
+                oscillator=oscillator,
+                uart_pins=uart_pins,
+                led=bootloader_led,
+            )
         else:
             bootloader_path = join(
                 framework_dir,
@@ -127,6 +206,14 @@ def get_suitable_urboot_binary(framework_dir, board_config):
                 bootloader_led,
                 bootloader_file,
             )
+            indexed_path = find_bootloader_image(
+                framework_dir,
+                "urboot",
+                mcu=mcu,
+                speed="autobaud",
+                uart_pins=uart_pins,
+                led=bootloader_led,
+            )
 
     else:
         sys.stderr.write(
@@ -135,7 +222,7 @@ def get_suitable_urboot_binary(framework_dir, board_config):
         )
         env.Exit(1)
 
-    return bootloader_path
+    return indexed_path or bootloader_path
 
 
 framework_dir = ""
@@ -163,6 +250,8 @@ else:
 
 if not isfile(bootloader_path):
     sys.stderr.write("Error: Couldn't find bootloader image %s\n" % bootloader_path)
+    if BOOTLOADER_QUERY:
+        print_bootloader_suggestions()
     env.Exit(1)
 
 print("Using bootloader image:\n%s" % bootloader_path)
@@ -177,6 +266,8 @@ else:
     unlock_bits = board.get("bootloader.unlock_bits", "0x3F")
 
 env.Replace(
+    BOOTLOADERIMAGE=bootloader_path,
+    BOOTLOCKBITS=lock_bits,
     BOOTUPLOADER="avrdude",
     BOOTUPLOADERFLAGS=[
         "-p",
@@ -200,7 +291,10 @@ else:
 
 bootloader_actions = [
     fuses_action,
-    env.VerboseAction("$UPLOADBOOTCMD", "Uploading bootloader"),
+    env.VerboseAction(
+        uploadtrace.traced_command(env, "bootloader", "$UPLOADBOOTCMD"),
+        "Uploading bootloader",
+    ),
 ]
 
 Return("bootloader_actions")
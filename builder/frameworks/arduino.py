@@ -22,11 +22,14 @@ kinds of creative coding, interactive objects, spaces or physical experiences.
 http://arduino.cc/en/Reference/HomePage
 """
 
-from os.path import isdir, join
+from os.path import isdir, isfile, join, splitext
 
-from SCons.Script import DefaultEnvironment
+from SCons.Script import Import
+
+from avrtools import corecache
+
+Import("env")
 
-env = DefaultEnvironment()
 platform = env.PioPlatform()
 board = env.BoardConfig()
 build_core = board.get("build.core", "")
@@ -161,30 +164,101 @@ elif build_core in ("tiny", "tinymodern"):
     if extra_defines:
         env.AppendUnique(CPPDEFINES=extra_defines)
 
+#
+# Precompiled Arduino.h for the core library and the project sources
+#
+
+
+def BuildArduinoPch():
+    header = join(FRAMEWORK_DIR, "cores", build_core, "Arduino.h")
+    if not isfile(header):
+        return
+
+    # GCC checks each file of a `.gch` directory and uses the one which
+    # matches the language and the flags of the translation unit
+    std = [flag for flag in env["CXXFLAGS"] if flag.startswith("-std=")]
+    pch_dir = join("$BUILD_DIR", "pch", "%s-%s-%s-%s" % (
+        build_core, env.subst("$BOARD_MCU"), env.subst("$BOARD_F_CPU"),
+        std[-1][5:] if std else "default"))
+    pch = {}
+    for language, command in (
+        ("c", "$CC -x c-header -o $TARGET -c $CFLAGS $CCFLAGS "
+              "$_CCCOMCOM $SOURCE"),
+        ("c++", "$CXX -x c++-header -o $TARGET -c $CXXFLAGS $CCFLAGS "
+                "$_CCCOMCOM $SOURCE")
+    ):
+        pch[language] = env.Command(
+            join(pch_dir, "Arduino.h.gch", language), header,
+            env.VerboseAction(command, "Precompiling $SOURCE ($TARGET)"))
+
+    # The project and library sources find the precompiled header through
+    # `pch_dir`, the force-include is limited to the core and the variant,
+    # Arduino.h must not leak its `min`/`max` macros into plain C libraries
+    framework_build_dirs = tuple(
+        join(env.subst(join("$BUILD_DIR", name)), "")
+        for name in ("FrameworkArduino", "FrameworkArduinoVariant"))
+
+    def UsePch(env, node):  # pylint: disable=W0621
+        language = {".c": "c", ".cpp": "c++", ".cc": "c++", ".cxx": "c++"}.get(
+            splitext(node.get_path())[1].lower())
+        if not language:
+            return node
+        if node.get_abspath().startswith(framework_build_dirs):
+            # The core sources include "Arduino.h" from their own directory,
+            # which GCC searches before `pch_dir`. An `-include` is looked up
+            # in the include path, so the precompiled header is found first.
+            obj = env.Object(
+                node, CCFLAGS=env["CCFLAGS"] + ["-include", "Arduino.h"])
+        else:
+            obj = env.Object(node)
+        env.Depends(obj, pch[language])
+        return obj
+
+    env.Prepend(CPPPATH=[pch_dir])
+    env.AddBuildMiddleware(UsePch)
+
+
+if str(board.get("build.pch", "no")).lower() in ("1", "yes", "true"):
+    BuildArduinoPch()
+
 #
 # Target: Build Core Library
 #
 
 libs = []
+core_cache = corecache.get_cache(env)
+variant_dir = None
+
+
+def BuildFrameworkLibrary(variant_dir, src_dir, depends=()):
+    if not core_cache:
+        return env.BuildLibrary(variant_dir, src_dir)
+    return corecache.build_library(
+        env, core_cache, variant_dir, src_dir,
+        platform.get_package_version("toolchain-atmelavr"), depends)
+
 
 if "build.variant" in board:
     variants_dir = join(
         "$PROJECT_DIR", board.get("build.variants_dir")) if board.get(
             "build.variants_dir", "") else join(FRAMEWORK_DIR, "variants")
+    variant_dir = env.subst(join(variants_dir, board.get("build.variant")))
 
     env.Append(
         CPPPATH=[
-            join(variants_dir, board.get("build.variant"))
+            variant_dir
         ]
     )
-    libs.append(env.BuildLibrary(
+    libs.append(BuildFrameworkLibrary(
         join("$BUILD_DIR", "FrameworkArduinoVariant"),
-        join(variants_dir, board.get("build.variant"))
+        variant_dir,
+        [join(FRAMEWORK_DIR, "cores", build_core)]
     ))
 
-libs.append(env.BuildLibrary(
+libs.append(BuildFrameworkLibrary(
     join("$BUILD_DIR", "FrameworkArduino"),
-    join(FRAMEWORK_DIR, "cores", build_core)
+    join(FRAMEWORK_DIR, "cores", build_core),
+    [variant_dir] if variant_dir else []
 ))
 
 env.Prepend(LIBS=libs)
@@ -1,444 +1,102 @@
+import json
+import os
 import sys
+import tempfile
 from os.path import join
 
 from SCons.Script import COMMAND_LINE_TARGETS, Import, Return
 
+from avrtools import uploadtrace
+from avrtools.fusedb import FuseError, load_database, plan_fuses_update
+
 Import("env")
 
+FUSE_DATABASE = load_database()
 
-def get_lfuse(target, f_cpu, oscillator, bod, eesave, ckout):
-    targets_1 = (
-        "atmega2561",
-        "atmega2560",
-        "atmega1284",
-        "atmega1284p",
-        "atmega1281",
-        "atmega1280",
-        "atmega644a",
-        "atmega644p",
-        "atmega640",
-        "atmega328",
-        "atmega328p",
-        "atmega324a",
-        "atmega324p",
-        "atmega324pa",
-        "atmega168",
-        "atmega168p",
-        "atmega164a",
-        "atmega164p",
-        "atmega88",
-        "atmega88p",
-        "atmega48",
-        "atmega48p",
-    )
-    targets_2 = (
-        "atmega6490p",
-        "atmega6490",
-        "atmega6450p",
-        "atmega6450",
-        "atmega3290p",
-        "atmega3290",
-        "atmega3250p",
-        "atmega3250",
-        "atmega649p",
-        "atmega649",
-        "atmega645p",
-        "atmega645",
-        "atmega329p",
-        "atmega329",
-        "atmega328pb",
-        "atmega325p",
-        "atmega325",
-        "atmega324pb",
-        "atmega168pb",
-        "atmega162",
-        "atmega88pb",
-        "atmega48pb",
-        "at90can128",
-        "at90can64",
-        "at90can32",
-    )
-    targets_3 = (
-        "atmega8535",
-        "atmega8515",
-        "atmega128",
-        "atmega64",
-        "atmega32",
-        "atmega16",
-        "atmega8",
-    )
-    targets_4 = ("attiny13", "attiny13a")
-
-    ckout_bit = 1 if ckout == "yes" else 0
-    ckout_offset = ckout_bit << 6
-
-    if target in targets_1:
-        if oscillator == "external":
-            return 0xF7 & ~ckout_offset
-        elif oscillator == "external_clock":
-            return 0xE0 & ~ckout_offset
-        else:
-            if f_cpu == "8000000L":
-                return 0xE2 & ~ckout_offset
-            else:
-                return 0x62 & ~ckout_offset
-
-    elif target in targets_2:
-        if oscillator == "external":
-            return 0xFF & ~ckout_offset
-        elif oscillator == "external_clock":
-            return 0xE0 & ~ckout_offset
-        else:
-            if f_cpu == "8000000L":
-                return 0xE2 & ~ckout_offset
-            else:
-                return 0x62 & ~ckout_offset
-
-    elif target in targets_3:
-        if bod == "4.0v":
-            bod_bits = 0b11
-        elif bod == "2.7v":
-            bod_bits = 0b01
-        else:
-            bod_bits = 0b00
-
-        bod_offset = bod_bits << 6
-        if oscillator == "external":
-            return 0xFF & ~bod_offset
-        elif oscillator == "external_clock":
-            return 0xE0 & ~bod_offset
-        else:
-            if f_cpu == "8000000L":
-                return 0xE4 & ~bod_offset
-            else:
-                return 0xE1 & ~bod_offset
-
-    elif target in targets_4:
-        eesave_bit = 1 if eesave == "yes" else 0
-        eesave_offset = eesave_bit << 6
-        if oscillator == "external" or oscillator == "external_clock":
-            return 0x78 & ~eesave_offset
-        else:
-            if f_cpu == "9600000L":
-                return 0x7A & ~eesave_offset
-            elif f_cpu == "4800000L":
-                return 0x79 & ~eesave_offset
-            elif f_cpu == "1200000L":
-                return 0x6A & ~eesave_offset
-            elif f_cpu == "600000L":
-                return 0x69 & ~eesave_offset
-            elif f_cpu == "128000L":
-                return 0x7B & ~eesave_offset
-            elif f_cpu == "16000L":
-                return 0x6B & ~eesave_offset
-            else:
-                sys.stderr.write("Error: unknown f_cpu value %s\n" % f_cpu)
-                env.Exit(1)
 
-    else:
-        sys.stderr.write("Error: Couldn't calculate lfuse for %s\n" % target)
+def calculate_fuse(target, fuse, options):
+    try:
+        return FUSE_DATABASE.calculate(target, fuse, options)
+    except FuseError as exc:
+        sys.stderr.write("Error: %s\n" % exc)
         env.Exit(1)
 
 
-def get_hfuse(target, oscillator, bod, eesave, jtagen, bootloader_type):
-    targets_1 = (
-        "atmega6490p",
-        "atmega6490",
-        "atmega6450p",
-        "atmega6450",
-        "atmega3290p",
-        "atmega3290",
-        "atmega3250p",
-        "atmega3250",
-        "atmega2561",
-        "atmega2560",
-        "atmega1284",
-        "atmega1284p",
-        "atmega1281",
-        "atmega1280",
-        "atmega649p",
-        "atmega649",
-        "atmega645p",
-        "atmega645",
-        "atmega644a",
-        "atmega644p",
-        "atmega640",
-        "atmega329p",
-        "atmega329",
-        "atmega325p",
-        "atmega325",
-        "atmega324a",
-        "atmega324p",
-        "atmega324pa",
-        "atmega324pb",
-        "at90can128",
-        "at90can64",
-        "at90can32",
-    )
-    targets_2 = ("atmega328", "atmega328p", "atmega328pb")
-    targets_3 = (
-        "atmega169p",
-        "atmega169a",
-        "atmega169",
-        "atmega165p",
-        "atmega165a",
-        "atmega165",
-        "atmega164p",
-        "atmega164a",
-        "atmega162",
-    )
-    targets_4 = (
-        "atmega168",
-        "atmega168p",
-        "atmega168pb",
-        "atmega88",
-        "atmega88p",
-        "atmega88pb",
-        "atmega48",
-        "atmega48p",
-        "atmega48pb",
-    )
-    targets_5 = ("atmega128", "atmega64", "atmega32")
-    targets_6 = ("atmega8535", "atmega8515", "atmega16", "atmega8")
-    targets_7 = ("attiny13", "attiny13a")
-
-    eesave_bit = 1 if eesave == "yes" else 0
-    eesave_offset = eesave_bit << 3
-    ckopt_bit = 1 if oscillator == "external" else 0
-    ckopt_offset = ckopt_bit << 4
-    jtagen_bit = 1 if jtagen == "yes" else 0
-    jtagen_offset = jtagen_bit << 6
-    selfprogen_bit = 1 if bootloader_type != "no_bootloader" else 0
-    selfprogen_offset = selfprogen_bit << 4
-
-    is_urboot_or_noboot = bootloader_type in ("no_bootloader", "urboot")
-
-    if target in targets_1:
-        if is_urboot_or_noboot:
-            return 0xDF & ~jtagen_offset & ~eesave_offset
-        else:
-            return 0xDE & ~jtagen_offset & ~eesave_offset
-
-    elif target in targets_2:
-        if is_urboot_or_noboot:
-            return 0xDF & ~eesave_offset
-        else:
-            return 0xDE & ~eesave_offset
-
-    elif target in targets_3:
-        if is_urboot_or_noboot:
-            return 0xDD & ~jtagen_offset & ~eesave_offset
-        else:
-            return 0xDC & ~jtagen_offset & ~eesave_offset
-
-    elif target in targets_4:
-        if bod == "4.3v":
-            return 0xDC & ~eesave_offset
-        elif bod == "2.7v":
-            return 0xDD & ~eesave_offset
-        elif bod == "1.8v":
-            return 0xDE & ~eesave_offset
-        else:
-            return 0xDF & ~eesave_offset
-
-    elif target in targets_5:
-        if is_urboot_or_noboot:
-            return 0xDF & ~jtagen_offset & ~ckopt_offset & ~eesave_offset
-        else:
-            return 0xDE & ~jtagen_offset & ~ckopt_offset & ~eesave_offset
-
-    elif target in targets_6:
-        if is_urboot_or_noboot:
-            return 0xDD & ~ckopt_offset & ~eesave_offset
-        else:
-            return 0xDC & ~ckopt_offset & ~eesave_offset
-
-    elif target in targets_7:
-        if bod == "4.3v":
-            return 0xF9 & ~selfprogen_offset
-        elif bod == "2.7v":
-            return 0xFB & ~selfprogen_offset
-        elif bod == "1.8v":
-            return 0xFD & ~selfprogen_offset
-        else:
-            return 0xFF & ~selfprogen_offset
-
-    else:
-        sys.stderr.write("Error: Couldn't calculate hfuse for %s\n" % target)
-        env.Exit(1)
-
+def is_target_without_bootloader(target):
+    return not FUSE_DATABASE.has_bootloader(target)
 
-def get_efuse(target, bod, cfd, bootloader_type):
 
-    targets_without_efuse = (
-        "atmega8535",
-        "atmega8515",
-        "atmega8",
-        "atmega16",
-        "atmega32",
-        "attiny13a",
-        "attiny13",
-    )
-    targets_1 = (
-        "atmega2561",
-        "atmega2560",
-        "atmega1284",
-        "atmega1284p",
-        "atmega1281",
-        "atmega1280",
-        "atmega644a",
-        "atmega644p",
-        "atmega640",
-        "atmega328",
-        "atmega328p",
-        "atmega324a",
-        "atmega324p",
-        "atmega324pa",
-        "atmega164a",
-        "atmega164p",
-    )
-    targets_2 = ("atmega328pb", "atmega324pb")
-    targets_3 = (
-        "atmega168",
-        "atmega168p",
-        "atmega168pb",
-        "atmega88",
-        "atmega88p",
-        "atmega88pb",
-    )
-    targets_4 = ("atmega128", "atmega64")
-    targets_5 = ("at90can128", "at90can64", "at90can32")
-    targets_6 = (
-        "atmega6490p",
-        "atmega6490",
-        "atmega6450p",
-        "atmega6450",
-        "atmega3290p",
-        "atmega3290",
-        "atmega3250p",
-        "atmega3250",
-        "atmega649p",
-        "atmega649",
-        "atmega645p",
-        "atmega645",
-        "atmega329p",
-        "atmega329",
-        "atmega325p",
-        "atmega325",
-        "atmega162",
+def read_fuse_file(path):
+    if not os.path.isfile(path):
+        return None
+    with open(path, encoding="utf8") as fp:
+        value = fp.read().strip().split(",")[0]
+    return int(value, 0) if value else None
+
+
+def SetChangedFuses(target, source, env):  # pylint: disable=W0613,W0621
+    expected = [(name, int(value, 0)) for name, value in env["SELECTEDFUSES"]]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        read_files = {name: join(tmp_dir, "%s.hex" % name) for name, _ in expected}
+        env.Replace(
+            FUSESREADFLAGS=[
+                "-U%s:r:%s:h" % (name, path) for name, path in read_files.items()
+            ]
+        )
+        if env.Execute(
+            env.VerboseAction(
+                uploadtrace.traced_command(env, "fuses_read", "$READFUSESCMD"),
+                "Reading fuses",
+            )
+        ):
+            env.Exit(1)
+        current = {name: read_fuse_file(path) for name, path in read_files.items()}
+
+    changed, report = plan_fuses_update(
+        expected,
+        current,
+        env["FUSESERASECHIP"],
+        {
+            name: FUSE_DATABASE.get_used_mask(env.subst("$BOARD_MCU"), name)
+            for name, _ in expected
+        },
     )
-    targets_7 = ("atmega48", "atmega48p", "atmega48pb")
-
-    cfd_bit = 1 if cfd == "yes" else 0
-    cfd_offset = cfd_bit << 3
-
-    if target in targets_without_efuse:
+    report["mcu"] = env.subst("$BOARD_MCU")
+
+    for name, _ in expected:
+        state = report["fuses"][name]
+        print(
+            "%s: current = %s, expected = %s%s"
+            % (
+                name,
+                state["current"],
+                state["expected"],
+                " -> write" if state["written"] else "",
+            )
+        )
+
+    report_path = env.subst(join("$BUILD_DIR", "fuses.json"))
+    os.makedirs(os.path.dirname(report_path), exist_ok=True)
+    with open(report_path, "w", encoding="utf8") as fp:
+        json.dump(report, fp, indent=2)
+
+    if not changed:
+        print("Fuses are up to date, nothing to write")
         return None
 
-    is_urboot_or_noboot = bootloader_type in ("no_bootloader", "urboot")
-
-    if target in targets_1:
-        if bod == "4.3v":
-            return 0xFC
-        elif bod == "2.7v":
-            return 0xFD
-        elif bod == "1.8v":
-            return 0xFE
-        else:
-            return 0xFF
-
-    elif target in targets_2:
-        if bod == "4.3v":
-            return 0xF4 | cfd_offset
-        elif bod == "2.7v":
-            return 0xF5 | cfd_offset
-        elif bod == "1.8v":
-            return 0xF6 | cfd_offset
-        else:
-            return 0xF7
-
-    elif target in targets_3:
-        if is_urboot_or_noboot:
-            return 0xFF
-        else:
-            return 0xFD
-
-    elif target in targets_4:
-        return 0xFF
-
-    elif target in targets_5:
-        if bod == "4.1v":
-            return 0xFD
-        elif bod == "4.0v":
-            return 0xFB
-        elif bod == "3.9v":
-            return 0xF9
-        elif bod == "3.8v":
-            return 0xF7
-        elif bod == "2.7v":
-            return 0xF5
-        elif bod == "2.6v":
-            return 0xF3
-        elif bod == "2.5v":
-            return 0xF1
-        else:
-            return 0xFF
-
-    elif target in targets_6:
-        if bod == "4.3v":
-            return 0xF9
-        elif bod == "2.7v":
-            return 0xFB
-        elif bod == "1.8v":
-            return 0xFD
-        else:
-            return 0xFF
-
-    elif target in targets_7:
-        if is_urboot_or_noboot:
-            return 0xFF
-        else:
-            return 0xFE
-
-    else:
-        sys.stderr.write("Error: Couldn't calculate efuse for %s\n" % target)
-        env.Exit(1)
-
-
-def is_target_without_bootloader(target):
-    targets_without_bootloader = (
-        "attiny4313",
-        "attiny2313",
-        "attiny1634",
-        "attiny861",
-        "attiny841",
-        "attiny461",
-        "attiny441",
-        "attiny261",
-        "attiny167",
-        "attiny88",
-        "attiny87",
-        "attiny85",
-        "attiny84",
-        "attiny48",
-        "attiny45",
-        "attiny44",
-        "attiny43",
-        "attiny40",
-        "attiny26",
-        "attiny25",
-        "attiny24",
+    env.Replace(
+        FUSESFLAGS=(["-e"] if report["erase"] else [])
+        + [
+            "-U%s:w:%s:m" % (name, hex(value))
+            for name, value in expected
+            if name in changed
+        ]
+    )
+    return env.Execute(
+        env.VerboseAction(
+            uploadtrace.traced_command(env, "fuses", "$SETFUSESCMD"), "Setting fuses"
+        )
     )
-
-    return target in targets_without_bootloader
-
-
-def get_lock_bits(target, bootloader_type):
-    is_urboot_or_noboot = bootloader_type in ("no_bootloader", "urboot")
-    if is_target_without_bootloader(target) or is_urboot_or_noboot:
-        return 0xFF
-    else:
-        return 0xCF
 
 
 board = env.BoardConfig()
@@ -451,15 +109,20 @@ target = (
     else env.subst("$BOARD").lower()
 )
 
+# The production target burns the bootloader too
+burn_bootloader = any(
+    name in COMMAND_LINE_TARGETS for name in ("bootloader", "production")
+)
+
 fuses_section = "fuses"
-if "bootloader" in COMMAND_LINE_TARGETS:
+if burn_bootloader:
     fuses_section = "bootloader"
 
 lfuse = board.get("%s.lfuse" % fuses_section, "")
 hfuse = board.get("%s.hfuse" % fuses_section, "")
 efuse = board.get("%s.efuse" % fuses_section, "")
 lock = board.get("%s.lock_bits" % fuses_section, board.get("bootloader.lock_bits", ""))
-if "bootloader" in COMMAND_LINE_TARGETS:
+if burn_bootloader:
     # A special case for unlocking chip to burn a new bootloader
     lock = board.get("%s.unlock_bits" % fuses_section, "0xff")
 
@@ -511,54 +174,33 @@ if core in ("MiniCore", "MegaCore", "MightyCore", "MajorCore", "MicroCore"):
     elif uart not in ("no_bootloader", "swio"):
         print("UART port = %s" % uart)
 
-    if target not in (
-        "atmega8535",
-        "atmega8515",
-        "atmega128",
-        "atmega64",
-        "atmega32",
-        "atmega16",
-        "atmega8",
-        "attiny13",
-        "attiny13a",
-    ):
+    fuse_options = dict(
+        f_cpu=f_cpu,
+        oscillator=oscillator,
+        bod=bod,
+        eesave=eesave,
+        jtagen=jtagen,
+        ckout=ckout,
+        cfd=cfd,
+        bootloader_type=bootloader_type,
+    )
+    target_options = FUSE_DATABASE.get_options(target)
+
+    if "ckout" in target_options:
         print("Clock output = %s" % ckout)
 
-    if target in (
-        "atmega2561",
-        "atmega2560",
-        "atmega1284",
-        "atmega1284p",
-        "atmega1281",
-        "atmega1280",
-        "atmega644a",
-        "atmega644p",
-        "atmega640",
-        "atmega324a",
-        "atmega324p",
-        "atmega324pa",
-        "atmega324pb",
-        "at90can128",
-        "at90can64",
-        "at90can32",
-        "atmega164a",
-        "atmega164p",
-        "atmega162",
-        "atmega128",
-        "atmega64",
-        "atmega32",
-    ):
+    if "jtagen" in target_options:
         print("JTAG enable = %s" % jtagen)
 
-    if target in ("atmega324pb", "atmega328pb"):
+    if "cfd" in target_options:
         print("CFD enable = %s" % cfd)
 
     print("---------------------")
 
-    lfuse = lfuse or hex(get_lfuse(target, f_cpu, oscillator, bod, eesave, ckout))
-    hfuse = hfuse or hex(get_hfuse(target, oscillator, bod, eesave, jtagen, bootloader_type))
-    efuse = efuse or get_efuse(target, bod, cfd, bootloader_type)
-    lock  = lock  or hex(get_lock_bits(target, bootloader_type))
+    lfuse = lfuse or hex(calculate_fuse(target, "lfuse", fuse_options))
+    hfuse = hfuse or hex(calculate_fuse(target, "hfuse", fuse_options))
+    efuse = efuse or calculate_fuse(target, "efuse", fuse_options)
+    lock  = lock  or hex(calculate_fuse(target, "lock", fuse_options))
 
 env.Replace(
     FUSESUPLOADER="avrdude",
@@ -574,14 +216,19 @@ env.Replace(
         "-Ulfuse:w:%s:m" % lfuse,
     ],
     SETFUSESCMD="$FUSESUPLOADER $FUSESUPLOADERFLAGS $UPLOAD_FLAGS $FUSESFLAGS",
+    READFUSESCMD="$FUSESUPLOADER $FUSESUPLOADERFLAGS $UPLOAD_FLAGS $FUSESREADFLAGS",
+    FUSESERASECHIP=not is_target_without_bootloader(target),
 )
 
-if not is_target_without_bootloader(target):
-    env.Append(FUSESUPLOADERFLAGS=["-e"])
+# Read the chip first and program only fuse bytes which differ
+skip_unchanged = fuses_section == "fuses" and str(
+    board.get("fuses.skip_unchanged", "no")
+).lower() in ("1", "yes", "true")
 
 if env.subst("$UPLOAD_PROTOCOL") != "custom":
     env.Append(FUSESUPLOADERFLAGS=["-c", "$UPLOAD_PROTOCOL"])
 else:
+    skip_unchanged = False
     print(
         "Warning: The `custom` upload protocol is used! The upload and fuse flags may "
         "conflict!\nMore information: "
@@ -593,11 +240,35 @@ if efuse:
     efuse = efuse if isinstance(efuse, str) else hex(efuse)
     env.Append(FUSESFLAGS=["-Uefuse:w:%s:m" % efuse])
 
+if env["FUSESERASECHIP"] and not skip_unchanged:
+    env.Append(FUSESUPLOADERFLAGS=["-e"])
+
 print(
     "\nSelected fuses: [lfuse = %s, hfuse = %s%s]"
     % (lfuse, hfuse, ", efuse = %s" % efuse if efuse else "")
 )
 
-fuses_action = env.VerboseAction("$SETFUSESCMD", "Setting fuses")
+env.Replace(
+    SELECTEDFUSES=[
+        (name, value)
+        for name, value in (
+            ("lock", lock),
+            ("hfuse", hfuse),
+            ("lfuse", lfuse),
+            ("efuse", efuse),
+        )
+        if value
+    ]
+)
+
+if skip_unchanged:
+    fuses_action = env.VerboseAction(
+        uploadtrace.traced_function(env, "fuses_check", SetChangedFuses),
+        "Checking fuses",
+    )
+else:
+    fuses_action = env.VerboseAction(
+        uploadtrace.traced_command(env, "fuses", "$SETFUSESCMD"), "Setting fuses"
+    )
 
 Return("fuses_action")
@@ -12,9 +12,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
 import sys
-from os.path import join
-from time import sleep
+from os.path import join, splitext
 
 from SCons.Script import (
     ARGUMENTS,
@@ -27,8 +27,26 @@ from SCons.Script import (
 
 from platformio.public import list_serial_ports
 
+from avrtools import (
+    budgets,
+    compilecache,
+    corecache,
+    deltaflash,
+    elf,
+    gpioreset,
+    ihex,
+    lto,
+    multiupload,
+    portwatch,
+    simtest,
+    sizereport,
+    sizes,
+    stack,
+    uploadtrace,
+)
 
-def BeforeUpload(target, source, env):  # pylint: disable=W0613,W0621
+
+def configure_upload_flags(env):
     upload_options = {}
     if "BOARD" in env:
         upload_options = env.BoardConfig().get("upload", {})
@@ -48,44 +66,572 @@ def BeforeUpload(target, source, env):  # pylint: disable=W0613,W0621
     # disable erasing by default
     env.Append(UPLOADERFLAGS=["-D"])
 
-    if upload_options and not upload_options.get("require_upload_port", False):
-        return
+    return upload_options
 
-    env.AutodetectUploadPort()
-    env.Append(UPLOADERFLAGS=["-P", "$UPLOAD_PORT"])
 
-    if env.subst("$BOARD") in ("raspduino", "emonpi", "sleepypi"):
+def WaitForBootloaderPort(env, watcher):
+    print("Waiting for the new upload port...")
+    prev_port = env.subst("$UPLOAD_PORT")
+    new_port = watcher.wait()
+    if not new_port and prev_port in [p["port"] for p in list_serial_ports()]:
+        new_port = prev_port
+    if not new_port:
+        sys.stderr.write(
+            "Error: Couldn't find a board on the selected port. "
+            "Check that you have the correct port selected. "
+            "If it is correct, try pressing the board's reset "
+            "button after initiating the upload.\n"
+        )
+        env.Exit(1)
+    portwatch.wait_until_ready(new_port)
+    return new_port
 
-        def _rpi_sysgpio(path, value):
-            with open(path, "w") as f:
-                f.write(str(value))
 
-        if env.subst("$BOARD") == "raspduino":
-            pin_num = 18
-        elif env.subst("$BOARD") == "sleepypi":
-            pin_num = 22
-        else:
-            pin_num = 4
-
-        _rpi_sysgpio("/sys/class/gpio/export", pin_num)
-        _rpi_sysgpio("/sys/class/gpio/gpio%d/direction" % pin_num, "out")
-        _rpi_sysgpio("/sys/class/gpio/gpio%d/value" % pin_num, 1)
-        sleep(0.1)
-        _rpi_sysgpio("/sys/class/gpio/gpio%d/value" % pin_num, 0)
-        _rpi_sysgpio("/sys/class/gpio/unexport", pin_num)
+def BeforeUpload(target, source, env):  # pylint: disable=W0613,W0621
+    upload_options = configure_upload_flags(env)
+
+    if upload_options and not upload_options.get("require_upload_port", False):
+        return
+
+    with uploadtrace.phase(env, "autodetect_port"):
+        env.AutodetectUploadPort()
+    env.Append(UPLOADERFLAGS=["-P", "$UPLOAD_PORT"])
+    ResetIntoBootloader(env, upload_options)
+
+
+def ResetIntoBootloader(env, upload_options):
+    reset_gpio = upload_options.get("reset_gpio", {})
+    if reset_gpio:
+        try:
+            with uploadtrace.phase(env, "gpio_reset"):
+                gpioreset.GpioReset.from_config(reset_gpio).pulse_reset()
+        except (KeyError, ValueError, OSError) as exc:
+            sys.stderr.write("Error: Could not reset the board via GPIO: %s\n" % exc)
+            env.Exit(1)
     else:
         if not upload_options.get("disable_flushing", False) and not env.get(
             "UPLOAD_PORT", ""
         ).startswith("net:"):
-            env.FlushSerialBuffer("$UPLOAD_PORT")
+            with uploadtrace.phase(env, "flush"):
+                env.FlushSerialBuffer("$UPLOAD_PORT")
 
-        before_ports = list_serial_ports()
+        # Watch for the bootloader port from before the reset, so its
+        # enumeration can not be missed
+        watcher = None
+        if upload_options.get("wait_for_upload_port", False):
+            watcher = portwatch.PortWatcher(
+                portwatch.parse_board_hwids(env.BoardConfig().get("build.hwids", [])),
+                list_serial_ports,
+            ).start()
 
         if upload_options.get("use_1200bps_touch", False):
-            env.TouchSerialPort("$UPLOAD_PORT", 1200)
+            with uploadtrace.phase(env, "touch_1200bps"):
+                env.TouchSerialPort("$UPLOAD_PORT", 1200)
+
+        if watcher:
+            with uploadtrace.phase(env, "wait_for_port") as entry:
+                env.Replace(UPLOAD_PORT=WaitForBootloaderPort(env, watcher))
+                entry["port"] = env.subst("$UPLOAD_PORT")
+
+
+def UploadToPorts(target, source, env):  # pylint: disable=W0613,W0621
+    upload_options = configure_upload_flags(env)
+    try:
+        timeout = multiupload.parse_timeout(upload_options.get("timeout"))
+        jobs = multiupload.parse_jobs(upload_options.get("jobs"))
+    except ValueError as exc:
+        sys.stderr.write("Error: %s\n" % exc)
+        env.Exit(1)
+    ports = multiupload.resolve_ports(
+        upload_options.get("ports"), [p["port"] for p in list_serial_ports()]
+    )
+    if not ports:
+        sys.stderr.write(
+            "Error: No upload ports match `%s`\n" % upload_options.get("ports")
+        )
+        env.Exit(1)
+
+    if upload_options.get("wait_for_upload_port", False):
+        print(
+            "Warning: Waiting for a new upload port is not supported "
+            "when uploading to several ports"
+        )
 
-        if upload_options.get("wait_for_upload_port", False):
-            env.Replace(UPLOAD_PORT=env.WaitForNewSerialPort(before_ports))
+    env.Append(UPLOADERFLAGS=["-P", "$UPLOAD_PORT"])
+    store = get_flash_record_store(env)
+    commands = {}
+    for port in ports:
+        store.invalidate_device(port, env.subst("$BOARD_MCU").lower())
+        if not upload_options.get("disable_flushing", False) and not port.startswith(
+            "net:"
+        ):
+            env.FlushSerialBuffer(port)
+        if upload_options.get("use_1200bps_touch", False):
+            env.TouchSerialPort(port, 1200)
+        commands[port] = env.Override({"UPLOAD_PORT": port}).subst(
+            "$UPLOADCMD", target=target, source=source
+        )
+
+    def _on_result(result):
+        print(
+            "%s: %s in %.2f seconds"
+            % (
+                result["port"],
+                "SUCCESS" if result["success"] else "FAILED",
+                result["elapsed"],
+            )
+        )
+
+    print("Uploading to %d ports: %s" % (len(ports), ", ".join(ports)))
+    results = multiupload.run_parallel(
+        commands,
+        jobs=jobs,
+        timeout=timeout,
+        on_result=_on_result,
+    )
+
+    report_path = env.subst(join("$BUILD_DIR", "upload_ports.json"))
+    with open(report_path, "w", encoding="utf8") as fp:
+        json.dump(results, fp, indent=2)
+
+    failed = [result for result in results if not result["success"]]
+    for result in failed:
+        sys.stderr.write("\n%s:\n%s\n" % (result["port"], result["log"]))
+    print(
+        "Uploaded %d of %d ports, report: %s"
+        % (len(results) - len(failed), len(results), report_path)
+    )
+    return 1 if failed else None
+
+
+def get_flash_record_store(env):
+    return deltaflash.FlashRecordStore(
+        env.subst(join("$PROJECT_CORE_DIR", ".cache", "atmelavr-flash"))
+    )
+
+
+def InvalidateFlashRecords(target, source, env):  # pylint: disable=W0613,W0621
+    """Flash written outside the delta upload makes the records of the device
+    useless, of every device with the MCU when the port is not known"""
+    get_flash_record_store(env).invalidate_device(
+        env.subst("$UPLOAD_PORT") or None, env.subst("$BOARD_MCU").lower()
+    )
+
+
+def UploadDelta(target, source, env):  # pylint: disable=W0613,W0621
+    board = env.BoardConfig()
+    port = env.subst("$UPLOAD_PORT")
+    mcu = env.subst("$BOARD_MCU").lower()
+    page_size = int(board.get("upload.page_size", deltaflash.get_page_size(mcu)))
+    store = get_flash_record_store(env)
+
+    image = ihex.read_ihex(source[0].get_abspath())
+    new_pages = ihex.to_pages(image, page_size)
+    old_pages = store.load(
+        port, mcu, page_size, int(board.get("upload.delta_max_age", 3600))
+    )
+
+    # The pages kept from the record are verified on the device in the same
+    # avrdude session, before the dirty pages are written
+    operations = []
+    sources = []
+    if old_pages is None:
+        print("No valid flash record for %s, writing the whole image" % port)
+        operations.append("-U flash:w:${SOURCES[0]}:i")
+        sources.append(source[0])
+    else:
+        dirty = deltaflash.diff_pages(old_pages, new_pages)
+        clean = [page for page in sorted(new_pages) if page not in dirty]
+        if clean:
+            verify_source = env.File(join("$BUILD_DIR", "${PROGNAME}.verify.hex"))
+            ihex.write_ihex(
+                verify_source.get_abspath(),
+                deltaflash.build_delta(new_pages, clean, page_size),
+            )
+            operations.append("-U flash:v:${SOURCES[%d]}:i" % len(sources))
+            sources.append(verify_source)
+        if dirty:
+            print(
+                "Writing %d of %d flash pages (%d bytes per page)"
+                % (len(dirty), len(set(old_pages) | set(new_pages)), page_size)
+            )
+            delta_source = env.File(join("$BUILD_DIR", "${PROGNAME}.delta.hex"))
+            ihex.write_ihex(
+                delta_source.get_abspath(),
+                deltaflash.build_delta(new_pages, dirty, page_size),
+            )
+            operations.append("-U flash:w:${SOURCES[%d]}:i" % len(sources))
+            sources.append(delta_source)
+        elif clean:
+            print("Flash content matches the record, verifying the device")
+        else:
+            print("Flash content is up to date, nothing to write")
+            return None
+
+    result = env.Execute(
+        env.VerboseAction(
+            uploadtrace.traced_command(
+                env,
+                "upload",
+                env.subst(
+                    "$UPLOADER $UPLOADERFLAGS " + " ".join(operations),
+                    source=sources,
+                ),
+            ),
+            "Uploading %s" % sources[-1],
+        )
+    )
+    if result and old_pages is not None:
+        # The device does not hold the recorded image (another writer or a
+        # swapped board) or the write failed, start over with the whole image
+        store.invalidate(port, mcu)
+        print(
+            "Flash content of %s differs from the record, writing the whole image"
+            % port
+        )
+        ResetIntoBootloader(env, board.get("upload", {}))
+        result = env.Execute(
+            env.VerboseAction(
+                uploadtrace.traced_command(
+                    env, "upload", env.subst("$UPLOADCMD", source=[source[0]])
+                ),
+                "Uploading %s" % source[0],
+            )
+        )
+    if result:
+        store.invalidate(port, mcu)
+    else:
+        store.save(port, mcu, page_size, image)
+    return result
+
+
+def ConvertElfToHex(target, source, env):  # pylint: disable=W0613,W0621
+    firmware = elf.load_elf(source[0].get_abspath())
+    ihex.write_ihex(
+        target[0].get_abspath(),
+        firmware.get_load_segments(exclude=[".eeprom"]),
+        firmware.entry,
+    )
+
+
+def ConvertElfToEep(target, source, env):  # pylint: disable=W0613,W0621
+    firmware = elf.load_elf(source[0].get_abspath())
+    ihex.write_ihex(
+        target[0].get_abspath(),
+        firmware.get_load_segments(include=[".eeprom"], change_lma={".eeprom": 0}),
+        firmware.entry,
+    )
+
+
+def get_memory_usage(env, source):
+    maximum_sizes = {}
+    if "BOARD" in env:
+        board = env.BoardConfig()
+        maximum_sizes = dict(
+            program=int(board.get("upload.maximum_size", 0)),
+            data=int(board.get("upload.maximum_ram_size", 0)),
+        )
+    usage = sizes.calculate_usage(
+        elf.load_elf(source[0].get_abspath()),
+        env["SIZEPROGSECTIONS"],
+        env["SIZEDATASECTIONS"],
+        env["SIZEEEPROMSECTIONS"],
+        maximum_sizes,
+    )
+    usage["mcu"] = env.subst("$BOARD_MCU")
+    with open(env.subst(join("$BUILD_DIR", "size.json")), "w", encoding="utf8") as fp:
+        json.dump(usage, fp, indent=2)
+    return usage
+
+
+def get_stack_usage(env, source, usage):
+    """Worst-case stack depth, stored next to the memory usage in size.json"""
+    analysis = stack.StackAnalysis(
+        elf.load_elf(source[0].get_abspath()),
+        stack.get_pc_size(env.BoardConfig().get("upload.maximum_size", 0)),
+    )
+    if not analysis.get_function(stack.ENTRY_POINT):
+        sys.stderr.write(
+            "Warning! The stack depth is not checked, the program has no "
+            "symbol table\n"
+        )
+        return None
+    stack_usage = analysis.analyze()
+    names = sizereport.demangle(
+        set(
+            stack_usage["main"]["chain"]
+            + stack_usage["interrupt"]["chain"]
+            + stack_usage["indirect_calls"]
+            + stack_usage["recursive"]
+        ),
+        env["ENV"].get("PATH"),
+    )
+    for item in (stack_usage["main"], stack_usage["interrupt"]):
+        item["chain"] = [names.get(name, name) for name in item["chain"]]
+    for key in ("indirect_calls", "recursive"):
+        stack_usage[key] = [names.get(name, name) for name in stack_usage[key]]
+    usage["stack"] = stack_usage
+    with open(env.subst(join("$BUILD_DIR", "size.json")), "w", encoding="utf8") as fp:
+        json.dump(usage, fp, indent=2)
+    return stack_usage
+
+
+def get_size_metrics(env, source, usage, libraries=True):
+    library_sizes = None
+    if libraries:
+        program_path = source[0].get_abspath()
+        library_sizes = budgets.get_library_sizes(
+            program_path,
+            "%s.map" % splitext(program_path)[0],
+            env.subst("$PROJECT_DIR"),
+            env.subst("$BUILD_DIR"),
+            env.subst(join("$BUILD_DIR", "sizelibraries.json")),
+        )
+    return budgets.get_metrics(usage, library_sizes)
+
+
+def get_size_baseline_path(env):
+    return join(
+        env.subst("$PROJECT_DIR"),
+        env.subst(
+            env.BoardConfig().get(
+                "build.size_baseline", join("sizebaseline", "${PIOENV}.json")
+            )
+        ),
+    )
+
+
+def is_link_map_required(env):
+    """The link map is only written for the size report and the library
+    sizes of the size budgets and the baseline"""
+    if any(name in COMMAND_LINE_TARGETS for name in ("sizereport", "sizebaseline")):
+        return True
+    if "BOARD" not in env:
+        return False
+    board = env.BoardConfig()
+    try:
+        names = list(budgets.parse_budgets(board.get("build.size_budgets", "")))
+        growth_limit = budgets.parse_growth_limit(
+            board.get("build.size_growth_limit", ""),
+            board.get("build.size_growth_percent", ""),
+        )
+    except ValueError:
+        # Reported by the size check
+        return False
+    if growth_limit != (None, None):
+        names.extend(budgets.load_baseline(get_size_baseline_path(env)) or {})
+    return any(budgets.is_library_metric(name) for name in names)
+
+
+def CheckSizeBudgets(env, source, usage):
+    board = env.BoardConfig()
+    try:
+        size_budgets = budgets.parse_budgets(board.get("build.size_budgets", ""))
+        growth_limit = budgets.parse_growth_limit(
+            board.get("build.size_growth_limit", ""),
+            board.get("build.size_growth_percent", ""),
+        )
+    except ValueError as exc:
+        sys.stderr.write("Error: %s\n" % exc)
+        env.Exit(1)
+
+    baseline = None
+    if growth_limit != (None, None):
+        baseline_path = get_size_baseline_path(env)
+        baseline = budgets.load_baseline(baseline_path)
+        if baseline is None:
+            sys.stderr.write(
+                "Warning! No size baseline at %s, save one with "
+                "`pio run -t sizebaseline`\n" % baseline_path
+            )
+    if not size_budgets and not baseline:
+        return
+
+    names = list(size_budgets) + list(baseline or {})
+    metrics = get_size_metrics(
+        env, source, usage, any(budgets.is_library_metric(name) for name in names)
+    )
+    unknown = sorted(name for name in size_budgets if name not in metrics)
+    if unknown:
+        sys.stderr.write(
+            "Warning! Size budgets for unknown sections or libraries: %s\n"
+            % ", ".join(unknown)
+        )
+    exceeded = budgets.check_budgets(metrics, size_budgets)
+    grown = budgets.check_growth(metrics, baseline or {}, *growth_limit)
+    if exceeded or grown:
+        sys.stderr.write(
+            "Error: %d size limits exceeded\n%s\n"
+            % (
+                len(exceeded) + len(grown),
+                budgets.format_violations(exceeded, grown, *growth_limit),
+            )
+        )
+        env.Exit(1)
+
+
+def CheckProgramSize(_, target, source, env):  # pylint: disable=W0613,W0621
+    if "BOARD" not in env:
+        return
+    program_max_size = int(env.BoardConfig().get("upload.maximum_size", 0))
+    data_max_size = int(env.BoardConfig().get("upload.maximum_ram_size", 0))
+    if program_max_size == 0:
+        return
+
+    usage = get_memory_usage(env, source)
+    program_size = usage["program"]["size"]
+    data_size = usage["data"]["size"]
+
+    stack_usage = None
+    if str(env.BoardConfig().get("build.stack_check", "no")).lower() in (
+        "1",
+        "yes",
+        "true",
+    ):
+        stack_usage = get_stack_usage(env, source, usage)
+
+    print('Advanced Memory Usage is available via "PlatformIO Home > Project Inspect"')
+    if data_max_size:
+        print("RAM:   %s" % sizes.format_available_bytes(data_size, data_max_size))
+    if stack_usage:
+        print(
+            "Stack: %d bytes worst case (main %d bytes, interrupt %d bytes)"
+            % (
+                stack_usage["size"],
+                stack_usage["main"]["size"],
+                stack_usage["interrupt"]["size"],
+            )
+        )
+        if data_max_size:
+            print(
+                "RAM + stack: %s"
+                % sizes.format_available_bytes(
+                    data_size + stack_usage["size"], data_max_size
+                )
+            )
+    print("Flash: %s" % sizes.format_available_bytes(program_size, program_max_size))
+    if int(ARGUMENTS.get("PIOVERBOSE", 0)):
+        for name, size in usage["sections"].items():
+            print("%-16s%8d" % (name, size))
+        if stack_usage:
+            for name in ("main", "interrupt"):
+                print(
+                    "Deepest %s path: %s"
+                    % (name, " > ".join(stack_usage[name]["chain"]) or "-")
+                )
+    if stack_usage and stack_usage["indirect_calls"]:
+        sys.stderr.write(
+            "Warning! Indirect calls in %s are assumed to reach the deepest "
+            "function that is not called directly\n"
+            % ", ".join(stack_usage["indirect_calls"])
+        )
+    if stack_usage and stack_usage["recursive"]:
+        sys.stderr.write(
+            "Warning! The stack depth of recursive functions (%s) is a lower "
+            "bound\n" % ", ".join(stack_usage["recursive"])
+        )
+
+    if data_max_size and data_size > data_max_size:
+        sys.stderr.write(
+            "Warning! The data size (%d bytes) is greater "
+            "than maximum allowed (%s bytes)\n" % (data_size, data_max_size)
+        )
+    if (
+        stack_usage
+        and data_max_size
+        and data_size + stack_usage["size"] > data_max_size
+    ):
+        sys.stderr.write(
+            "Error: The data size plus the worst-case stack (%d bytes) is greater "
+            "than maximum allowed (%s bytes)\n"
+            % (data_size + stack_usage["size"], data_max_size)
+        )
+        env.Exit(1)
+    if program_size > program_max_size:
+        sys.stderr.write(
+            "Error: The program size (%d bytes) is greater "
+            "than maximum allowed (%s bytes)\n" % (program_size, program_max_size)
+        )
+        env.Exit(1)
+    CheckSizeBudgets(env, source, usage)
+
+
+def PrintProgramSize(target, source, env):  # pylint: disable=W0613,W0621
+    usage = get_memory_usage(env, source)
+    print(sizes.format_memory_usage(usage, env.subst("$BOARD_MCU")))
+
+
+def PrintSizeReport(target, source, env):  # pylint: disable=W0613,W0621
+    program_path = source[0].get_abspath()
+    report = sizereport.create_report(
+        elf.load_elf(program_path),
+        "%s.map" % splitext(program_path)[0],
+        env.subst("$PROJECT_DIR"),
+        env.subst("$BUILD_DIR"),
+        path=env["ENV"].get("PATH"),
+    )
+    store = sizereport.SnapshotStore(
+        env.subst(join("$PROJECT_WORKSPACE_DIR", "sizereport", "$PIOENV"))
+    )
+    previous = store.load_previous(report["id"])
+    snapshot_path = store.save(report)
+    print(
+        sizereport.format_report(
+            report,
+            previous,
+            top=int(env.BoardConfig().get("build.size_report_top", 10)),
+        )
+    )
+    print("Snapshot: %s" % snapshot_path)
+
+
+def SaveSizeBaseline(target, source, env):  # pylint: disable=W0613,W0621
+    baseline_path = get_size_baseline_path(env)
+    budgets.save_baseline(
+        baseline_path,
+        get_size_metrics(env, source, get_memory_usage(env, source)),
+    )
+    print("Saved size baseline to %s" % baseline_path)
+
+
+def RunSimulatorTests(target, source, env):  # pylint: disable=W0613,W0621
+    board = env.BoardConfig()
+    mcu = board.get("debug.simavr_target", "")
+    if not mcu:
+        sys.stderr.write(
+            "Error: simavr does not support the `%s` board\n" % env.subst("$BOARD")
+        )
+        env.Exit(1)
+
+    programs = [source[0].get_abspath()]
+    if board.get("build.simtest_programs", ""):
+        programs = simtest.resolve_programs(
+            board.get("build.simtest_programs"), env.subst("$PROJECT_DIR")
+        )
+    if not programs:
+        sys.stderr.write(
+            "Error: No programs match `%s`\n" % board.get("build.simtest_programs")
+        )
+        env.Exit(1)
+
+    simavr = join(env.PioPlatform().get_package_dir("tool-simavr"), "bin", "simavr")
+    commands = [
+        simtest.get_command(simavr, mcu, env.subst("$BOARD_F_CPU"), program)
+        for program in programs
+    ]
+    print("Running %d programs on simavr (%s)" % (len(commands), mcu))
+    results = simtest.run_parallel(
+        commands,
+        jobs=board.get("build.simtest_jobs", env.GetOption("num_jobs")),
+        timeout=float(board.get("build.simtest_timeout", simtest.DEFAULT_TIMEOUT)),
+        on_result=lambda result: print(simtest.format_result(result)),
+    )
+
+    report_path = env.subst(join("$BUILD_DIR", "simtest.json"))
+    with open(report_path, "w", encoding="utf8") as fp:
+        json.dump(results, fp, indent=2)
+
+    return None if simtest.print_report(results) else 1
 
 
 env = DefaultEnvironment()
@@ -104,41 +650,63 @@ env.Replace(
     SIZEDATAREGEXP=r"^(?:\.data|\.bss|\.noinit)\s+(\d+).*",
     SIZECHECKCMD="$SIZETOOL -A -d $SOURCES",
     SIZEPRINTCMD="$SIZETOOL --mcu=$BOARD_MCU -C -d $SOURCES",
+    SIZEPROGSECTIONS=list(sizes.PROGRAM_SECTIONS),
+    SIZEDATASECTIONS=list(sizes.DATA_SECTIONS),
+    SIZEEEPROMSECTIONS=list(sizes.EEPROM_SECTIONS),
     PROGSUFFIX=".elf",
 )
 
+# Link map for the size report and the library size budgets
+if is_link_map_required(env):
+    env.Append(LINKFLAGS=["-Wl,-Map,${BUILD_DIR}/${PROGNAME}.map"])
+
+# Opt-in cache of compiled objects, `board_build.compiler_cache = yes`
+if "BOARD" in env:
+    compilecache.install(env)
+
+# Calculate program size from the ELF section headers instead of running
+# avr-size, `board_build.native_size = no` restores the avr-size commands
+native_size = "BOARD" not in env or str(
+    env.BoardConfig().get("build.native_size", "yes")
+).lower() not in ("0", "no", "false")
+if native_size:
+    env.AddMethod(CheckProgramSize, "CheckUploadSize")
+
+# Convert ELF to Intel HEX in-process, `board_build.native_ihex = no` falls
+# back to avr-objcopy
+if "BOARD" not in env or str(
+    env.BoardConfig().get("build.native_ihex", "yes")
+).lower() not in ("0", "no", "false"):
+    elf_to_eep_action = env.VerboseAction(ConvertElfToEep, "Building $TARGET")
+    elf_to_hex_action = env.VerboseAction(ConvertElfToHex, "Building $TARGET")
+else:
+    elf_to_eep_action = env.VerboseAction(
+        " ".join(
+            [
+                "$OBJCOPY",
+                "-O",
+                "ihex",
+                "-j",
+                ".eeprom",
+                '--set-section-flags=.eeprom="alloc,load"',
+                "--no-change-warnings",
+                "--change-section-lma",
+                ".eeprom=0",
+                "$SOURCES",
+                "$TARGET",
+            ]
+        ),
+        "Building $TARGET",
+    )
+    elf_to_hex_action = env.VerboseAction(
+        " ".join(["$OBJCOPY", "-O", "ihex", "-R", ".eeprom", "$SOURCES", "$TARGET"]),
+        "Building $TARGET",
+    )
+
 env.Append(
     BUILDERS=dict(
-        ElfToEep=Builder(
-            action=env.VerboseAction(
-                " ".join(
-                    [
-                        "$OBJCOPY",
-                        "-O",
-                        "ihex",
-                        "-j",
-                        ".eeprom",
-                        '--set-section-flags=.eeprom="alloc,load"',
-                        "--no-change-warnings",
-                        "--change-section-lma",
-                        ".eeprom=0",
-                        "$SOURCES",
-                        "$TARGET",
-                    ]
-                ),
-                "Building $TARGET",
-            ),
-            suffix=".eep",
-        ),
-        ElfToHex=Builder(
-            action=env.VerboseAction(
-                " ".join(
-                    ["$OBJCOPY", "-O", "ihex", "-R", ".eeprom", "$SOURCES", "$TARGET"]
-                ),
-                "Building $TARGET",
-            ),
-            suffix=".hex",
-        ),
+        ElfToEep=Builder(action=elf_to_eep_action, suffix=".eep"),
+        ElfToHex=Builder(action=elf_to_hex_action, suffix=".hex"),
     )
 )
 
@@ -154,11 +722,23 @@ if not env.get("PIOFRAMEWORK"):
 #
 
 target_elf = None
+matrix_targets = []
+matrix_actions = None
 if "nobuild" in COMMAND_LINE_TARGETS:
     target_elf = join("$BUILD_DIR", "${PROGNAME}.elf")
     target_firm = join("$BUILD_DIR", "${PROGNAME}.hex")
 else:
+    # The other boards of the matrix start from the environment as it was
+    # before the main program was set up
+    base_env = env.Clone() if "matrix" in COMMAND_LINE_TARGETS else None
     target_elf = env.BuildProgram()
+    corecache.build_libraries(env)
+    if base_env:
+        matrix_targets, matrix_actions = env.SConscript(
+            "matrix.py", exports=["env", "base_env"]
+        )
+    if "BOARD" in env:
+        lto.configure(env, target_elf)
     target_firm = env.ElfToHex(join("$BUILD_DIR", "${PROGNAME}"), target_elf)
     env.Depends(target_firm, "checkprogsize")
 
@@ -172,16 +752,42 @@ target_buildprog = env.Alias("buildprog", target_firm, target_firm)
 target_size = env.AddPlatformTarget(
     "size",
     target_elf,
-    env.VerboseAction("$SIZEPRINTCMD", "Calculating size $SOURCE"),
+    env.VerboseAction(
+        PrintProgramSize if native_size else "$SIZEPRINTCMD",
+        "Calculating size $SOURCE",
+    ),
     "Program Size",
     "Calculate program size",
 )
 
+#
+# Target: Print flash and RAM usage per library, object and symbol
+#
+
+env.AddPlatformTarget(
+    "sizereport",
+    target_elf,
+    env.VerboseAction(PrintSizeReport, "Calculating size report"),
+    "Program Size Report",
+)
+
+#
+# Target: Save the sizes checked by the size growth limits
+#
+
+env.AddPlatformTarget(
+    "sizebaseline",
+    target_elf,
+    env.VerboseAction(SaveSizeBaseline, "Saving size baseline"),
+    "Save Size Baseline",
+)
+
 #
 # Target: Upload by default .hex file
 #
 
 upload_protocol = env.subst("$UPLOAD_PROTOCOL")
+invalidate_flash_action = env.VerboseAction(InvalidateFlashRecords, None)
 
 if upload_protocol == "micronucleus":
     env.Replace(
@@ -194,10 +800,22 @@ if upload_protocol == "micronucleus":
         ],
         UPLOADCMD="$UPLOADER $UPLOADERFLAGS $SOURCES",
     )
-    upload_actions = [env.VerboseAction("$UPLOADCMD", "Uploading $SOURCE")]
+    upload_actions = [
+        invalidate_flash_action,
+        env.VerboseAction(
+            uploadtrace.traced_command(env, "upload", "$UPLOADCMD"),
+            "Uploading $SOURCE",
+        )
+    ]
 
 elif upload_protocol == "custom":
-    upload_actions = [env.VerboseAction("$UPLOADCMD", "Uploading $SOURCE")]
+    upload_actions = [
+        invalidate_flash_action,
+        env.VerboseAction(
+            uploadtrace.traced_command(env, "upload", "$UPLOADCMD"),
+            "Uploading $SOURCE",
+        )
+    ]
 
 else:
     env.Replace(
@@ -224,9 +842,37 @@ else:
 
     upload_actions = [
         env.VerboseAction(BeforeUpload, "Looking for upload port..."),
-        env.VerboseAction("$UPLOADCMD", "Uploading $SOURCE"),
+        invalidate_flash_action,
+        env.VerboseAction(
+            uploadtrace.traced_command(env, "upload", "$UPLOADCMD"),
+            "Uploading $SOURCE",
+        ),
     ]
 
+    # Upload the same firmware to several boards at once
+    if "BOARD" in env and env.BoardConfig().get("upload.ports", ""):
+        upload_actions = [
+            env.VerboseAction(
+                uploadtrace.traced_function(env, "upload", UploadToPorts),
+                "Uploading $SOURCE to several ports",
+            )
+        ]
+
+    # Rewrite only flash pages changed since the previous upload
+    elif "BOARD" in env and str(
+        env.BoardConfig().get("upload.delta", "no")
+    ).lower() in ("1", "yes", "true"):
+        if upload_protocol in deltaflash.DELTA_PROTOCOLS:
+            upload_actions = [
+                env.VerboseAction(BeforeUpload, "Looking for upload port..."),
+                env.VerboseAction(UploadDelta, "Checking flash pages"),
+            ]
+        else:
+            print(
+                "Warning: Delta upload is not supported by the `%s` protocol, "
+                "the whole image will be written" % upload_protocol
+            )
+
 
 env.AddPlatformTarget("upload", target_firm, upload_actions, "Upload")
 
@@ -234,14 +880,21 @@ env.AddPlatformTarget("upload", target_firm, upload_actions, "Upload")
 # Target: Upload EEPROM data (from EEMEM directive)
 #
 
-env.AddPlatformTarget(
-    "uploadeep",
+target_eep = (
     join("$BUILD_DIR", "${PROGNAME}.eep")
     if "nobuild" in COMMAND_LINE_TARGETS
-    else env.ElfToEep(target_elf),
+    else env.ElfToEep(target_elf)
+)
+
+env.AddPlatformTarget(
+    "uploadeep",
+    target_eep,
     [
         env.VerboseAction(BeforeUpload, "Looking for upload port..."),
-        env.VerboseAction("$UPLOADEEPCMD", "Uploading $SOURCE"),
+        env.VerboseAction(
+            uploadtrace.traced_command(env, "uploadeep", "$UPLOADEEPCMD"),
+            "Uploading $SOURCE",
+        ),
     ],
     "Upload EEPROM",
 )
@@ -264,7 +917,10 @@ if "program" in COMMAND_LINE_TARGETS:
 
 fuses_action = None
 if "fuses" in COMMAND_LINE_TARGETS:
-    fuses_action = env.SConscript("fuses.py", exports="env")
+    fuses_action = [
+        invalidate_flash_action,
+        env.SConscript("fuses.py", exports="env"),
+    ]
 env.AddPlatformTarget("fuses", None, fuses_action, "Set Fuses")
 
 #
@@ -273,9 +929,49 @@ env.AddPlatformTarget("fuses", None, fuses_action, "Set Fuses")
 
 bootloader_actions = None
 if "bootloader" in COMMAND_LINE_TARGETS:
-    bootloader_actions = env.SConscript("bootloader.py", exports="env")
+    bootloader_actions = [invalidate_flash_action] + env.SConscript(
+        "bootloader.py", exports="env"
+    )
 env.AddPlatformTarget("bootloader", None, bootloader_actions, "Burn Bootloader")
 
+#
+# Target: Program bootloader, firmware, EEPROM and fuses in one ISP session
+#
+
+production_actions = None
+if "production" in COMMAND_LINE_TARGETS:
+    production_actions = [invalidate_flash_action] + env.SConscript(
+        "production.py", exports="env"
+    )
+env.AddPlatformTarget(
+    "production",
+    [target_firm, target_eep],
+    production_actions,
+    "Program Production Image",
+)
+
+#
+# Target: Build the project for every board of `board_build.matrix`
+#
+
+env.AddPlatformTarget(
+    "matrix",
+    [target_firm] + matrix_targets,
+    matrix_actions,
+    "Build Board Matrix",
+)
+
+#
+# Target: Run the firmware or `board_build.simtest_programs` on simavr
+#
+
+env.AddPlatformTarget(
+    "simtest",
+    target_elf,
+    env.VerboseAction(RunSimulatorTests, "Running on simavr"),
+    "Simulator Tests",
+)
+
 #
 # Setup default targets
 #
@@ -0,0 +1,272 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+#
+# Board matrix: `pio run -t matrix` builds the project for every board of
+# `board_build.matrix` in the same SCons process, so all builds share one
+# job scheduler. Boards with the same build settings (mcu, f_cpu, core,
+# variant and flags) share one build. The `board_*` options of the
+# environment apply to every board of the matrix.
+#
+
+import hashlib
+import json
+import re
+import sys
+from contextlib import contextmanager
+from os.path import join
+
+import SCons.Defaults
+from SCons.Script import DefaultEnvironment, Export, Import, Return
+
+from avrtools import corecache, elf, lto, sizes
+
+# `env` is the primary environment after `env.BuildProgram()`, `base_env` a
+# copy taken before it
+Import("env", "base_env", "projenv")
+
+
+def parse_boards(value):
+    if isinstance(value, (list, tuple)):
+        value = ",".join(value)
+    return [item for item in re.split(r"[\s,]+", str(value)) if item]
+
+
+def get_board_config(board_id):
+    """Returns the board manifest with the overrides of the environment"""
+    if board_id in board_configs:
+        return board_configs[board_id]
+    board_config = env.BoardConfig(board_id)
+    for option, value in env.GetProjectOptions():
+        if not option.startswith("board_"):
+            continue
+        option = option.lower()[6:]
+        try:
+            if isinstance(board_config.get(option), bool):
+                value = str(value).lower() in ("1", "yes", "true")
+            elif isinstance(board_config.get(option), int):
+                value = int(value)
+        except KeyError:
+            pass
+        board_config.update(option, value)
+    board_configs[board_id] = board_config
+    return board_config
+
+
+def get_build_key(board_config):
+    data = dict(
+        build={
+            name: value
+            for name, value in board_config.get("build", {}).items()
+            if name != "matrix"
+        },
+        vendor=board_config.get("vendor", ""),
+    )
+    return hashlib.sha1(
+        json.dumps(data, sort_keys=True, default=str).encode()
+    ).hexdigest()[:10]
+
+
+def get_maximum_sizes(board_config):
+    return (
+        int(board_config.get("upload.maximum_size", 0)),
+        int(board_config.get("upload.maximum_ram_size", 0)),
+    )
+
+
+def exit_unsupported(reason):
+    sys.stderr.write(
+        "Error: The matrix target does not support this version of "
+        "PlatformIO Core (%s)\n" % reason
+    )
+    env.Exit(1)
+
+
+def check_default_environment():
+    """The matrix builds depend on internals of SCons and PlatformIO Core,
+    an upgrade which changes them must not silently mix up the builds"""
+    if getattr(SCons.Defaults, "_default_env", None) is not env:
+        exit_unsupported("the default environment can not be replaced")
+    # Filled by `env.BuildProgram()` of the primary build
+    for name in ("PIOBUILDFILES", "__PIO_LIB_BUILDERS"):
+        if name not in env:
+            exit_unsupported("`%s` is not in the default environment" % name)
+
+
+@contextmanager
+def default_environment(build_env):
+    """PlatformIO keeps the library builders and the objects of the program
+    in the default environment, a matrix build uses its own meanwhile"""
+    # pylint: disable=protected-access
+    default_env = SCons.Defaults._default_env
+    SCons.Defaults._default_env = build_env
+    try:
+        if DefaultEnvironment() is not build_env:
+            exit_unsupported("the default environment can not be replaced")
+        yield
+    finally:
+        SCons.Defaults._default_env = default_env
+
+
+def BuildMatrixProgram(key, board_id):
+    board_config = get_board_config(board_id)
+    build_env = base_env.Clone(
+        BOARD=board_id,
+        BOARD_MCU=board_config.get("build.mcu"),
+        BOARD_F_CPU=board_config.get("build.f_cpu"),
+        BUILD_DIR=join(env.subst("$BUILD_DIR"), "matrix", key),
+        PIOBUILDFILES=[],
+        __PIO_LIB_BUILDERS=None,
+    )
+    # The same steps as `env.BuildProgram()` without the size check target
+    # and the main program registration of the primary build
+    with default_environment(build_env):
+        build_env.ProcessProgramDeps()
+        corecache.build_libraries(build_env)
+        build_env.ProcessProjectDeps()
+    if build_env.get("LIBS"):
+        build_env.Prepend(_LIBFLAGS="-Wl,--start-group ")
+        build_env.Append(_LIBFLAGS=" -Wl,--end-group")
+    program = build_env.Program(
+        build_env.subst("$PROGPATH"), build_env["PIOBUILDFILES"]
+    )
+    lto.configure(build_env, program)
+    return program, build_env.ElfToHex(join("$BUILD_DIR", "${PROGNAME}"), program)
+
+
+def ReportMatrix(target, source, env):  # pylint: disable=W0613,W0621
+    rows = []
+    failed = False
+    for board_id in boards:
+        key = board_keys[board_id]
+        program, representative, initial_sizes = builds[key]
+        if program is None:
+            program = env["PIOMAINPROG"]
+        # The framework script reserves the bootloader space on the board
+        # it builds for, the other boards of the build get the same
+        reserved = [
+            initial - current
+            for initial, current in zip(
+                initial_sizes, get_maximum_sizes(get_board_config(representative))
+            )
+        ]
+        maximum_sizes = [
+            max(0, size - delta)
+            for size, delta in zip(
+                get_maximum_sizes(get_board_config(board_id)), reserved
+            )
+        ]
+        usage = sizes.calculate_usage(
+            elf.load_elf(program[0].get_abspath()),
+            env["SIZEPROGSECTIONS"],
+            env["SIZEDATASECTIONS"],
+            env["SIZEEEPROMSECTIONS"],
+            dict(program=maximum_sizes[0], data=maximum_sizes[1]),
+        )
+        too_big = [
+            group
+            for group in ("program", "data")
+            if usage[group]["maximum"]
+            and usage[group]["size"] > usage[group]["maximum"]
+        ]
+        failed = failed or bool(too_big)
+        rows.append(
+            dict(
+                board=board_id,
+                build=key,
+                shared_with=representative if representative != board_id else None,
+                mcu=get_board_config(board_id).get("build.mcu"),
+                program=usage["program"],
+                data=usage["data"],
+                status="too big" if too_big else "ok",
+            )
+        )
+
+    print(
+        "%-24s %-12s %-10s %-28s %-28s %s"
+        % ("Board", "MCU", "Build", "Flash", "RAM", "Status")
+    )
+    for row in rows:
+        print(
+            "%-24s %-12s %-10s %-28s %-28s %s"
+            % (
+                row["board"],
+                row["mcu"],
+                row["build"],
+                format_usage(row["program"]),
+                format_usage(row["data"]),
+                row["status"],
+            )
+        )
+    print(
+        "%d boards in %d builds" % (len(rows), len(set(row["build"] for row in rows)))
+    )
+    with open(
+        env.subst(join("$BUILD_DIR", "matrix.json")), "w", encoding="utf8"
+    ) as fp:
+        json.dump(rows, fp, indent=2)
+
+    if failed:
+        sys.stderr.write("Error: The program does not fit on some boards\n")
+        env.Exit(1)
+
+
+def format_usage(usage):
+    if not usage["maximum"]:
+        return "%d bytes" % usage["size"]
+    return "%d/%d bytes (%.1f%%)" % (
+        usage["size"],
+        usage["maximum"],
+        usage["size"] * 100.0 / usage["maximum"],
+    )
+
+
+board_configs = {}
+boards = parse_boards(env.BoardConfig().get("build.matrix", ""))
+if not boards:
+    sys.stderr.write(
+        "Error: The matrix target requires a list of boards in "
+        "`board_build.matrix`\n"
+    )
+    env.Exit(1)
+
+check_default_environment()
+
+primary_key = get_build_key(get_board_config(env.subst("$BOARD")))
+board_keys = {}
+# key: (program, representative board, maximum sizes before the build)
+builds = {
+    primary_key: (
+        None,
+        env.subst("$BOARD"),
+        get_maximum_sizes(get_board_config(env.subst("$BOARD"))),
+    )
+}
+matrix_targets = []
+for board in boards:
+    board_keys[board] = get_build_key(get_board_config(board))
+    if board_keys[board] in builds:
+        continue
+    initial_sizes = get_maximum_sizes(get_board_config(board))
+    matrix_program, matrix_firmware = BuildMatrixProgram(board_keys[board], board)
+    builds[board_keys[board]] = (matrix_program, board, initial_sizes)
+    matrix_targets.append(matrix_firmware)
+
+# The project builder of every matrix build exports its own `projenv`, the
+# post scripts get the one of the primary build
+Export("projenv")
+
+matrix_actions = [env.VerboseAction(ReportMatrix, "Board matrix")]
+
+Return("matrix_targets", "matrix_actions")
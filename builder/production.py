@@ -0,0 +1,90 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+#
+# Production image: bootloader, application, EEPROM data, fuses and lock
+# bits programmed in one ISP session
+#
+
+import sys
+from os.path import isfile, join
+
+from SCons.Script import Import, Return
+
+from avrtools import deltaflash, ihex, uploadtrace
+
+Import("env")
+
+
+def BuildProductionImage(target, source, env):  # pylint: disable=W0613,W0621
+    image_path = env.subst("$PRODUCTIONIMAGE")
+    try:
+        segments = ihex.merge_segments(
+            ihex.read_ihex(env.subst("$BOOTLOADERIMAGE"))
+            + ihex.read_ihex(source[0].get_abspath())
+        )
+    except (OSError, ihex.IHexError) as exc:
+        sys.stderr.write(
+            "Error: Could not merge the bootloader and the application: %s\n" % exc
+        )
+        env.Exit(1)
+    ihex.write_ihex(image_path, segments)
+
+    flags = [] if "-e" in env["FUSESUPLOADERFLAGS"] else ["-e"]
+    flags.append("-Uflash:w:%s:i" % image_path)
+    eeprom_path = source[1].get_abspath() if len(source) > 1 else ""
+    if isfile(eeprom_path) and ihex.read_ihex(eeprom_path):
+        flags.append("-Ueeprom:w:%s:i" % eeprom_path)
+    # Fuses after the memories, the lock bits always last
+    flags.extend(
+        "-U%s:w:%s:m" % (name, value)
+        for name, value in env["SELECTEDFUSES"]
+        if name != "lock"
+    )
+    flags.append("-Ulock:w:%s:m" % env["BOOTLOCKBITS"])
+    env.Replace(PRODUCTIONFLAGS=flags)
+
+    print(
+        "Production image: %d bytes of flash in %d segment(s)"
+        % (sum(len(data) for _, data in segments), len(segments))
+    )
+
+
+upload_protocol = env.subst("$UPLOAD_PROTOCOL")
+if upload_protocol in ("custom", "micronucleus") or (
+    upload_protocol in deltaflash.DELTA_PROTOCOLS
+):
+    sys.stderr.write(
+        "Error: The production target requires an ISP programmer, the `%s` "
+        "upload protocol is not supported\n" % upload_protocol
+    )
+    env.Exit(1)
+
+# Resolves the bootloader image, fuses and lock bits
+env.SConscript("bootloader.py", exports="env")
+
+env.Replace(
+    PRODUCTIONIMAGE=join("$BUILD_DIR", "${PROGNAME}.production.hex"),
+    PRODUCTIONCMD="$FUSESUPLOADER $FUSESUPLOADERFLAGS $UPLOAD_FLAGS $PRODUCTIONFLAGS",
+)
+
+production_actions = [
+    env.VerboseAction(BuildProductionImage, "Merging bootloader and $SOURCE"),
+    env.VerboseAction(
+        uploadtrace.traced_command(env, "production", "$PRODUCTIONCMD"),
+        "Programming $PRODUCTIONIMAGE",
+    ),
+]
+
+Return("production_actions")
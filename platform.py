@@ -12,18 +12,156 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import copy
+import importlib.util
+import json
+import os
+import re
+import sys
+import time
+
+from platformio.platform.board import PlatformBoardConfig
 from platformio.public import PlatformBase
 
+BOARD_INDEX_FORMAT = 1
+
+
+def get_process_cache(name):
+    # This module is executed again for every PlatformFactory.new() call,
+    # state shared by all environments of a process is kept on PlatformBase
+    if not hasattr(PlatformBase, "_atmelavr_caches"):
+        PlatformBase._atmelavr_caches = {}  # pylint: disable=protected-access
+    return PlatformBase._atmelavr_caches.setdefault(  # pylint: disable=W0212
+        name, {}
+    )
+
+
+def load_builder_module(name):
+    # Dependency-free helpers from builder/avrtools are loaded by path, the
+    # builder folder is not added to sys.path as its SConscripts would shadow
+    # other modules
+    module_name = "atmelavr_%s" % name
+    if module_name not in sys.modules:
+        spec = importlib.util.spec_from_file_location(
+            module_name,
+            os.path.join(
+                os.path.dirname(os.path.realpath(__file__)),
+                "builder",
+                "avrtools",
+                "%s.py" % name,
+            ),
+        )
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        sys.modules[module_name] = module
+    return sys.modules[module_name]
+
+
+class CachedBoardConfig(PlatformBoardConfig):
+    """Board restored from the board index without parsing its manifest"""
+
+    def __init__(self, manifest_path, manifest):  # pylint: disable=W0231
+        self._id = os.path.basename(manifest_path)[:-5]
+        self.manifest_path = manifest_path
+        self._manifest = manifest
+
 
 class AtmelavrPlatform(PlatformBase):
 
+    def __init__(self, manifest_path):
+        super().__init__(manifest_path)
+        self._debug_ready_boards = set()
+        self._board_index = None
+        self._board_index_stored = set()
+        self._board_lookup = None
+        self._tool_progress = None
+        self.upload_events = []
+        self.upload_summary = None
+
     def configure_default_packages(self, variables, targets):
         if not variables.get("board"):
             return super().configure_default_packages(variables, targets)
 
+        started = time.perf_counter()
+        plans = get_process_cache("package_plans")
+        stats = get_process_cache("package_plan_stats")
+        key = (
+            str(self.version),
+            variables.get("board"),
+            variables.get("board_build.core"),
+            tuple(variables.get("pioframework", [])),
+            variables.get("upload_protocol"),
+            tuple(sorted(set(targets or []))),
+        )
+        plan = plans.get(key)
+        if plan is None:
+            plan = plans[key] = self._resolve_package_plan(variables, targets)
+        else:
+            stats["hits"] = stats.get("hits", 0) + 1
+
+        if plan["framework_package"]:
+            if plan["avrdude_version"]:
+                self.packages["tool-avrdude"]["version"] = plan["avrdude_version"]
+            self.frameworks["arduino"]["package"] = plan["framework_package"]
+            self.packages[plan["framework_package"]]["optional"] = False
+            self.packages["framework-arduino-avr"]["optional"] = True
+
+        # The matrix target builds the other boards in the same process
+        if "matrix" in (targets or []):
+            for board in re.split(r"[\s,]+", variables.get("board_build.matrix", "")):
+                if not board or board == variables.get("board"):
+                    continue
+                matrix_plan = self._resolve_package_plan(
+                    dict(variables, board=board), targets
+                )
+                framework_package = matrix_plan["framework_package"]
+                if not framework_package and "arduino" in variables.get(
+                    "pioframework", []
+                ):
+                    framework_package = "framework-arduino-avr"
+                if framework_package in self.packages:
+                    self.packages[framework_package]["optional"] = False
+
+        if "simtest" in (targets or []) and "tool-simavr" in self.packages:
+            self.packages["tool-simavr"]["optional"] = False
+
+        required_tool = plan["required_tool"]
+        disabled_tool = plan["disabled_tool"]
+        if required_tool in self.packages:
+            self.packages[required_tool]["optional"] = False
+
+        if disabled_tool in self.packages and disabled_tool != required_tool:
+            del self.packages[disabled_tool]
+
+        elapsed = time.perf_counter() - started
+        stats["calls"] = stats.get("calls", 0) + 1
+        stats["elapsed"] = stats.get("elapsed", 0.0) + elapsed
+        if os.getenv("PLATFORMIO_ATMELAVR_PROFILE"):
+            sys.stderr.write(
+                "atmelavr: package plan for %s in %.3f ms (%d calls, %d cached, "
+                "%.3f ms total)\n"
+                % (
+                    key[1],
+                    elapsed * 1000,
+                    stats["calls"],
+                    stats.get("hits", 0),
+                    stats["elapsed"] * 1000,
+                )
+            )
+
+        return super().configure_default_packages(variables, targets)
+
+    def _resolve_package_plan(self, variables, targets):
+        board_config = self.board_config(variables.get("board"))
         build_core = variables.get(
-            "board_build.core", self.board_config(variables.get("board")).get(
-                "build.core", "arduino"))
+            "board_build.core", board_config.get("build.core", "arduino")
+        )
+        plan = dict(
+            framework_package=None,
+            avrdude_version=None,
+            required_tool="",
+            disabled_tool="tool-micronucleus",
+        )
 
         if "arduino" in variables.get(
                 "pioframework", []) and build_core != "arduino":
@@ -41,51 +179,225 @@ class AtmelavrPlatform(PlatformBase):
                 "MajorCore",
                 "MicroCore",
             ):
-                self.packages["tool-avrdude"]["version"] = "~1.80100.0"
+                plan["avrdude_version"] = "~1.80100.0"
 
-            self.frameworks["arduino"]["package"] = framework_package
-            self.packages[framework_package]["optional"] = False
-            self.packages["framework-arduino-avr"]["optional"] = True
+            plan["framework_package"] = framework_package
 
         upload_protocol = variables.get(
-            "upload_protocol",
-            self.board_config(variables.get("board")).get(
-                "upload.protocol", ""))
-        disabled_tool = "tool-micronucleus"
-        required_tool = ""
-
+            "upload_protocol", board_config.get("upload.protocol", "")
+        )
         if upload_protocol == "micronucleus":
-            disabled_tool = "tool-avrdude"
+            plan["disabled_tool"] = "tool-avrdude"
 
-        if "fuses" in targets or "bootloader" in targets:
-            required_tool = "tool-avrdude"
+        # These targets run avrdude through $FUSESUPLOADER, not as an upload
+        if any(target in targets for target in ("fuses", "bootloader", "production")):
+            plan["required_tool"] = "tool-avrdude"
 
-        if required_tool in self.packages:
-            self.packages[required_tool]["optional"] = False
+        return plan
 
-        if disabled_tool in self.packages and disabled_tool != required_tool:
-            del self.packages[disabled_tool]
+    def run(  # pylint: disable=too-many-arguments
+        self, variables, targets, silent, verbose, jobs
+    ):
+        toolprogress = load_builder_module("toolprogress")
+        self._tool_progress = toolprogress.ProgressParser(self.on_upload_event)
+        self.upload_events = []
+        try:
+            return super().run(variables, targets, silent, verbose, jobs)
+        finally:
+            tool_progress, self._tool_progress = self._tool_progress, None
+            if tool_progress:
+                self.upload_summary = tool_progress.close()
+                text = toolprogress.format_summary(self.upload_summary)
+                if text and not silent:
+                    print("Upload summary: %s" % text)
 
-        return super().configure_default_packages(variables, targets)
+    def on_upload_event(self, event):
+        """Receives events of the avrdude and micronucleus output parser"""
+        self.upload_events.append(event)
+
+    def _feed_tool_progress(self, line):
+        if self._tool_progress:
+            self._tool_progress.feed(line)
 
-    def on_run_err(self, line):  # pylint: disable=R0201
-        # fix STDERR "flash written" for avrdude
-        if "avrdude" in line:
-            self.on_run_out(line)
+    # PlatformIO 6 passes every line of the build process output to these
+    # callbacks, they replace the former `on_run_out`/`on_run_err` hooks
+    def _on_stdout_line(self, line):
+        self._feed_tool_progress(line)
+        super()._on_stdout_line(line)
+
+    def _on_stderr_line(self, line):
+        self._feed_tool_progress(line)
+        # fix STDERR "flash written" for avrdude, its errors stay on STDERR
+        if "avrdude" in line and not self.LINE_ERROR_RE.search(line):
+            super()._on_stdout_line(line)
         else:
-            super().on_run_err(line)
+            super()._on_stderr_line(line)
 
     def get_boards(self, id_=None):
+        if id_ is None:
+            self._restore_board_index()
         result = super().get_boards(id_)
         if not result:
             return result
-        if id_:
-            return self._add_default_debug_tools(result)
-        else:
-            for key, value in result.items():
-                result[key] = self._add_default_debug_tools(result[key])
+        boards = {id_: result} if id_ else result
+        for key, board in boards.items():
+            if key in self._debug_ready_boards:
+                continue
+            self._add_default_debug_tools(board)
+            self._debug_ready_boards.add(key)
+            if self._board_index is not None:
+                self._board_index[key] = dict(
+                    path=board.manifest_path,
+                    mtime=os.path.getmtime(board.manifest_path),
+                    manifest=copy.deepcopy(board.manifest),
+                )
+                self._board_lookup = None
+        if id_ is None:
+            self._store_board_index()
+        return result
+
+    def find_boards(self, mcu=None, core=None, f_cpu=None, protocol=None):
+        """Returns sorted IDs of boards matching all given criteria"""
+        if self._board_lookup is None:
+            self._board_lookup = dict(mcu={}, core={}, f_cpu={}, protocol={})
+            for key, board in self.get_boards().items():
+                for field, value in (
+                    ("mcu", board.get("build.mcu", "")),
+                    ("core", board.get("build.core", "")),
+                    ("f_cpu", board.get("build.f_cpu", "")),
+                    ("protocol", board.get("upload.protocol", "")),
+                ):
+                    self._board_lookup[field].setdefault(
+                        str(value).lower(), set()
+                    ).add(key)
+        result = None
+        for field, value in (
+            ("mcu", mcu),
+            ("core", core),
+            ("f_cpu", f_cpu),
+            ("protocol", protocol),
+        ):
+            if value is None:
+                continue
+            matched = self._board_lookup[field].get(str(value).lower(), set())
+            result = matched if result is None else result & matched
+        if result is None:
+            result = self.get_boards().keys()
+        return sorted(result)
+
+    def _get_board_index_path(self):
+        return os.path.join(
+            self.config.get("platformio", "cache_dir"), "atmelavr-boards.json"
+        )
+
+    def _get_board_manifest_paths(self):
+        # The same lookup order as in PlatformBase.get_boards
+        result = {}
+        for boards_dir in (
+            self.config.get("platformio", "boards_dir"),
+            os.path.join(self.config.get("platformio", "core_dir"), "boards"),
+            os.path.join(self.get_dir(), "boards"),
+        ):
+            if not os.path.isdir(boards_dir):
+                continue
+            for item in os.listdir(boards_dir):
+                if item.endswith(".json"):
+                    result.setdefault(item[:-5], os.path.join(boards_dir, item))
         return result
 
+    def _restore_board_index(self):
+        if self._board_index is not None:
+            return
+        self._board_index = {}
+        try:
+            with open(self._get_board_index_path(), encoding="utf8") as fp:
+                data = json.load(fp)
+        except (OSError, ValueError):
+            return
+        if data.get("format") != BOARD_INDEX_FORMAT or data.get(
+            "version"
+        ) != str(self.version):
+            return
+        manifest_paths = self._get_board_manifest_paths()
+        for key, item in data.get("boards", {}).items():
+            path = manifest_paths.get(key)
+            if key in self._BOARDS_CACHE or path != item["path"]:
+                continue
+            try:
+                if os.path.getmtime(path) != item["mtime"]:
+                    continue
+            except OSError:
+                continue
+            self._BOARDS_CACHE[key] = CachedBoardConfig(
+                path, copy.deepcopy(item["manifest"])
+            )
+            self._debug_ready_boards.add(key)
+            self._board_index[key] = item
+        self._board_index_stored = set(self._board_index)
+
+    def _store_board_index(self):
+        # stale entries were not restored and are rewritten after re-parsing
+        if set(self._board_index) == self._board_index_stored:
+            return
+        path = self._get_board_index_path()
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + ".tmp", "w", encoding="utf8") as fp:
+                json.dump(
+                    dict(
+                        format=BOARD_INDEX_FORMAT,
+                        version=str(self.version),
+                        boards=self._board_index,
+                    ),
+                    fp,
+                )
+            os.replace(path + ".tmp", path)
+            self._board_index_stored = set(self._board_index)
+        except OSError:
+            pass
+
+    def configure_debug_session(self, debug_config):
+        server = debug_config.server
+        if debug_config.tool_name != "simavr" or not server:
+            return
+        if debug_config.env_options.get("debug_server"):
+            return
+
+        simavrpool = load_builder_module("simavrpool")
+        port = simavrpool.parse_port(debug_config.env_options.get("debug_port"))
+        if not port:
+            try:
+                pool_size = simavrpool.parse_pool_size(
+                    debug_config.env_options.get(
+                        "board_debug.simavr_pool",
+                        os.getenv(simavrpool.POOL_ENV_VAR, 0),
+                    )
+                )
+            except ValueError as exc:
+                sys.stderr.write("Warning: %s, the servers are not pooled\n" % exc)
+                pool_size = 0
+            pool = simavrpool.ServerPool(
+                os.path.join(
+                    debug_config.project_config.get("platformio", "core_dir"),
+                    ".cache",
+                    "atmelavr-simavr",
+                ),
+                os.path.join(server["cwd"] or "", server["executable"]),
+                simavrpool.get_option(server["arguments"], "-m"),
+                simavrpool.get_option(server["arguments"], "-f"),
+                pool_size,
+            )
+            port = pool.acquire()
+            if port:
+                # The claimed server is already running
+                debug_config.server = None
+                debug_config.port = ":%d" % port
+                return
+            port = simavrpool.find_free_port()
+
+        debug_config.port = ":%d" % port
+        server["arguments"] = simavrpool.set_gdb_port(server["arguments"], port)
+
     def _add_default_debug_tools(self, board):
         debug = board.manifest.get("debug", {})
         build = board.manifest.get("build", {})
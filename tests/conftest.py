@@ -0,0 +1,34 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import sys
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES_DIR = os.path.join(ROOT_DIR, "tests", "fixtures")
+
+# `avrtools` is imported the way the build scripts do
+sys.path.insert(0, os.path.join(ROOT_DIR, "builder"))
+
+
+@pytest.fixture
+def load_fixture():
+    def _load(name):
+        with open(os.path.join(FIXTURES_DIR, name), encoding="utf8") as fp:
+            return json.load(fp)
+
+    return _load
@@ -0,0 +1,18 @@
+#define FAR __attribute__((section(".far"), used))
+volatile unsigned char counter = 5;
+FAR const unsigned char far_table[48] = {
+    1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16,
+    17, 18, 19, 20, 21, 22, 23, 24, 25, 26, 27, 28, 29, 30, 31, 32,
+    33, 34, 35, 36, 37, 38, 39, 40, 41, 42, 43, 44, 45, 46, 47, 48};
+__attribute__((section(".top"), used)) const unsigned char top_table[4] = {
+    0xDE, 0xAD, 0xBE, 0xEF};
+
+int main(void)
+{
+    return counter + 1;
+}
+
+__attribute__((section(".vectors"), used, naked)) void vectors(void)
+{
+    __asm__ volatile("rjmp main");
+}
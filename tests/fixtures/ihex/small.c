@@ -0,0 +1,11 @@
+volatile unsigned char counter = 3;
+unsigned char table[20] = "initialized data!!!";
+unsigned char config[6] __attribute__((section(".eeprom"))) = {1, 2, 3, 4, 5, 6};
+unsigned char buffer[8];
+
+int main(void)
+{
+    for (unsigned char i = 0; i < sizeof(buffer); i++)
+        buffer[i] = table[i] + counter;
+    return buffer[1];
+}
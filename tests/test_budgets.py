@@ -0,0 +1,172 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+
+import pytest
+
+from avrtools import budgets
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        (1200, 1200),
+        ("1200", 1200),
+        (" 512 b ", 512),
+        ("4K", 4096),
+        ("4 KB", 4096),
+        ("4kib", 4096),
+        ("1.5 KB", 1536),
+    ],
+)
+def test_parse_size(value, expected):
+    assert budgets.parse_size(value) == expected
+
+
+@pytest.mark.parametrize("value", ["", "KB", "-1", "4 MB", "1,5K"])
+def test_parse_invalid_size(value):
+    with pytest.raises(ValueError, match="Invalid size"):
+        budgets.parse_size(value)
+
+
+def test_parse_budgets():
+    assert budgets.parse_budgets(
+        "\n.bss: 1200\nFrameworkArduino: 4 KB, FrameworkArduino.ram: 200\n"
+    ) == {".bss": 1200, "FrameworkArduino": 4096, "FrameworkArduino.ram": 200}
+    assert budgets.parse_budgets(["flash: 30K", "ram: 1.5K"]) == {
+        "flash": 30720,
+        "ram": 1536,
+    }
+    assert budgets.parse_budgets(None) == {}
+    assert budgets.parse_budgets("") == {}
+
+
+def test_parse_budgets_colon_in_name():
+    # The size follows the last colon, a name may contain colons
+    assert budgets.parse_budgets("lib:Servo: 2K") == {"lib:Servo": 2048}
+    with pytest.raises(ValueError, match="Invalid size"):
+        budgets.parse_budgets("Servo: 2K: extra")
+
+
+@pytest.mark.parametrize("value", ["flash 30K", ": 100", "flash:"])
+def test_parse_invalid_budgets(value):
+    with pytest.raises(ValueError):
+        budgets.parse_budgets(value)
+
+
+@pytest.mark.parametrize(
+    "absolute, percent, expected",
+    [
+        (None, None, (None, None)),
+        ("", " ", (None, None)),
+        ("256", "2", (256, 2.0)),
+        ("1K", "0.5%", (1024, 0.5)),
+        (None, 10, (None, 10.0)),
+    ],
+)
+def test_parse_growth_limit(absolute, percent, expected):
+    assert budgets.parse_growth_limit(absolute, percent) == expected
+
+
+def test_parse_invalid_growth_limit():
+    with pytest.raises(ValueError, match="Invalid growth limit"):
+        budgets.parse_growth_limit(None, "two")
+    with pytest.raises(ValueError, match="Invalid size"):
+        budgets.parse_growth_limit("many", None)
+
+
+def test_get_metrics():
+    usage = dict(
+        sections={".text": 900, ".data": 20, ".bss": 100},
+        program=dict(size=920),
+        data=dict(size=120),
+    )
+    metrics = budgets.get_metrics(usage, {"Servo": dict(text=48, data=2, bss=24)})
+    assert metrics == {
+        ".text": 900,
+        ".data": 20,
+        ".bss": 100,
+        "flash": 920,
+        "ram": 120,
+        "Servo": 50,
+        "Servo.ram": 26,
+    }
+    assert [name for name in metrics if budgets.is_library_metric(name)] == [
+        "Servo",
+        "Servo.ram",
+    ]
+
+
+def test_check_budgets():
+    metrics = {".bss": 1300, "flash": 900, "Servo": 48}
+    assert budgets.check_budgets(
+        metrics, {"flash": 1000, ".bss": 1200, "Servo": 48, "Missing": 10}
+    ) == [(".bss", 1300, 1200)]
+
+
+def test_check_growth():
+    baseline = {"flash": 1000, "ram": 100, ".data": 10, "Servo": 50}
+    metrics = {"flash": 1300, "ram": 103, ".data": 12, "Servo": 40}
+    assert budgets.check_growth(metrics, baseline) == []
+    assert budgets.check_growth(metrics, baseline, absolute=256) == [
+        ("flash", 1000, 1300)
+    ]
+    # 3 %, 20 % and 30 %
+    assert budgets.check_growth(metrics, baseline, percent=2) == [
+        (".data", 10, 12),
+        ("flash", 1000, 1300),
+        ("ram", 100, 103),
+    ]
+    assert budgets.check_growth(metrics, baseline, absolute=2, percent=25) == [
+        ("flash", 1000, 1300),
+        ("ram", 100, 103),
+    ]
+    # A size which is gone counts as zero
+    assert budgets.check_growth({}, baseline, absolute=0, percent=0) == []
+
+
+def test_check_growth_from_zero():
+    # Any growth of an empty baseline size exceeds a percent limit
+    assert budgets.check_growth({".noinit": 1}, {".noinit": 0}, percent=1000) == [
+        (".noinit", 0, 1)
+    ]
+    assert budgets.check_growth({".noinit": 1}, {".noinit": 0}, absolute=1) == []
+
+
+def test_format_violations():
+    text = budgets.format_violations(
+        [(".bss", 1300, 1200)],
+        [("flash", 1000, 1300), (".noinit", 0, 8)],
+        absolute=256,
+        percent=2,
+    )
+    assert text.splitlines() == [
+        "  .bss                 1300 bytes, budget 1200 bytes (+100 bytes)",
+        "  flash                1300 bytes, baseline 1000 bytes "
+        "(+300 bytes, +30.0%, limit 256 bytes or 2%)",
+        "  .noinit                 8 bytes, baseline 0 bytes "
+        "(+8 bytes, limit 256 bytes or 2%)",
+    ]
+
+
+def test_baseline(tmp_path):
+    path = tmp_path / "sizes" / "baseline.json"
+    assert budgets.load_baseline(str(path)) is None
+    budgets.save_baseline(str(path), {"flash": 920, "Servo": 50})
+    assert budgets.load_baseline(str(path)) == {"Servo": 50, "flash": 920}
+    path.write_text(json.dumps(dict(format=0, sizes={"flash": 1})))
+    assert budgets.load_baseline(str(path)) is None
+    path.write_text("{")
+    assert budgets.load_baseline(str(path)) is None
@@ -0,0 +1,83 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from avrtools import deltaflash
+
+
+def test_diff_pages():
+    old = {0: b"\x01" * 4, 4: b"\x02" * 4, 8: b"\x03" * 4}
+    new = {0: b"\x01" * 4, 4: b"\x09" * 4, 12: b"\x04" * 4}
+    # Page 8 disappeared and is not blank, page 12 is new
+    assert deltaflash.diff_pages(old, new) == [4, 8, 12]
+    assert deltaflash.diff_pages({0: b"\xff" * 4}, {}) == []
+
+
+def test_build_delta_merges_adjacent_pages():
+    new = {0: b"\x01" * 4, 4: b"\x02" * 4}
+    assert deltaflash.build_delta(new, [0, 4, 12], 4) == [
+        (0, bytearray(b"\x01" * 4 + b"\x02" * 4)),
+        (12, bytearray(b"\xff" * 4)),
+    ]
+
+
+def test_record_store(tmp_path):
+    store = deltaflash.FlashRecordStore(str(tmp_path))
+    segments = [(0, bytearray(range(8)))]
+    store.save("COM1", "atmega328p", 4, segments)
+    assert store.load("COM1", "atmega328p", 4) == {
+        0: bytes(range(4)),
+        4: bytes(range(4, 8)),
+    }
+    assert store.load("COM1", "atmega328p", 8) is None
+    assert store.load("COM2", "atmega328p", 4) is None
+
+
+def test_invalidate_device(tmp_path):
+    store = deltaflash.FlashRecordStore(str(tmp_path))
+    segments = [(0, bytearray(4))]
+    store.save("COM1", "atmega328p", 4, segments)
+    store.save("COM10", "atmega328p", 4, segments)
+    store.save("COM1", "atmega2560", 4, segments)
+    store.save("COM2", "atmega2560", 4, segments)
+
+    # A write through COM1 drops every record of the port
+    store.invalidate_device(port="COM1")
+    assert store.load("COM1", "atmega328p", 4) is None
+    assert store.load("COM1", "atmega2560", 4) is None
+    assert store.load("COM10", "atmega328p", 4) is not None
+
+    # An ISP write does not know the serial port of the board
+    store.invalidate_device(mcu="atmega2560")
+    assert store.load("COM2", "atmega2560", 4) is None
+    assert store.load("COM10", "atmega328p", 4) is not None
+
+
+def test_invalidate_port_and_mcu(tmp_path):
+    store = deltaflash.FlashRecordStore(str(tmp_path))
+    segments = [(0, bytearray(4))]
+    store.save("COM1", "atmega328p", 4, segments)
+    store.save("COM2", "atmega328p", 4, segments)
+    store.save("COM1", "atmega2560", 4, segments)
+
+    # An upload through COM1 keeps the boards on the other ports
+    store.invalidate_device("COM1", "atmega328p")
+    assert store.load("COM1", "atmega328p", 4) is None
+    assert store.load("COM2", "atmega328p", 4) is not None
+    assert store.load("COM1", "atmega2560", 4) is not None
+
+    # Records of unknown devices are removed
+    (tmp_path / "broken.json").write_text("{", encoding="utf8")
+    store.invalidate_device("COM3", "atmega328p")
+    assert not (tmp_path / "broken.json").exists()
+    assert store.load("COM2", "atmega328p", 4) is not None
@@ -0,0 +1,164 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+#
+# `fixtures/fusedb_golden.json` holds the fuse bytes calculated by the
+# `get_lfuse`, `get_hfuse`, `get_efuse` and `get_lock_bits` functions that
+# `fusedb.json` replaced, for every MCU they knew and every combination of
+# the option values in `grid`. A cell is the hex byte, `--` for a fuse the
+# MCU does not have and `xx` for a combination that stopped the build.
+#
+
+import itertools
+
+import pytest
+
+from avrtools.fusedb import FUSES, FuseError, load_database, plan_fuses_update
+
+GOLDEN_TABLE = "fusedb_golden.json"
+
+
+def iter_golden(golden, mcu, fuse):
+    names = golden["options"][fuse]
+    cells = golden["mcus"][mcu][fuse]
+    for index, values in enumerate(
+        itertools.product(*(golden["grid"][name] for name in names))
+    ):
+        yield dict(zip(names, values)), cells[index * 2 : index * 2 + 2]
+
+
+def calculate_cell(database, mcu, fuse, options):
+    try:
+        value = database.calculate(mcu, fuse, options)
+    except FuseError:
+        return "xx"
+    return "--" if value is None else "%02X" % value
+
+
+@pytest.mark.parametrize("fuse", FUSES)
+def test_matches_golden_table(load_fixture, fuse):
+    golden = load_fixture(GOLDEN_TABLE)
+    database = load_database()
+    mismatches = []
+    for mcu in sorted(golden["mcus"]):
+        for options, expected in iter_golden(golden, mcu, fuse):
+            actual = calculate_cell(database, mcu, fuse, options)
+            if actual != expected:
+                mismatches.append((mcu, options, expected, actual))
+    assert not mismatches, "%d mismatches, first: %s" % (
+        len(mismatches),
+        mismatches[:5],
+    )
+
+
+def test_bulk_api_matches_golden_table(load_fixture):
+    golden = load_fixture(GOLDEN_TABLE)
+    database = load_database()
+    names = sorted(golden["grid"])
+    options_list = [
+        dict(zip(names, values))
+        for values in itertools.product(*(golden["grid"][name] for name in names))
+    ]
+    for mcu in ("atmega328p", "atmega2560", "atmega1284p", "atmega168", "atmega8"):
+        expected = {
+            fuse: {
+                tuple(sorted(options.items())): cell
+                for options, cell in iter_golden(golden, mcu, fuse)
+            }
+            for fuse in FUSES
+        }
+        results = database.evaluate_many(mcu, options_list)
+        for options, result in zip(options_list, results):
+            for fuse in FUSES:
+                key = tuple(
+                    sorted((name, options[name]) for name in golden["options"][fuse])
+                )
+                value = result[fuse]
+                cell = "--" if value is None else "%02X" % value
+                assert cell == expected[fuse][key], (mcu, fuse, options)
+
+
+def test_compute_all_covers_known_values():
+    database = load_database()
+    results = database.compute_all("atmega328p")
+    assert results
+    for options, fuses in results:
+        assert fuses == database.calculate_all("atmega328p", options)
+
+
+@pytest.mark.parametrize(
+    "mcu, fuse, mask",
+    [
+        ("atmega328p", "efuse", 0x07),
+        ("atmega328p", "hfuse", 0xFF),
+        ("atmega328p", "lock", 0x3F),
+        ("attiny85", "lock", 0x03),
+        ("unknown", "efuse", 0xFF),
+    ],
+)
+def test_used_mask(mcu, fuse, mask):
+    assert load_database().get_used_mask(mcu, fuse) == mask
+
+
+def get_masks(mcu, expected):
+    return {name: load_database().get_used_mask(mcu, name) for name, _ in expected}
+
+
+def test_plan_ignores_unused_bits():
+    expected = [("lock", 0x0F), ("hfuse", 0xDE), ("lfuse", 0xFF), ("efuse", 0xFD)]
+    # Older avrdude versions read the unused bits as 0
+    current = dict(lock=0x0F, hfuse=0xDE, lfuse=0xFF, efuse=0x05)
+    changed, report = plan_fuses_update(
+        expected, current, True, get_masks("atmega328p", expected)
+    )
+    assert changed == []
+    assert report["erase"] is False
+    assert not any(item["written"] for item in report["fuses"].values())
+
+
+def test_plan_writes_changed_fuses():
+    expected = [("lock", 0x0F), ("hfuse", 0xDE), ("lfuse", 0xFF), ("efuse", 0xFD)]
+    current = dict(lock=0x0F, hfuse=0xDE, lfuse=0xF7, efuse=0x04)
+    changed, report = plan_fuses_update(
+        expected, current, True, get_masks("atmega328p", expected)
+    )
+    # The chip erase clears the lock bits, they are written again
+    assert changed == ["lock", "lfuse", "efuse"]
+    assert report["erase"] is True
+    assert report["fuses"]["lfuse"] == dict(
+        expected="0xff", current="0xf7", written=True
+    )
+
+
+def test_plan_without_erase():
+    expected = [("lock", 0x3F), ("hfuse", 0xDE), ("lfuse", 0xFF)]
+    current = dict(lock=0xFF, hfuse=0xD6, lfuse=None)
+    changed, report = plan_fuses_update(
+        expected, current, False, get_masks("atmega328p", expected)
+    )
+    assert changed == ["hfuse", "lfuse"]
+    assert report["erase"] is False
+    assert report["fuses"]["lfuse"]["current"] is None
+
+
+def test_plan_keeps_unlocked_chip_after_erase():
+    # 0x3F leaves the implemented lock bits unprogrammed, no rewrite needed
+    expected = [("lock", 0x3F), ("hfuse", 0xDE)]
+    changed, _ = plan_fuses_update(
+        expected,
+        dict(lock=0xFF, hfuse=0xDA),
+        True,
+        get_masks("atmega328p", expected),
+    )
+    assert changed == ["hfuse"]
@@ -0,0 +1,212 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import struct
+import sys
+
+import pytest
+
+from conftest import ROOT_DIR
+
+from avrtools import gpioreset
+
+# The sysfs and character device backends only exist on Linux, the fake
+# backend runs everywhere
+linux_only = pytest.mark.skipif(
+    not sys.platform.startswith("linux"), reason="GPIO lines are Linux only"
+)
+chardev_only = pytest.mark.skipif(
+    not sys.platform.startswith("linux") or gpioreset.fcntl is None,
+    reason="GPIO character devices are Linux only",
+)
+
+
+@pytest.fixture(autouse=True)
+def release_lines():
+    yield
+    gpioreset.release_all()
+
+
+@pytest.fixture
+def sysfs(tmp_path, monkeypatch):
+    """Exported GPIO lines of a fake sysfs tree"""
+    root = tmp_path / "gpio"
+    root.mkdir()
+    for name in ("export", "unexport"):
+        (root / name).write_text("")
+
+    def _export(pin):
+        line_dir = root / ("gpio%d" % pin)
+        line_dir.mkdir()
+        for name in ("direction", "value"):
+            (line_dir / name).write_text("")
+        return line_dir
+
+    monkeypatch.setattr(gpioreset, "SYSFS_ROOT", str(root))
+    return root, _export
+
+
+class FakeChardev:
+    """Handles the GPIO ioctls of `ChardevLine` on a regular file"""
+
+    def __init__(self, path):
+        self.path = path
+        self.requests = []
+        self.values = []
+
+    def ioctl(self, fd, request, buf):  # pylint: disable=unused-argument
+        if request == gpioreset.GPIO_GET_LINEHANDLE_IOCTL:
+            fields = list(struct.unpack(gpioreset.GPIOHANDLE_REQUEST_FORMAT, buf))
+            self.requests.append(fields)
+            fields[-1] = os.open(self.path, os.O_RDONLY)
+            buf[:] = struct.pack(gpioreset.GPIOHANDLE_REQUEST_FORMAT, *fields)
+        elif request == gpioreset.GPIOHANDLE_SET_LINE_VALUES_IOCTL:
+            self.values.append(buf[0])
+        return 0
+
+
+def test_reset_sequence_active_high():
+    reset = gpioreset.GpioReset(18, pulse_ms=50, backend="fake")
+    line = reset.pulse_reset()
+    assert [(action, value) for _, action, value in line.events] == [
+        ("request", 0),
+        ("set", 1),
+        ("set", 0),
+    ]
+    pulses = line.get_pulses()
+    assert pulses[1][0] == 1
+    assert 0.045 <= pulses[1][1] < 0.5
+
+
+def test_reset_sequence_active_low():
+    line = gpioreset.GpioReset(
+        5, polarity="low", pulse_ms=10, backend="fake"
+    ).pulse_reset()
+    assert [value for _, _, value in line.events] == [1, 0, 1]
+
+
+def test_line_stays_requested_between_resets():
+    reset = gpioreset.GpioReset(18, pulse_ms=1, backend="fake")
+    line = reset.pulse_reset()
+    assert gpioreset.GpioReset(18, pulse_ms=1, backend="fake").pulse_reset() is line
+    assert [action for _, action, _ in line.events].count("request") == 1
+    gpioreset.release_all()
+    assert not line.requested
+
+
+def test_invalid_config():
+    with pytest.raises(gpioreset.GpioError):
+        gpioreset.GpioReset(18, polarity="up")
+    with pytest.raises(gpioreset.GpioError):
+        gpioreset.GpioReset(18, backend="serial").get_line()
+    with pytest.raises(KeyError):
+        gpioreset.GpioReset.from_config({})
+
+
+@linux_only
+def test_sysfs_backend(sysfs):
+    root, export = sysfs
+    line_dir = export(22)
+    reset = gpioreset.GpioReset(22, pulse_ms=1, backend="sysfs")
+    line = reset.pulse_reset()
+    assert isinstance(line, gpioreset.SysfsLine)
+    # Output configured at the inactive level, the pulse ends inactive
+    assert (line_dir / "direction").read_text() == "low"
+    assert (line_dir / "value").read_text() == "0"
+    gpioreset.release_all()
+    assert (root / "unexport").read_text() == "22"
+
+
+@linux_only
+def test_sysfs_export(sysfs):
+    root, _ = sysfs
+    # Without a kernel the export does not create the line
+    with pytest.raises(gpioreset.GpioError):
+        gpioreset.GpioReset(4, backend="sysfs").get_line()
+    assert (root / "export").read_text() == "4"
+
+
+@chardev_only
+def test_chardev_backend(tmp_path, monkeypatch):
+    chip = tmp_path / "gpiochip0"
+    chip.write_text("")
+    chardev = FakeChardev(str(chip))
+    monkeypatch.setattr(gpioreset.fcntl, "ioctl", chardev.ioctl)
+    line = gpioreset.GpioReset(
+        18, pulse_ms=1, backend="chardev", chip=str(chip)
+    ).pulse_reset()
+    assert isinstance(line, gpioreset.ChardevLine)
+    request = chardev.requests[0]
+    max_lines = gpioreset.GPIOHANDLES_MAX
+    assert request[0] == 18
+    assert request[max_lines] == gpioreset.GPIOHANDLE_REQUEST_OUTPUT
+    # Requested at the inactive level
+    assert request[max_lines + 1] == 0
+    assert request[-2] == 1
+    assert chardev.values == [1, 0]
+
+
+@chardev_only
+def test_auto_prefers_chardev(tmp_path, monkeypatch, sysfs):
+    chip = tmp_path / "gpiochip0"
+    chip.write_text("")
+    monkeypatch.setattr(gpioreset.fcntl, "ioctl", FakeChardev(str(chip)).ioctl)
+    _, export = sysfs
+    export(18)
+    line = gpioreset.get_line("auto", 18, str(chip))
+    assert isinstance(line, gpioreset.ChardevLine)
+
+
+@chardev_only
+def test_auto_falls_back_to_sysfs(tmp_path, monkeypatch, sysfs):
+    chip = tmp_path / "gpiochip0"
+    chip.write_text("")
+
+    def _ioctl(*_):
+        raise OSError("Inappropriate ioctl for device")
+
+    monkeypatch.setattr(gpioreset.fcntl, "ioctl", _ioctl)
+    _, export = sysfs
+    export(18)
+    line = gpioreset.get_line("auto", 18, str(chip))
+    assert isinstance(line, gpioreset.SysfsLine)
+    # Without a chip device only sysfs is tried
+    gpioreset.release_all()
+    line = gpioreset.get_line("auto", 18, str(tmp_path / "missing"))
+    assert isinstance(line, gpioreset.SysfsLine)
+
+
+def test_chardev_without_fcntl(tmp_path, monkeypatch):
+    monkeypatch.setattr(gpioreset, "fcntl", None)
+    chip = tmp_path / "gpiochip0"
+    chip.write_text("")
+    with pytest.raises(gpioreset.GpioError):
+        gpioreset.get_line("chardev", 18, str(chip))
+
+
+@pytest.mark.parametrize(
+    "board, pin", [("raspduino", 18), ("emonpi", 4), ("sleepypi", 22)]
+)
+def test_board_reset_pins(board, pin):
+    with open(
+        os.path.join(ROOT_DIR, "boards", "%s.json" % board), encoding="utf8"
+    ) as fp:
+        config = json.load(fp)["upload"]["reset_gpio"]
+    reset = gpioreset.GpioReset.from_config(dict(config, backend="fake"))
+    # The hard-coded sequence drove the pin high, then low
+    assert reset.pin == pin
+    assert reset.active_value == 1
+    assert reset.pulse == 0.1
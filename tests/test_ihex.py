@@ -0,0 +1,108 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+#
+# `fixtures/ihex` holds two programs linked from the `.c` and `.ld` files
+# next to them and the Intel HEX files objcopy writes for them:
+#
+#   small.elf   atmega328p, .data behind .text, .eeprom at 0x810000
+#   large.elf   atmega2560, no .eeprom, sections across the 64 KB segments
+#               at 0x1FFE0 and 0x3FF00, entry point 0x4
+#
+#   zig cc -target avr-freestanding-none -mmcu=<mcu> -Os -nostdlib \
+#       -Wl,-T,X.ld -Wl,--entry=main -o X.elf X.c
+#   objcopy -O ihex -R .eeprom X.elf X.hex
+#   objcopy -O ihex -j .eeprom --set-section-flags=.eeprom="alloc,load" \
+#       --no-change-warnings --change-section-lma .eeprom=0 X.elf X.eep
+#   objcopy -O ihex -j .eeprom small.elf small-eeprom.hex
+#
+
+import os
+
+import pytest
+
+from conftest import FIXTURES_DIR
+from avrtools import elf, ihex
+
+
+def get_fixture_path(name):
+    return os.path.join(FIXTURES_DIR, "ihex", name)
+
+
+def read_fixture(name):
+    with open(get_fixture_path(name), encoding="ascii", newline="") as fp:
+        return fp.read()
+
+
+@pytest.mark.parametrize("name", ["small", "large"])
+def test_hex_matches_objcopy(name):
+    firmware = elf.load_elf(get_fixture_path(name + ".elf"))
+    assert ihex.format_ihex(
+        firmware.get_load_segments(exclude=[".eeprom"]), firmware.entry
+    ) == read_fixture(name + ".hex")
+
+
+@pytest.mark.parametrize("name", ["small", "large"])
+def test_eep_matches_objcopy(name):
+    firmware = elf.load_elf(get_fixture_path(name + ".elf"))
+    assert ihex.format_ihex(
+        firmware.get_load_segments(include=[".eeprom"], change_lma={".eeprom": 0}),
+        firmware.entry,
+    ) == read_fixture(name + ".eep")
+
+
+def test_extended_linear_address():
+    # Without the rebase the EEPROM stays above 1 MB, a type 04 record
+    firmware = elf.load_elf(get_fixture_path("small.elf"))
+    text = ihex.format_ihex(
+        firmware.get_load_segments(include=[".eeprom"]), firmware.entry
+    )
+    assert text == read_fixture("small-eeprom.hex")
+    assert text.startswith(":02000004008179\r\n")
+
+
+def test_load_addresses():
+    firmware = elf.load_elf(get_fixture_path("small.elf"))
+    text_size = firmware.get_section(".text").size
+    data = firmware.get_section(".data")
+    assert data.addr == 0x800100
+    assert data.lma == text_size
+    segments = dict(firmware.get_load_segments())
+    assert segments[text_size] == firmware.get_contents(data)
+    assert segments[0x810000] == bytes([1, 2, 3, 4, 5, 6])
+
+
+def test_large_image():
+    firmware = elf.load_elf(get_fixture_path("large.elf"))
+    assert firmware.get_section(".eeprom") is None
+    assert firmware.entry == 4
+    image = ihex.read_ihex(get_fixture_path("large.hex"))
+    assert dict(image)[0x3FF00] == bytes([0xDE, 0xAD, 0xBE, 0xEF])
+    pages = ihex.to_pages(image, 256)
+    assert sorted(pages) == [0, 0x1FF00, 0x20000, 0x3FF00]
+    assert pages[0x1FF00][0xE0:] == bytes(range(1, 33))
+    assert pages[0x20000][:16] == bytes(range(33, 49))
+    assert pages[0x20000][16:] == bytes([0xFF] * 240)
+
+
+def test_record_size():
+    text = ihex.format_ihex([(0x10, bytes(range(40)))])
+    lengths = [int(line[1:3], 16) for line in text.splitlines()]
+    assert lengths == [16, 16, 8, 0]
+    assert ihex.parse_ihex(text) == [(0x10, bytes(range(40)))]
+
+
+def test_invalid_checksum():
+    with pytest.raises(ihex.IHexError):
+        ihex.parse_ihex(":0400000300000004F4\n:00000001FF\n")
@@ -0,0 +1,126 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+import time
+
+import pytest
+
+from avrtools import multiupload
+
+# Stands in for avrdude, the behaviour depends on the port name
+FAKE_AVRDUDE = """
+import sys, time
+port = sys.argv[sys.argv.index("-P") + 1]
+print("avrdude: writing flash on %s" % port)
+if "hang" in port:
+    time.sleep(10)
+if "slow" in port:
+    time.sleep(0.5)
+if "fail" in port:
+    print("avrdude: stk500_recv(): programmer is not responding")
+    sys.exit(1)
+print("avrdude done.  Thank you.")
+"""
+
+
+@pytest.fixture
+def avrdude(tmp_path):
+    script = tmp_path / "avrdude.py"
+    script.write_text(FAKE_AVRDUDE)
+
+    def _command(port):
+        return '"%s" "%s" -P %s' % (sys.executable, script, port)
+
+    return _command
+
+
+def test_resolve_ports(tmp_path):
+    for name in ("ttyUSB0", "ttyUSB1", "ttyACM0"):
+        (tmp_path / name).touch()
+    pattern = str(tmp_path / "ttyUSB*")
+    assert multiupload.resolve_ports("%s, COM*" % pattern, ["COM3", "COM4"]) == [
+        str(tmp_path / "ttyUSB0"),
+        str(tmp_path / "ttyUSB1"),
+        "COM3",
+        "COM4",
+    ]
+    assert multiupload.resolve_ports(["COM3", "COM3"]) == ["COM3"]
+
+
+def test_failed_port_does_not_stop_others(avrdude):
+    ports = ["ok0", "fail1", "ok2", "slow3"]
+    reported = []
+    results = multiupload.run_parallel(
+        {port: avrdude(port) for port in ports},
+        jobs=2,
+        on_result=lambda result: reported.append(result["port"]),
+    )
+    assert [result["port"] for result in results] == ports
+    assert [result["success"] for result in results] == [True, False, True, True]
+    assert results[1]["returncode"] == 1
+    assert "not responding" in results[1]["log"]
+    assert "Thank you" in results[0]["log"]
+    assert sorted(reported) == sorted(ports)
+    assert all(result["elapsed"] >= 0 for result in results)
+
+
+def test_timeout(avrdude):
+    started = time.monotonic()
+    results = multiupload.run_parallel(
+        {"hang0": avrdude("hang0"), "ok1": avrdude("ok1")}, timeout=2
+    )
+    assert time.monotonic() - started < 20
+    assert results[0]["success"] is False
+    assert "Timed out after 2" in results[0]["log"]
+    assert results[1]["success"] is True
+
+
+def test_failing_worker_is_reported_per_port(avrdude, monkeypatch):
+    run_command = multiupload._run_command  # pylint: disable=protected-access
+
+    def _run_command(port, cmd, timeout):
+        if port == "broken":
+            raise TypeError("unexpected")
+        return run_command(port, cmd, timeout)
+
+    monkeypatch.setattr(multiupload, "_run_command", _run_command)
+    results = multiupload.run_parallel(
+        {"broken": avrdude("broken"), "ok": avrdude("ok")}
+    )
+    assert results[0]["success"] is False
+    assert "unexpected" in results[0]["log"]
+    assert results[1]["success"] is True
+
+
+@pytest.mark.parametrize(
+    "value, expected", [(None, None), ("", None), ("30", 30.0), (" 2.5 ", 2.5)]
+)
+def test_parse_timeout(value, expected):
+    assert multiupload.parse_timeout(value) == expected
+
+
+@pytest.mark.parametrize("value", ["abc", "0", "-1"])
+def test_parse_timeout_invalid(value):
+    with pytest.raises(ValueError):
+        multiupload.parse_timeout(value)
+
+
+def test_parse_jobs():
+    assert multiupload.parse_jobs(None) == multiupload.MAX_JOBS
+    assert multiupload.parse_jobs("4") == 4
+    assert multiupload.parse_jobs("1000") == multiupload.MAX_JOBS
+    for value in ("x", "0"):
+        with pytest.raises(ValueError):
+            multiupload.parse_jobs(value)
@@ -0,0 +1,137 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+
+from avrtools import portwatch
+
+LEONARDO_HWIDS = [["0x2341", "0x0036"], ["0x2341", "0x8036"]]
+LEONARDO_HWID = "USB VID:PID=2341:0036 SER=HIDPC LOCATION=1-1:1.0"
+
+
+def test_parse_hwids():
+    assert portwatch.parse_hwid(LEONARDO_HWID) == (0x2341, 0x0036)
+    assert portwatch.parse_hwid("n/a") is None
+    assert portwatch.parse_board_hwids(LEONARDO_HWIDS + [["bad"]]) == {
+        (0x2341, 0x0036),
+        (0x2341, 0x8036),
+    }
+
+
+def test_parse_uevent():
+    data = b"add@/devices/usb1/tty/ttyACM1\0ACTION=add\0SUBSYSTEM=tty\0DEVNAME=ttyACM1"
+    assert portwatch.parse_uevent(data) == dict(
+        ACTION="add", SUBSYSTEM="tty", DEVNAME="ttyACM1"
+    )
+
+
+def test_simulated_port_appears():
+    source = portwatch.SimulatedSource()
+    watcher = portwatch.PortWatcher(
+        portwatch.parse_board_hwids(LEONARDO_HWIDS), source=source
+    ).start()
+    source.add("/dev/ttyUSB5", 0x0403, 0x6001, delay=0.05)
+    source.add("/dev/ttyACM1", 0x2341, 0x0036, delay=0.1)
+    started = time.monotonic()
+    assert watcher.wait(timeout=5) == "/dev/ttyACM1"
+    # Returns on the event, not at the end of the timeout
+    assert time.monotonic() - started < 2
+
+
+def test_simulated_port_without_hwid_matches():
+    source = portwatch.SimulatedSource()
+    watcher = portwatch.PortWatcher({(0x2341, 0x0036)}, source=source).start()
+    source.add("/dev/ttyACM0")
+    assert watcher.wait(timeout=1) == "/dev/ttyACM0"
+
+
+def test_simulated_timeout():
+    source = portwatch.SimulatedSource()
+    watcher = portwatch.PortWatcher({(0x2341, 0x0036)}, source=source).start()
+    source.add("/dev/ttyUSB5", 0x0403, 0x6001)
+    started = time.monotonic()
+    assert watcher.wait(timeout=0.3) is None
+    assert 0.25 <= time.monotonic() - started < 2
+
+
+class FakePorts:
+    """Port list of `list_serial_ports()` changed from another thread"""
+
+    def __init__(self, ports):
+        self.ports = list(ports)
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        with self.lock:
+            return list(self.ports)
+
+    def replace(self, ports, delay):
+        def _replace():
+            time.sleep(delay)
+            with self.lock:
+                self.ports = list(ports)
+
+        threading.Thread(target=_replace, daemon=True).start()
+
+
+def test_polling_fallback_detects_new_port():
+    before = [
+        dict(port="/dev/ttyUSB0", hwid="USB VID:PID=0403:6001"),
+        dict(port="/dev/ttyACM0", hwid=LEONARDO_HWID),
+    ]
+    ports = FakePorts(before)
+    watcher = portwatch.PortWatcher(
+        {(0x2341, 0x0036)}, ports, source=portwatch.PollingSource(interval=0.02)
+    ).start()
+    # The sketch port goes away on reset, the bootloader enumerates as a
+    # new port next to an unrelated one
+    ports.replace(
+        [
+            dict(port="/dev/ttyUSB0", hwid="USB VID:PID=0403:6001"),
+            dict(port="/dev/ttyUSB1", hwid="USB VID:PID=0403:6001"),
+            dict(port="/dev/ttyACM1", hwid=LEONARDO_HWID),
+        ],
+        delay=0.1,
+    )
+    assert watcher.wait(timeout=5) == "/dev/ttyACM1"
+
+
+def test_polling_fallback_timeout():
+    ports = FakePorts([dict(port="/dev/ttyACM0", hwid=LEONARDO_HWID)])
+    watcher = portwatch.PortWatcher(
+        {(0x2341, 0x0036)}, ports, source=portwatch.PollingSource(interval=0.02)
+    ).start()
+    assert watcher.wait(timeout=0.2) is None
+
+
+def test_default_source_falls_back_to_polling(monkeypatch):
+    def _start(_):
+        raise OSError("no netlink")
+
+    monkeypatch.setattr(portwatch.NetlinkSource, "start", _start)
+    watcher = portwatch.PortWatcher(list_ports=lambda: []).start()
+    assert isinstance(watcher.source, portwatch.PollingSource)
+    watcher.close()
+
+
+def test_windows_port_is_ready_at_once():
+    started = time.monotonic()
+    assert portwatch.wait_until_ready("COM5", timeout=1.0)
+    assert time.monotonic() - started < 0.5
+
+
+def test_device_node_waits_for_access(monkeypatch):
+    monkeypatch.setattr(portwatch.os, "access", lambda path, mode: False)
+    assert not portwatch.wait_until_ready("/dev/ttyACM9", timeout=0.1)
@@ -0,0 +1,51 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from avrtools import simavrpool
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        (None, 0),
+        ("", 0),
+        (0, 0),
+        ("2", 2),
+        (" 3 ", 3),
+        (1000, simavrpool.MAX_POOL_SIZE),
+    ],
+)
+def test_parse_pool_size(value, expected):
+    assert simavrpool.parse_pool_size(value) == expected
+
+
+@pytest.mark.parametrize("value", ["two", "1.5", "-1"])
+def test_parse_invalid_pool_size(value):
+    with pytest.raises(ValueError, match="Invalid simavr pool size"):
+        simavrpool.parse_pool_size(value)
+
+
+def test_disabled_pool(tmp_path):
+    pool = simavrpool.ServerPool(str(tmp_path), "simavr", "atmega328p", "16000000", 0)
+    assert pool.acquire() is None
+    assert not list(tmp_path.iterdir())
+
+
+@pytest.mark.parametrize(
+    "value, expected", [(":1234", 1234), ("localhost:3333", 3333), ("", None)]
+)
+def test_parse_port(value, expected):
+    assert simavrpool.parse_port(value) == expected
@@ -0,0 +1,137 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+import pytest
+
+from conftest import FIXTURES_DIR
+
+from avrtools import budgets, elf, sizereport
+
+MAP_PATH = os.path.join(FIXTURES_DIR, "sizereport", "firmware.map")
+PROJECT_DIR = os.path.join(os.sep, "project")
+BUILD_DIR = os.path.join(PROJECT_DIR, ".pio", "build", "uno")
+
+TEXT = elf.ElfSection(".text", 1, elf.SHF_ALLOC | 0x4, 0, 0, 0x1AA)
+DATA = elf.ElfSection(".data", 1, elf.SHF_ALLOC | 0x1, 0x800100, 0, 0x8)
+BSS = elf.ElfSection(".bss", elf.SHT_NOBITS, elf.SHF_ALLOC | 0x1, 0x800108, 0, 0x20)
+
+
+class FakeElf:
+    """Sections and symbols of the program linked with `firmware.map`"""
+
+    data = b"firmware"
+    sections = [TEXT, DATA, BSS]
+
+    @staticmethod
+    def get_symbols():
+        return [
+            elf.ElfSymbol("__vectors", 0x0, 0, 0, 1, TEXT),
+            elf.ElfSymbol("main", 0x78, 0x40, elf.STT_FUNC, 1, TEXT),
+            elf.ElfSymbol("_ZN5Servo6attachEi", 0xB8, 0x30, elf.STT_FUNC, 1, TEXT),
+            elf.ElfSymbol("counter", 0x800108, 4, elf.STT_OBJECT, 1, BSS),
+            elf.ElfSymbol("servos", 0x800110, 0x18, elf.STT_OBJECT, 1, BSS),
+        ]
+
+
+@pytest.fixture
+def report():
+    # No `avr-c++filt` in the search path, the names stay mangled
+    return sizereport.create_report(
+        FakeElf(), MAP_PATH, PROJECT_DIR, BUILD_DIR, path=os.devnull
+    )
+
+
+def test_parse_map():
+    with open(MAP_PATH, encoding="utf8") as fp:
+        sections, loaded = sizereport.parse_map(fp)
+    assert len(loaded) == 5
+    assert loaded[1] == ".pio/build/uno/src/main.cpp.o"
+    # The long section names are followed by the address on the next line,
+    # the empty sections and `.comment` are left out
+    assert sections[3] == (
+        "text",
+        0xB8,
+        0x30,
+        ".pio/build/uno/lib7a3/libServo.a(Servo.cpp.o)",
+    )
+    assert ("text", 0x1A4, 2, None) in sections
+    assert sum(size for category, _, size, _ in sections if category == "bss") == 32
+    assert len(sections) == 12
+
+
+def test_library_attribution(report):
+    assert report["totals"] == dict(text=0x1AA, data=8, bss=32)
+    assert report["libraries"] == {
+        "src": dict(text=80, data=6, bss=4),
+        "FrameworkArduino": dict(text=148, data=2, bss=4),
+        # `lib7a3/libServo.a` of the build directory
+        "Servo": dict(text=48, data=0, bss=24),
+        "libgcc": dict(text=40, data=0, bss=0),
+        "toolchain": dict(text=104, data=0, bss=0),
+        # The fill and the end of `.text` not covered by the map
+        "(linker)": dict(text=6, data=0, bss=0),
+    }
+    for category in sizereport.CATEGORIES:
+        assert (
+            sum(sizes[category] for sizes in report["libraries"].values())
+            == report["totals"][category]
+        )
+
+
+def test_objects_and_symbols(report):
+    assert report["objects"]["libFrameworkArduino.a(wiring.c.o)"]["library"] == (
+        "FrameworkArduino"
+    )
+    assert report["objects"]["crtatmega328p.o"]["text"] == 104
+    assert report["symbols"]["servos@libServo.a(Servo.cpp.o)"] == dict(
+        name="servos", object="libServo.a(Servo.cpp.o)", section="bss", size=24
+    )
+    assert "__vectors@(linker)" not in report["symbols"]
+
+
+def test_without_map():
+    report = sizereport.create_report(
+        FakeElf(), None, PROJECT_DIR, BUILD_DIR, with_symbols=False
+    )
+    assert report["libraries"] == {"(linker)": dict(text=0x1AA, data=8, bss=32)}
+    assert not report["symbols"]
+
+
+@pytest.mark.parametrize(
+    "item, expected",
+    [
+        (dict(text=100, data=6, bss=4), (106, 10)),
+        (dict(name="servos", section="bss", size=24), (0, 24)),
+        ({}, (0, 0)),
+    ],
+)
+def test_get_usage(item, expected):
+    assert sizereport.get_usage(item) == expected
+
+
+def test_library_budgets(report):
+    usage = dict(
+        sections={".text": 0x1AA, ".data": 8, ".bss": 32},
+        program=dict(size=0x1AA + 8),
+        data=dict(size=40),
+    )
+    metrics = budgets.get_metrics(usage, report["libraries"])
+    assert metrics["Servo"] == 48
+    assert metrics["Servo.ram"] == 24
+    assert metrics["FrameworkArduino"] == 150
+    assert budgets.check_budgets(metrics, {"Servo.ram": 16, "src": 100}) == [
+        ("Servo.ram", 24, 16)
+    ]
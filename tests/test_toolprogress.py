@@ -0,0 +1,227 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import itertools
+
+import pytest
+
+from avrtools import toolprogress
+
+BAR = "#" * 50
+
+# avrdude prints the bars of a pipe one `#` at a time
+AVRDUDE_UPLOAD = """\
+avrdude -v -p atmega328p -c arduino -b 115200 -D -P /dev/ttyACM0 -U flash:w:a.hex:i
+avrdude: stk500_recv(): programmer is not responding
+avrdude: stk500_getsync() attempt 1 of 10: not in sync: resp=0x00
+avrdude: stk500_recv(): programmer is not responding
+avrdude: stk500_getsync() attempt 2 of 10: not in sync: resp=0x00
+avrdude: AVR device initialized and ready to accept instructions
+
+Reading | {bar} | 100% 0.00s
+
+avrdude: Device signature = 0x1e950f (probably m328p)
+avrdude: reading input file "a.hex"
+avrdude: writing flash (924 bytes):
+
+Writing | {bar} | 100% 0.15s
+
+avrdude: 924 bytes of flash written
+avrdude: verifying flash memory against a.hex:
+avrdude: load data flash data from input file a.hex:
+avrdude: input file a.hex contains 924 bytes
+avrdude: reading on-chip flash data:
+
+Reading | {bar} | 100% 0.12s
+
+avrdude: verifying ...
+avrdude: 924 bytes of flash verified
+
+avrdude done.  Thank you.
+
+""".format(
+    bar=BAR
+)
+
+MICRONUCLEUS_UPLOAD = """\
+micronucleus --run .pio/build/digispark-tiny/firmware.hex
+> Please plug in the device ...
+> Press CTRL+C to terminate the program.
+> Device is found!
+connecting: 33% complete
+> Device has firmware version 1.6
+> Available space for user applications: 6012 bytes
+parsing: 50% complete
+> Erasing the memory ...
+erasing: 55% complete
+erasing: 60% complete
+> Starting to upload ...
+writing: 70% complete
+writing: 85% complete
+> Starting the user app ...
+running: 100% complete
+>> Micronucleus done. Thank you!
+"""
+
+
+def parse(chunks, expected_bytes=None):
+    """Feeds output chunks, the clock advances by 0.5 s at every reading"""
+    events = []
+    ticks = itertools.count()
+    parser = toolprogress.ProgressParser(
+        events.append, expected_bytes, clock=lambda: next(ticks) * 0.5
+    )
+    for chunk in chunks:
+        parser.feed(chunk)
+    return events, parser.close()
+
+
+def split(text, size):
+    return [text[pos : pos + size] for pos in range(0, len(text), size)]
+
+
+def select(events, event_type):
+    return [event for event in events if event["type"] == event_type]
+
+
+def test_avrdude_upload():
+    events, summary = parse([AVRDUDE_UPLOAD])
+    assert [event["type"] for event in events if event["type"] != "progress"] == [
+        "session_start",
+        "sync",
+        "phase_start",
+        "phase_end",
+        "phase_start",
+        "phase_end",
+        "session_end",
+    ]
+    assert select(events, "sync")[0]["retries"] == 2
+    write, verify = summary["phases"]
+    assert (write["phase"], write["memory"], write["bytes"]) == ("write", "flash", 924)
+    # The size of verification is known only from its result
+    assert select(events, "phase_start")[1]["bytes"] is None
+    assert (verify["phase"], verify["bytes"]) == ("verify", 924)
+    assert write["throughput"] == 924 / write["elapsed"]
+    assert summary["sessions"] == 1
+    assert summary["retries"] == 2
+    assert not summary["errors"]
+
+
+def test_avrdude_bar_progress():
+    events, _ = parse([AVRDUDE_UPLOAD])
+    progress = select(events, "progress")
+    # The bar of the signature read runs before any phase
+    assert [event["percent"] for event in progress if event["phase"] == "write"] == [
+        10,
+        20,
+        30,
+        40,
+        50,
+        60,
+        70,
+        80,
+        90,
+        100,
+    ]
+    assert len([event for event in progress if event["phase"] == "verify"]) == 10
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 64, 1000])
+def test_chunked_output(size):
+    # Event timestamps are included, so even the clock readings must match
+    assert parse(split(AVRDUDE_UPLOAD, size)) == parse([AVRDUDE_UPLOAD])
+
+
+def test_line_split_across_chunks():
+    text = "avrdude: writing flash (924 bytes):\navrdude: 924 bytes of flash written\n"
+    pos = text.index("of flash")
+    events, summary = parse(["avrdude: wri", text[12:pos], text[pos:]])
+    assert select(events, "phase_start")[0]["bytes"] == 924
+    assert summary["phases"][0]["bytes"] == 924
+    # The end of the output completes an unterminated line
+    _, summary = parse([text.rstrip("\n")])
+    assert summary["phases"][0]["elapsed"] is not None
+
+
+def test_crlf_output():
+    assert parse([AVRDUDE_UPLOAD.replace("\n", "\r\n")]) == parse([AVRDUDE_UPLOAD])
+
+
+def test_fuses_session():
+    events, summary = parse(
+        [
+            "Setting fuses\n",
+            "avrdude -p atmega328p -c usbasp -U efuse:w:0xfd:m\n",
+            "avrdude: AVR device initialized and ready to accept instructions\n",
+            "avrdude: writing efuse (1 bytes):\n",
+            "avrdude: 1 bytes of efuse written\n",
+            "avrdude done.  Thank you.\n",
+        ]
+    )
+    # The action description and the command line are one run
+    assert len(select(events, "session_start")) == 1
+    assert summary["phases"][0]["memory"] == "efuse"
+    assert summary["phases"][0]["bytes"] == 1
+    # Fuses are not reported as an upload
+    assert toolprogress.format_summary(summary) is None
+
+
+def test_micronucleus_upload():
+    events, summary = parse([MICRONUCLEUS_UPLOAD], expected_bytes=700)
+    assert select(events, "session_start")[0]["tool"] == "micronucleus"
+    assert [(item["phase"], item["bytes"]) for item in summary["phases"]] == [
+        ("erase", None),
+        ("write", 700),
+    ]
+    assert [
+        (event["phase"], event["percent"]) for event in select(events, "progress")
+    ] == [
+        ("erase", 55),
+        ("erase", 60),
+        ("write", 70),
+        ("write", 85),
+    ]
+    assert summary["sync"] == 1.0
+
+
+def test_errors():
+    events, summary = parse(
+        [
+            "avrdude: verifying ...\n",
+            "avrdude: verification error, first mismatch at byte 0x0000\n",
+            "         0x0c != 0xff\n",
+            "avrdude: verification error; content mismatch\n",
+            "avrdude done.  Thank you.\n",
+        ]
+    )
+    assert summary["errors"] == [
+        "avrdude: verification error, first mismatch at byte 0x0000",
+        "avrdude: verification error; content mismatch",
+    ]
+    assert len(select(events, "error")) == 2
+
+
+def test_unrelated_output():
+    events, summary = parse(["Looking for upload port...\n", "Auto-detected: COM3\n"])
+    assert not events
+    assert summary["sessions"] == 0
+
+
+def test_format_summary():
+    _, summary = parse([AVRDUDE_UPLOAD])
+    assert toolprogress.format_summary(summary) == (
+        "write flash 924 bytes in 6.00 s (154 B/s), "
+        "verify flash 924 bytes in 6.00 s (154 B/s), "
+        "sync 1.00 s, sync retries: 2"
+    )